@@ -0,0 +1,198 @@
+from typing import Dict, Any
+from google.cloud.discoveryengine import (
+    SearchServiceAsyncClient,
+    ConversationalSearchServiceAsyncClient,
+    )
+
+from engines import Engines
+from deadlines import Deadline, acall_with_deadline
+from timing import span
+
+class AsyncEngines(Engines):
+    """
+    An asyncio counterpart of Engines built on the async Discovery Engine clients.
+
+    Requests are built with the same helpers as Engines; only the RPCs differ.
+    Async gRPC channels are bound to the event loop they were created on, so
+    an instance must only be used from one event loop, the one serving the
+    function in ASGI mode.
+    """
+
+    async def ahedge(self, operation: str, fn):
+        """
+        Awaits fn through the hedge policy, if one is configured. See Engines.hedge.
+
+        Args:
+            operation (str): The operation name, e.g. "search" or "answer".
+            fn (Callable[[], Awaitable[Any]]): Returns the idempotent coroutine to await.
+
+        Returns:
+            Any: The result of the coroutine.
+        """
+        if self.hedge_policy is None:
+            return await fn()
+        return await self.hedge_policy.acall(operation, fn)
+
+    def get_search_client(self, serving_config: str) -> SearchServiceAsyncClient:
+        """
+        Returns a pooled SearchServiceAsyncClient for the serving config's endpoint.
+
+        Args:
+            serving_config (str): The serving config resource name.
+
+        Returns:
+            SearchServiceAsyncClient: A client shared across requests on this instance.
+        """
+        client_options = self._client_options_discovery_engine(serving_config)
+        return self.pool.get(
+            SearchServiceAsyncClient, credentials=self.creds, client_options=client_options
+        )
+
+    def get_conversational_client(
+        self, serving_config: str
+    ) -> ConversationalSearchServiceAsyncClient:
+        """
+        Returns a pooled ConversationalSearchServiceAsyncClient for the serving config's endpoint.
+
+        Args:
+            serving_config (str): The serving config resource name.
+
+        Returns:
+            ConversationalSearchServiceAsyncClient: A client shared across requests on this instance.
+        """
+        client_options = self._client_options_discovery_engine(serving_config)
+        return self.pool.get(
+            ConversationalSearchServiceAsyncClient,
+            credentials=self.creds,
+            client_options=client_options,
+        )
+
+    async def query_by_search(
+        self,
+        search_config: Dict[str, Any],
+        total_results: int = 10,
+        deadline: Deadline = None):
+        """
+        Performs a search against an indexed Vertex Data Store.
+
+        Args:
+            search_config (Dict[str, Any]): See Engines.query_by_search.
+            total_results (int, optional): Total number of results to return. Defaults to 10.
+            deadline (Deadline, optional): The request deadline bounding the RPC and its retries. Defaults to None.
+
+        Returns:
+            A List of SearchResponse objects.
+        """
+        with span("build_request"):
+            request = self.build_search_request(search_config)
+        return await self.run_search(request, total_results, deadline)
+
+    async def query_by_profile(
+        self,
+        profile,
+        query: str,
+        total_results: int = None,
+        deadline: Deadline = None,
+        **request_fields):
+        """
+        Performs a search with a compiled SearchProfile.
+
+        Args:
+            profile (SearchProfile): The compiled static search configuration.
+            query (str): The search query string.
+            total_results (int, optional): Total number of results to return. Defaults to the profile's value.
+            deadline (Deadline, optional): The request deadline bounding the RPC and its retries. Defaults to None.
+            **request_fields: Per-request fields accepted by SearchProfile.build_request.
+
+        Returns:
+            A List of SearchResponse objects.
+        """
+        with span("build_request"):
+            request = profile.build_request(query, **request_fields)
+        return await self.run_search(request, total_results or profile.total_results, deadline)
+
+    async def run_search(
+        self,
+        request,
+        total_results: int = 10,
+        deadline: Deadline = None):
+        """
+        Sends a SearchRequest and collects the results.
+
+        Args:
+            request (SearchRequest): The request to send to the Search API.
+            total_results (int, optional): Total number of results to return. Defaults to 10.
+            deadline (Deadline, optional): The request deadline bounding the RPC and its retries. Defaults to None.
+
+        Returns:
+            A List of SearchResponse objects.
+        """
+        client = self.get_search_client(request.serving_config)
+
+        async def search():
+            response = await acall_with_deadline(client.search, request, deadline)
+
+            all_results = []
+            async for search_result in response:
+                if len(all_results) < total_results:
+                    all_results.append(search_result)
+                else:
+                    break
+
+            return all_results
+
+        with span("rpc"):
+            return await self.ahedge("search", search)
+
+    async def query_by_answer(
+        self,
+        answer_config: Dict[str, Any],
+        total_results: int = 10,
+        related_question: bool = False,
+        deadline: Deadline = None):
+        """
+        Queries for an answer and related questions using Discovery Engine's AnswerQuery API.
+
+        Args:
+            answer_config (Dict[str, Any]): See Engines.query_by_answer.
+            total_results (int, optional): The total number of results to return. Defaults to 10.
+            related_question (bool, optional): Whether to enable related questions in the response. Defaults to False.
+            deadline (Deadline, optional): The request deadline bounding the RPC and its retries. Defaults to None.
+
+        Returns:
+            google.cloud.discoveryengine_v1beta.types.AnswerQueryResponse: The response from the AnswerQuery API.
+        """
+        with span("build_request"):
+            request = self.build_answer_request(answer_config, related_question)
+        client = self.get_conversational_client(request.serving_config)
+        with span("rpc"):
+            response = await self.ahedge(
+                "answer", lambda: acall_with_deadline(client.answer_query, request, deadline)
+            )
+        return response
+
+    async def query_by_conversation(
+        self,
+        conv_config: Dict[str, Any],
+        conversation: "types.conversation" = None,
+        deadline: Deadline = None,
+        ):
+        """
+        Queries for a conversation using Discovery Engine's ConverseConversation API.
+
+        Args:
+            conv_config (Dict[str, Any]): See Engines.query_by_conversation.
+            conversation (google.cloud.discoveryengine_v1beta.types.conversation, optional): An existing Conversation object.
+                Defaults to None.
+            deadline (Deadline, optional): The request deadline bounding the RPC and its retries. Defaults to None.
+
+        Returns:
+            google.cloud.discoveryengine_v1beta.types.ConverseConversationResponse: The response from the ConverseConversation API.
+        """
+        with span("build_request"):
+            request = self.build_conversation_request(conv_config, conversation)
+        client = self.get_conversational_client(request.serving_config)
+        with span("rpc"):
+            response = await acall_with_deadline(client.converse_conversation, request, deadline)
+
+        return response
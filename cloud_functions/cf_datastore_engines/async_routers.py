@@ -0,0 +1,328 @@
+import os
+import asyncio
+import logging
+import threading
+from typing import Optional, Dict, Any
+
+from async_engines import AsyncEngines
+from federated import get_datastore_ids, afederated_search
+from cache import response_cache, CACHE_ENABLED
+from deadlines import Deadline
+from singleflight import single_flight
+from hedging import HedgePolicy
+from breaker import acall_backend, record_fallback
+from timing import span
+from routers import (
+    get_utterance,
+    get_cached_answer,
+    has_fallback_budget,
+    get_search_profile,
+    get_search_profiles,
+    prefetch_related_questions,
+    build_answer_config,
+    build_conv_config,
+    parse_search_results,
+    parse_answer_response,
+    parse_conversation_response,
+)
+
+_async_engines: Optional[AsyncEngines] = None
+_async_engines_lock = threading.Lock()
+
+def build_async_engines() -> AsyncEngines:
+    """
+    Returns the AsyncEngines instance shared by every request on this instance, creating it on first use.
+
+    Returns:
+        AsyncEngines: A lazily created AsyncEngines object whose clients are pooled.
+    """
+    global _async_engines
+    if _async_engines is None:
+        with _async_engines_lock:
+            if _async_engines is None:
+                _async_engines = AsyncEngines(hedge_policy=HedgePolicy.from_env())
+    return _async_engines
+
+async def get_async_engines() -> AsyncEngines:
+    """
+    Returns the AsyncEngines instance shared by every request on this instance.
+
+    Loading the credentials refreshes them over the network, so the first
+    call builds the instance in a worker thread instead of on the event loop.
+
+    Returns:
+        AsyncEngines: A lazily created AsyncEngines object whose clients are pooled.
+    """
+    if _async_engines is None:
+        return await asyncio.to_thread(build_async_engines)
+    return _async_engines
+
+async def run_cache(fn, *args, **kwargs):
+    """
+    Runs a response cache call, in a worker thread when a shared backend may be read or written.
+    """
+    if response_cache.backend is None:
+        return fn(*args, **kwargs)
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+async def search_route_controller(data, deadline: Deadline = None):
+    """
+    Handles search requests asynchronously.
+
+    Args:
+        data (Dict[str, Any]): The request data containing user utterance.
+        deadline (Deadline, optional): The webhook deadline. Defaults to one built from `webhook_deadline`.
+
+    Returns:
+        Optional[Dict[str, Any]]: A dictionary containing search results, or None if no utterance.
+    """
+    utterance = get_utterance(data)
+    if utterance:
+        return await query_by_search(query=utterance, deadline=deadline or Deadline.from_env())
+    return None
+
+async def answer_route_controller(data, deadline: Deadline = None):
+    """
+    Handles answer requests asynchronously.
+
+    Args:
+        data (Dict[str, Any]): The request data containing user utterance and session parameters.
+        deadline (Deadline, optional): The webhook deadline. Defaults to one built from `webhook_deadline`.
+
+    Returns:
+        Optional[Dict[str, Any]]: A dictionary containing answer results, or None if no utterance.
+    """
+    utterance = get_utterance(data)
+    session = None
+    if data.get("parameters"):
+        session = data.get("parameters").get("ds_session", None)
+    if utterance:
+        deadline = deadline or Deadline.from_env()
+        response = await query_by_answer(query=utterance, session=session, deadline=deadline)
+        if not response:
+            return await fallback_answer(query=utterance, deadline=deadline)
+        prefetch_related_questions(response)
+        return response
+    return None
+
+async def conversation_route_controller(data, deadline: Deadline = None):
+    """
+    Handles conversation requests asynchronously.
+
+    Args:
+        data (Dict[str, Any]): The request data containing user utterance and session parameters.
+        deadline (Deadline, optional): The webhook deadline. Defaults to one built from `webhook_deadline`.
+
+    Returns:
+        Optional[Dict[str, Any]]: A dictionary containing conversation results, or None if no utterance.
+    """
+    utterance = get_utterance(data)
+    session_json = None
+    if data.get("parameters"):
+        session_json = data.get("parameters").get("ds_session", None)
+    if utterance:
+        deadline = deadline or Deadline.from_env()
+        response = await query_by_conversation(query=utterance, session=session_json, deadline=deadline)
+        if not response:
+            return await fallback_conversation(query=utterance, session=session_json, deadline=deadline)
+        return response
+    return None
+
+async def query_by_search(query: str, deadline: Deadline = None, backend: str = "search") -> Dict[str, Any]:
+    """
+    Queries by search asynchronously. See routers.query_by_search.
+
+    Args:
+        query (str): The search query string.
+        deadline (Deadline, optional): The webhook deadline. Defaults to None.
+        backend (str, optional): The circuit breaker guarding the call. Defaults to "search".
+
+    Returns:
+        Dict[str, Any]: A dictionary containing search results, or an empty dictionary if an error occurred or no result was found.
+    """
+    datastore_ids = get_datastore_ids()
+    cache_key = ",".join(datastore_ids)
+    if CACHE_ENABLED:
+        with span("cache"):
+            cached = await run_cache(response_cache.get, "search", cache_key, query)
+        if cached:
+            return cached
+
+    async def fetch() -> Dict[str, Any]:
+        s = await get_async_engines()
+        if len(datastore_ids) > 1:
+            try:
+                profiles = get_search_profiles(datastore_ids, s)
+            except Exception as e:
+                logging.error(f"Failed to generate a search: {e}")
+                return {}
+            with span("federated"):
+                return await afederated_search(
+                    s,
+                    query=query,
+                    profiles=profiles,
+                    deadline=float(os.environ.get("federated_deadline", 2.0)),
+                    fusion=os.environ.get("federated_fusion", "rrf"),
+                    request_deadline=deadline,
+                    backend=backend,
+                )
+        try:
+            profile = get_search_profile(engines=s)
+            res = await acall_backend(
+                backend, lambda: s.query_by_profile(profile, query=query, deadline=deadline)
+            )
+        except Exception as e:
+            logging.error(f"Failed to generate a search: {e}")
+            return {}
+        with span("parse"):
+            return parse_search_results(res)
+
+    try:
+        parsed_response = await single_flight.ado(
+            f"search:{cache_key}:{query}", fetch,
+            timeout=deadline.remaining() if deadline else None,
+        )
+    except TimeoutError as e:
+        logging.error(f"Failed to generate a search: {e}")
+        return {}
+    if CACHE_ENABLED and parsed_response and not parsed_response.get("partial"):
+        await run_cache(response_cache.set, "search", cache_key, query, parsed_response)
+    return parsed_response
+
+async def query_by_answer(
+    query: str,
+    session: Optional[str] = None,
+    deadline: Deadline = None,
+    backend: str = "answer",
+) -> Dict[str, Any]:
+    """
+    Queries for an answer and related questions asynchronously. See routers.query_by_answer.
+
+    Args:
+        query (str): The query string.
+        session (Optional[str]): An optional session object.
+        deadline (Deadline, optional): The webhook deadline. Defaults to None.
+        backend (str, optional): The circuit breaker guarding the call. Defaults to "answer".
+
+    Returns:
+        Dict[str, Any]: A dictionary containing the answer and related questions, or an empty dictionary if an error occurred or no result was found.
+    """
+    answer_config = build_answer_config(query, session)
+    use_cache = CACHE_ENABLED and not session
+    if use_cache:
+        with span("cache"):
+            cached = await run_cache(response_cache.get, "answer", answer_config["data_store_id"], query)
+        if cached:
+            return cached
+
+    leader = []
+
+    async def fetch() -> Dict[str, Any]:
+        leader.append(True)
+        s = await get_async_engines()
+        try:
+            res = await acall_backend(
+                backend,
+                lambda: s.query_by_answer(answer_config=answer_config, related_question=True, deadline=deadline),
+            )
+        except Exception as e:
+            logging.error(f"Failed to generate an answer: {e}")
+            return {}
+        with span("parse"):
+            return parse_answer_response(res)
+
+    if session:
+        parsed_response = await fetch()
+    else:
+        try:
+            parsed_response = await single_flight.ado(
+                f"answer:{answer_config['data_store_id']}:{query}", fetch,
+                timeout=deadline.remaining() if deadline else None,
+            )
+        except TimeoutError as e:
+            logging.error(f"Failed to generate an answer: {e}")
+            return {}
+    if parsed_response and (use_cache or not leader):
+        # The session belongs to the first caller, so it is not shared.
+        shared_response = {
+            "answer": parsed_response["answer"],
+            "related_questions": parsed_response["related_questions"],
+        }
+        if use_cache:
+            await run_cache(response_cache.set, "answer", answer_config["data_store_id"], query, shared_response)
+        if not leader:
+            return shared_response
+    return parsed_response
+
+async def query_by_conversation(query: str, session: Dict[str, Any] = None, deadline: Deadline = None) -> Dict[str, Any]:
+    """
+    Queries for a conversation asynchronously and, optionally within a session.
+
+    Args:
+        query (str): The query string.
+        session (Optional[Dict[str, Any]]): An optional session object.
+        deadline (Deadline, optional): The webhook deadline. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: A dictionary containing the reply, or an empty dictionary if an error occurred or no result was found.
+    """
+    with span("session"):
+        conv_config = build_conv_config(query, session)
+
+    s = await get_async_engines()
+    try:
+        res = await acall_backend(
+            "conversation",
+            lambda: s.query_by_conversation(conv_config=conv_config, conversation=conv_config["conversation"], deadline=deadline),
+        )
+    except Exception as e:
+        logging.error(f"Failed to generate an answer: {e}")
+        return {}
+    with span("parse"):
+        return parse_conversation_response(res)
+
+async def fallback_answer(query: str, deadline: Deadline = None) -> Dict[str, Any]:
+    """
+    Answers from the fallback tiers asynchronously. See routers.fallback_answer.
+
+    Args:
+        query (str): The normalized query.
+        deadline (Deadline, optional): The webhook deadline. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: A dictionary containing the answer and related questions, or an empty dictionary.
+    """
+    cached = await run_cache(get_cached_answer, query)
+    if cached:
+        record_fallback("answer", "cache")
+        return cached
+    if has_fallback_budget(deadline):
+        searched = await query_by_search(query=query, deadline=deadline)
+        if searched:
+            record_fallback("answer", "search")
+            return {"answer": searched["search"], "related_questions": []}
+    record_fallback("answer", "error")
+    return {}
+
+async def fallback_conversation(query: str, session: Any = None, deadline: Deadline = None) -> Dict[str, Any]:
+    """
+    Replies from the fallback tiers asynchronously. See routers.fallback_conversation.
+
+    Args:
+        query (str): The normalized query.
+        session (Any, optional): The incoming session. Defaults to None.
+        deadline (Deadline, optional): The webhook deadline. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: A dictionary containing the reply, or an empty dictionary.
+    """
+    reply = (await run_cache(get_cached_answer, query)).get("answer")
+    tier = "cache"
+    if not reply and has_fallback_budget(deadline):
+        reply = (await query_by_search(query=query, deadline=deadline)).get("search")
+        tier = "search"
+    if not reply:
+        record_fallback("conversation", "error")
+        return {}
+    record_fallback("conversation", tier)
+    return {"reply": reply, "summary": "", "session": session, "state": None}
@@ -0,0 +1,84 @@
+import os
+import time
+import logging
+from concurrent import futures
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from responses import dumps
+
+MAX_PARALLELISM = int(os.environ.get("batch_max_parallelism", 8))
+
+def run_item(index: int, utterance: str, fn: Callable[[str], Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Runs one batch item and records its status and timing.
+
+    Args:
+        index (int): The position of the utterance in the request.
+        utterance (str): The raw utterance.
+        fn (Callable[[str], Dict[str, Any]]): The route query, e.g. routers.query_by_search.
+
+    Returns:
+        Dict[str, Any]: The item with its status ("ok", "empty" or "error"), elapsed_ms and result or error.
+    """
+    start = time.monotonic()
+    item: Dict[str, Any] = {"index": index, "utterance": utterance}
+    try:
+        result = fn(utterance)
+        item["status"] = "ok" if result else "empty"
+        item["result"] = result or {}
+    except Exception as e:
+        logging.error(f"Batch item {index} failed: {e}")
+        item["status"] = "error"
+        item["error"] = str(e)
+    item["elapsed_ms"] = round((time.monotonic() - start) * 1000, 1)
+    return item
+
+def run_batch(
+    utterances: List[str],
+    fn: Callable[[str], Dict[str, Any]],
+    parallelism: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Runs a list of utterances concurrently and yields each item as it completes.
+
+    At most `parallelism` items are in flight, so a large batch neither
+    floods the backend nor holds every pending future in memory.
+
+    Args:
+        utterances (List[str]): The raw utterances.
+        fn (Callable[[str], Dict[str, Any]]): The route query run for every utterance.
+        parallelism (Optional[int]): Concurrent items, capped by `batch_max_parallelism`. Defaults to the cap.
+
+    Yields:
+        Dict[str, Any]: One item per utterance, in completion order.
+    """
+    parallelism = max(1, min(parallelism or MAX_PARALLELISM, MAX_PARALLELISM))
+    with futures.ThreadPoolExecutor(
+        max_workers=parallelism, thread_name_prefix="batch"
+    ) as executor:
+        items = iter(enumerate(utterances))
+        pending = set()
+        for index, utterance in items:
+            pending.add(executor.submit(run_item, index, utterance, fn))
+            if len(pending) >= parallelism:
+                break
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                next_item = next(items, None)
+                if next_item is not None:
+                    pending.add(executor.submit(run_item, next_item[0], next_item[1], fn))
+
+def stream_ndjson(items: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    """
+    Serializes batch items as newline-delimited JSON.
+
+    Args:
+        items (Iterator[Dict[str, Any]]): The batch items.
+
+    Yields:
+        str: One JSON line per item.
+    """
+    for item in items:
+        yield dumps(item) + "\n"
@@ -0,0 +1,922 @@
+"""
+Benchmarks and checks for the Discovery Engine webhook paths.
+
+Run against a local gRPC stand-in for the Search API, so no Google Cloud
+project or credentials are needed:
+
+    python benchmarks.py clients --requests 200
+    python benchmarks.py async --callers 64 --requests 640 --latency 0.05
+    python benchmarks.py requests --iterations 20000
+    python benchmarks.py responses --messages 10 50 200
+    python benchmarks.py deadlines --deadline 0.5 --latency 2
+    python benchmarks.py singleflight --callers 50
+    python benchmarks.py hedging --tail-rate 0.03 --tail-latency 0.2
+    python benchmarks.py breaker --failures 5
+    python benchmarks.py cache
+    python benchmarks.py prefetch --max-pending 4 --rate 10
+    python benchmarks.py timing --requests 200 --latency 0.02
+
+The async, deadlines, singleflight, hedging, breaker, cache, prefetch and timing checks exit with status 1 if any of their checks fail.
+"""
+import os
+import sys
+import time
+import json
+import random
+import asyncio
+import logging
+import argparse
+import itertools
+import threading
+import statistics
+import contextlib
+from concurrent import futures
+
+import grpc
+from google.auth import credentials as ga_credentials
+from google.api_core import exceptions
+from google.cloud.discoveryengine import SearchRequest, SearchResponse, Document
+
+import main as webhook
+import routers
+import async_routers
+from clients import ClientPool
+from engines import Engines
+from profiles import SearchProfile
+from deadlines import Deadline, MAX_ATTEMPTS
+from singleflight import single_flight
+from hedging import HedgePolicy
+from prefetch import Prefetcher
+from cache import response_cache, ResponseCache, RedisBackend
+from breaker import CircuitBreaker, CircuitOpenError, CLOSED, HALF_OPEN, OPEN, fallbacks
+from async_engines import AsyncEngines
+
+DATA_STORE_ID = "projects/local/locations/global/collections/default_collection/dataStores/local"
+
+class LocalCredentials(ga_credentials.Credentials):
+    """
+    Credentials that never leave the process.
+    """
+
+    def refresh(self, request):
+        self.token = "local"
+
+SERVER_THREAD_PREFIX = "fake-search-server"
+
+def count_threads() -> int:
+    """
+    Counts the live threads, leaving out the fake server's handler threads.
+    """
+    return sum(1 for thread in threading.enumerate() if not thread.name.startswith(SERVER_THREAD_PREFIX))
+
+class FakeSearchServer:
+    """
+    A local gRPC Search service with injectable latency and failures.
+
+    Every search answers with one extractive answer echoing the query after
+    `latency` seconds, or after `tail_latency` seconds for a random
+    `tail_rate` share of calls. The first `failures` calls fail with UNAVAILABLE.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        failures: int = 0,
+        max_workers: int = 64,
+        tail_latency: float = 0.0,
+        tail_rate: float = 0.0,
+    ):
+        self.latency = latency
+        self.failures = failures
+        self.tail_latency = tail_latency
+        self.tail_rate = tail_rate
+        self.calls = 0
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+        self._server = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=SERVER_THREAD_PREFIX)
+        )
+        self._server.add_generic_rpc_handlers((
+            grpc.method_handlers_generic_handler(
+                "google.cloud.discoveryengine.v1beta.SearchService",
+                {
+                    "Search": grpc.unary_unary_rpc_method_handler(
+                        self.search,
+                        request_deserializer=SearchRequest.deserialize,
+                        response_serializer=SearchResponse.serialize,
+                    ),
+                },
+            ),
+        ))
+        self.address = f"127.0.0.1:{self._server.add_insecure_port('127.0.0.1:0')}"
+
+    def search(self, request, context):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+            slow = self._random.random() < self.tail_rate
+        if call <= self.failures:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "injected failure")
+        time.sleep(self.tail_latency if slow else self.latency)
+        return SearchResponse(results=[
+            SearchResponse.SearchResult(
+                id="doc-0",
+                document=Document(
+                    id="doc-0",
+                    derived_struct_data={"extractive_answers": [{"content": f"answer to {request.query}"}]},
+                ),
+            ),
+        ])
+
+    def __enter__(self) -> "FakeSearchServer":
+        self._server.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.stop(grace=None)
+
+class LocalClientPool(ClientPool):
+    """
+    A client pool whose clients talk plaintext gRPC to a local server.
+
+    With pooled=False every call builds a new client and channel, as the
+    webhook did before clients were pooled.
+    """
+
+    def __init__(self, address: str, pooled: bool = True):
+        super().__init__()
+        self.address = address
+        self.pooled = pooled
+        self.created = 0
+
+    def create(self, client_cls, credentials=None, client_options=None):
+        self.created += 1
+        if client_cls.__name__.endswith("AsyncClient"):
+            channel = grpc.aio.insecure_channel(self.address)
+            transport = client_cls.get_transport_class("grpc_asyncio")(channel=channel)
+        else:
+            channel = grpc.insecure_channel(self.address)
+            transport = client_cls.get_transport_class("grpc")(channel=channel)
+        return client_cls(transport=transport)
+
+    def get(self, client_cls, credentials=None, client_options=None):
+        if self.pooled:
+            return super().get(client_cls, credentials, client_options)
+        return self.create(client_cls, credentials, client_options)
+
+def build_engines(address: str, pooled: bool = True, **kwargs) -> Engines:
+    return Engines(creds=LocalCredentials(), pool=LocalClientPool(address, pooled), **kwargs)
+
+def use_local_engines(address: str, **kwargs):
+    """
+    Points the sync and async routers at a local server.
+    """
+    routers._engines = build_engines(address, **kwargs)
+    async_routers._async_engines = AsyncEngines(creds=LocalCredentials(), pool=LocalClientPool(address))
+
+def run_callers(fn, requests: int, callers: int) -> dict:
+    """
+    Calls fn(i) for every request from a pool of caller threads and times each call.
+    """
+    latencies = []
+    peak_threads = [0]
+
+    def run(i):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - start)
+        peak_threads[0] = max(peak_threads[0], count_threads())
+
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=callers) as executor:
+        list(executor.map(run, range(requests)))
+    wall = time.perf_counter() - start
+    return {
+        **summarize(latencies),
+        "requests_per_s": round(requests / wall, 1),
+        "peak_threads": peak_threads[0],
+    }
+
+def summarize(latencies) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+    }
+
+def benchmark_clients(args) -> dict:
+    """
+    Compares a client per request with pooled clients on the same fake server.
+
+    The local channel is plaintext and the credentials are static, so the
+    TLS handshake and token fetch a real unpooled client also pays are not
+    in these numbers.
+    """
+    results = {}
+    with FakeSearchServer() as server:
+        for pooled in (False, True):
+            engines = build_engines(server.address, pooled)
+            latencies = []
+            for i in range(args.requests):
+                start = time.perf_counter()
+                engines.query_by_search({"data_store_id": DATA_STORE_ID, "query": f"query {i}"}, total_results=1)
+                latencies.append(time.perf_counter() - start)
+            results["pooled" if pooled else "unpooled"] = {
+                **summarize(latencies),
+                "clients_created": engines.pool.created,
+            }
+    results["speedup"] = round(results["unpooled"]["mean_ms"] / results["pooled"]["mean_ms"], 2)
+    return results
+
+def build_asgi_app():
+    """
+    Wraps hello_http_async the way functions-framework does when serving over ASGI.
+    """
+    from functions_framework.aio import create_asgi_app_from_module
+
+    return create_asgi_app_from_module("hello_http_async", webhook.__file__, "http", webhook, None)
+
+async def run_async_callers(send, requests: int, callers: int) -> dict:
+    """
+    Awaits send(i) for every request from a fixed number of concurrent tasks and times each call.
+    """
+    latencies = []
+    peak_threads = 0
+    requests_left = iter(range(requests))
+
+    async def caller():
+        nonlocal peak_threads
+        for i in requests_left:
+            start = time.perf_counter()
+            await send(i)
+            latencies.append(time.perf_counter() - start)
+            peak_threads = max(peak_threads, count_threads())
+
+    start = time.perf_counter()
+    await asyncio.gather(*[caller() for _ in range(callers)])
+    wall = time.perf_counter() - start
+    return {
+        **summarize(latencies),
+        "requests_per_s": round(requests / wall, 1),
+        "peak_threads": peak_threads,
+    }
+
+def check_async(args) -> dict:
+    """
+    Serves the same /search webhooks through the Flask app and over ASGI.
+
+    In the Flask mode every request in flight holds a worker thread, so
+    `callers` concurrent requests need `callers` threads. Over ASGI the
+    requests wait for Discovery Engine on one event loop. The fake server's
+    handler threads are not counted.
+    """
+    import httpx
+
+    checks = {}
+    details = {}
+    with FakeSearchServer(latency=args.latency, max_workers=args.callers) as server:
+        use_local_engines(server.address)
+        baseline_threads = count_threads()
+
+        def send_sync(i):
+            return webhook.app.test_client().post("/search", json={"text": f"sync query {i}"})
+
+        details["flask"] = run_callers(send_sync, args.requests, args.callers)
+        sync_response = webhook.app.test_client().post("/search", json={"text": "parity query"})
+
+        async def serve():
+            transport = httpx.ASGITransport(app=build_asgi_app())
+            async with httpx.AsyncClient(transport=transport, base_url="http://webhook") as client:
+                async def send(i):
+                    response = await client.post("/search", json={"text": f"async query {i}"})
+                    response.raise_for_status()
+
+                result = await run_async_callers(send, args.requests, args.callers)
+                parity = await client.post("/search", json={"text": "parity query"})
+                timed_response = await client.post("/search", json={"text": "uncached query"})
+                return result, parity, timed_response
+
+        details["asgi"], async_response, timed_response = asyncio.run(serve())
+        details["baseline_threads"] = baseline_threads
+        details["server_calls"] = server.calls
+
+    flask, asgi = details["flask"], details["asgi"]
+    checks["asgi_responses_match_flask"] = (
+        async_response.status_code == 200 and async_response.json() == sync_response.get_json(force=True)
+    )
+    details["asgi_server_timing"] = timed_response.headers.get("Server-Timing")
+    checks["asgi_responses_carry_server_timing"] = "rpc;dur=" in timed_response.headers.get("Server-Timing", "")
+    # The Flask mode adds a thread per concurrent request; ASGI adds none per request.
+    checks["asgi_uses_fewer_threads"] = (
+        asgi["peak_threads"] - baseline_threads < (flask["peak_threads"] - baseline_threads) / 2
+    )
+    checks["asgi_keeps_throughput"] = asgi["requests_per_s"] >= 0.8 * flask["requests_per_s"]
+    return {"details": details, "checks": checks}
+
+SEARCH_CONFIG = {
+    "data_store_id": DATA_STORE_ID,
+    "page_size": 5,
+    "filter": 'category: ANY("plans", "billing")',
+    "canonical_filter": 'category: ANY("plans")',
+    "order_by": "title",
+    "params": {"search_type": 0},
+    "ranking_expression": "0.5 * relevance_score",
+    "user_labels": {"team": "support", "channel": "dialogflow"},
+}
+
+def time_per_call(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return (time.perf_counter() - start) / iterations
+
+def benchmark_requests(args) -> dict:
+    """
+    Compares building every SearchRequest from the config with copying a compiled SearchProfile.
+    """
+    engines = build_engines("127.0.0.1:0")
+    user_info = {"user_id": "user", "user_agent": "dialogflow"}
+    profile = SearchProfile.compile(engines, SEARCH_CONFIG, total_results=1)
+    built = time_per_call(
+        lambda i: engines.build_search_request({**SEARCH_CONFIG, "query": f"query {i}", "user_info": user_info}),
+        args.iterations,
+    )
+    copied = time_per_call(
+        lambda i: profile.build_request(f"query {i}", user_info=user_info),
+        args.iterations,
+    )
+    return {
+        "iterations": args.iterations,
+        "build_search_request_us": round(built * 1e6, 2),
+        "profile_build_request_us": round(copied * 1e6, 2),
+        "speedup": round(built / copied, 2),
+    }
+
+def build_conversation_result(messages: int, chars: int) -> dict:
+    """
+    Builds a conversation route result whose session holds the given number of turns.
+    """
+    text = ("the plan includes unlimited calls and texts " * (chars // 44 + 1))[:chars]
+    return {
+        "reply": text,
+        "summary": text,
+        "session": {
+            "name": "projects/local/locations/global/collections/default_collection/dataStores/local/conversations/1",
+            "state": 1,
+            "user_pseudo_id": "user",
+            "messages": [
+                {"userInput": {"input": text}} if i % 2 == 0 else {"reply": {"summary": {"summaryText": text}}}
+                for i in range(messages)
+            ],
+            "start_time": "2024-01-01T00:00:00Z",
+            "end_time": None,
+        },
+        "state": None,
+    }
+
+def render_legacy_conversation(res: dict) -> str:
+    """
+    Renders a conversation response the way main.py did before WebhookResponseBuilder.
+    """
+    from dfcx_scrapi.tools import webhook_util
+
+    wbhk_util = webhook_util.WebhookUtil()
+    session_info = wbhk_util.build_session_info(
+        parameters={
+            "ds_reply": res["reply"],
+            "ds_summary": res["summary"],
+            "ds_session": res["session"],
+            "ds_state": res["state"]
+        }
+    )
+    wb_response = wbhk_util.build_response(
+        response_text=res["reply"],
+        session_info=session_info,
+        append=True
+    )
+    response = json.dumps(wb_response)
+    logging.info(response)
+    return response
+
+def benchmark_responses(args) -> dict:
+    """
+    Compares the old and the current conversation webhook rendering for growing sessions.
+
+    The old path logged every response at INFO on the request thread
+    (importing dfcx_scrapi's webhook_util set the root logger to INFO), so
+    root records go to os.devnull at INFO to keep that cost without the output.
+    """
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    root.handlers = [logging.StreamHandler(open(os.devnull, "w"))]
+    root.setLevel(logging.INFO)
+    try:
+        return run_responses(args)
+    finally:
+        root.handlers = handlers
+        root.setLevel(level)
+
+def run_responses(args) -> dict:
+    results = []
+    for messages in args.messages:
+        res = build_conversation_result(messages, args.chars)
+        legacy = time_per_call(lambda i: render_legacy_conversation(res), args.iterations)
+        current = time_per_call(lambda i: webhook.fetch_wb_for_conversation(res), args.iterations)
+        results.append({
+            "messages": messages,
+            "payload_kb": round(len(webhook.fetch_wb_for_conversation(res)) / 1024, 1),
+            "legacy_us": round(legacy * 1e6, 1),
+            "current_us": round(current * 1e6, 1),
+            "speedup": round(legacy / current, 2),
+        })
+    return {"iterations": args.iterations, "chars_per_message": args.chars, "results": results}
+
+def timed(fn):
+    start = time.perf_counter()
+    try:
+        result = fn()
+    except Exception as e:
+        result = e
+    return result, time.perf_counter() - start
+
+def check_deadlines(args) -> dict:
+    """
+    Checks the webhook deadline against a server slower than the deadline and one that fails transiently.
+    """
+    slack = args.slack
+    checks = {}
+    details = {}
+    config = {"data_store_id": DATA_STORE_ID, "query": "plans"}
+
+    with FakeSearchServer(latency=args.latency) as server:
+        engines = build_engines(server.address)
+        result, elapsed = timed(lambda: engines.query_by_search(config, deadline=Deadline(args.deadline)))
+        details["slow_rpc"] = {"elapsed_s": round(elapsed, 3), "error": type(result).__name__}
+        checks["slow_rpc_raises_deadline_exceeded"] = isinstance(result, exceptions.DeadlineExceeded)
+        checks["slow_rpc_stops_at_deadline"] = elapsed < args.deadline + slack
+
+        use_local_engines(server.address)
+        os.environ["webhook_deadline"] = str(args.deadline)
+        client = webhook.app.test_client()
+        response, elapsed = timed(lambda: client.post("/search", json={"text": "slow plans"}))
+        body = response.get_json(force=True)
+        details["slow_webhook"] = {"elapsed_s": round(elapsed, 3), "status": response.status_code}
+        checks["slow_webhook_answers_before_timeout"] = elapsed < args.deadline + slack
+        checks["slow_webhook_returns_error_message"] = (
+            response.status_code == 200 and body["sessionInfo"]["parameters"]["ds_error"] is True
+        )
+
+    with FakeSearchServer(failures=MAX_ATTEMPTS - 1) as server:
+        engines = build_engines(server.address)
+        result, elapsed = timed(lambda: engines.query_by_search(config, deadline=Deadline(args.deadline * 4)))
+        details["transient"] = {"elapsed_s": round(elapsed, 3), "server_calls": server.calls}
+        checks["transient_errors_are_retried"] = isinstance(result, list) and server.calls == MAX_ATTEMPTS
+
+    with FakeSearchServer(failures=MAX_ATTEMPTS) as server:
+        engines = build_engines(server.address)
+        result, elapsed = timed(lambda: engines.query_by_search(config, deadline=Deadline(args.deadline * 4)))
+        details["persistent"] = {"elapsed_s": round(elapsed, 3), "server_calls": server.calls}
+        checks["retries_stop_after_max_attempts"] = (
+            isinstance(result, exceptions.ServiceUnavailable) and server.calls == MAX_ATTEMPTS
+        )
+
+    return {"details": details, "checks": checks}
+
+def check_singleflight(args) -> dict:
+    """
+    Checks that concurrent identical searches from threads and from coroutines share one RPC.
+    """
+    checks = {}
+    details = {}
+    with FakeSearchServer(latency=args.latency) as server:
+        use_local_engines(server.address)
+        barrier = threading.Barrier(args.callers)
+
+        def search(i):
+            barrier.wait()
+            return routers.query_by_search("shared thread query", deadline=Deadline(args.latency * 10))
+
+        executed = single_flight.executed
+        with futures.ThreadPoolExecutor(max_workers=args.callers) as executor:
+            results = list(executor.map(search, range(args.callers)))
+        details["threads"] = {"callers": args.callers, "server_calls": server.calls}
+        checks["threads_share_one_rpc"] = server.calls == 1 and single_flight.executed - executed == 1
+        checks["threads_get_the_same_result"] = all(result == results[0] and result for result in results)
+
+        async def gather():
+            return await asyncio.gather(*[
+                async_routers.query_by_search("shared async query", deadline=Deadline(args.latency * 10))
+                for _ in range(args.callers)
+            ])
+
+        results = asyncio.run(gather())
+        details["coroutines"] = {"callers": args.callers, "server_calls": server.calls - 1}
+        checks["coroutines_share_one_rpc"] = server.calls == 2
+        checks["coroutines_get_the_same_result"] = all(result == results[0] and result for result in results)
+    return {"details": details, "checks": checks}
+
+def check_hedging(args) -> dict:
+    """
+    Checks hedged searches against a server with a slow tail.
+
+    The same searches run without hedging, with hedging from threads through
+    Engines, and with hedging from coroutines through AsyncEngines. Hedging
+    must cut the p99 latency while hedging at most `max_rate` of the
+    requests, and the threaded runs must stay within the caller threads
+    plus the hedging pool.
+    """
+    checks = {}
+    details = {}
+    search = lambda engines, i: engines.query_by_search(
+        {"data_store_id": DATA_STORE_ID, "query": f"hedged query {i}"}, total_results=1
+    )
+    with FakeSearchServer(
+        latency=args.latency, tail_latency=args.tail_latency, tail_rate=args.tail_rate
+    ) as server:
+        baseline_threads = count_threads()
+        engines = build_engines(server.address)
+        details["unhedged"] = run_callers(lambda i: search(engines, i), args.requests, args.callers)
+
+        for name, max_rate in (("hedged", args.max_rate), ("hedged_low_cap", args.max_rate / 5)):
+            policy = HedgePolicy(max_rate=max_rate, min_samples=args.min_samples)
+            engines = build_engines(server.address, hedge_policy=policy)
+            result = run_callers(lambda i: search(engines, i), args.requests, args.callers)
+            details[name] = {**result, "max_rate": max_rate, "hedges": policy.hedges, "hedge_wins": policy.hedge_wins}
+            checks[f"{name}_stays_under_the_rate_cap"] = policy.hedges <= max_rate * args.requests
+            checks[f"{name}_threads_stay_bounded"] = (
+                result["peak_threads"] - baseline_threads <= args.callers + policy.max_workers
+            )
+
+        policy = HedgePolicy(max_rate=args.max_rate, min_samples=args.min_samples)
+
+        async def run_async():
+            engines = AsyncEngines(creds=LocalCredentials(), pool=LocalClientPool(server.address), hedge_policy=policy)
+            return await run_async_callers(lambda i: search(engines, i), args.requests, args.callers)
+
+        details["hedged_async"] = {
+            **asyncio.run(run_async()), "max_rate": args.max_rate,
+            "hedges": policy.hedges, "hedge_wins": policy.hedge_wins,
+        }
+        checks["hedged_async_stays_under_the_rate_cap"] = policy.hedges <= args.max_rate * args.requests
+
+    unhedged_p99 = details["unhedged"]["p99_ms"]
+    checks["hedging_improves_p99"] = details["hedged"]["p99_ms"] < unhedged_p99 / 2
+    checks["async_hedging_improves_p99"] = details["hedged_async"]["p99_ms"] < unhedged_p99 / 2
+    checks["hedges_win"] = details["hedged"]["hedge_wins"] > 0 and details["hedged_async"]["hedge_wins"] > 0
+    return {"details": details, "checks": checks}
+
+class FakeRedis:
+    """
+    An in-process stand-in for the Redis commands RedisBackend sends.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        return entry[1] if entry and entry[0] > time.monotonic() else None
+
+    def pttl(self, key):
+        if self.get(key) is None:
+            return -2
+        return int((self.entries[key][0] - time.monotonic()) * 1000)
+
+    def setex(self, key, seconds, value):
+        self.entries[key] = (time.monotonic() + seconds, value)
+
+    def pipeline(self):
+        client, calls = self, []
+
+        class Pipeline:
+            def get(self, key):
+                calls.append(lambda: client.get(key))
+
+            def pttl(self, key):
+                calls.append(lambda: client.pttl(key))
+
+            def execute(self):
+                return [call() for call in calls]
+
+        return Pipeline()
+
+def check_cache(args) -> dict:
+    """
+    Checks TTL and LRU eviction, per-route TTLs, stale reads and the TTL of entries read from Redis.
+    """
+    checks = {}
+    details = {}
+    ttl = args.ttl
+    cache = ResponseCache(max_size=3, default_ttl=ttl, ttls={"answer": ttl * 3})
+    cache.set("search", "store", "short", {"search": "short"})
+    cache.set("answer", "store", "long", {"answer": "long"})
+    time.sleep(ttl * 1.5)
+    checks["expired_entries_miss"] = cache.get("search", "store", "short") is None
+    checks["routes_keep_their_own_ttl"] = cache.get("answer", "store", "long") == {"answer": "long"}
+    checks["stale_reads_serve_expired_entries"] = (
+        cache.get("search", "store", "short", stale=True) == {"search": "short"}
+    )
+
+    cache = ResponseCache(max_size=3, default_ttl=60)
+    for utterance in ("a", "b", "c"):
+        cache.set("search", "store", utterance, {"search": utterance})
+    cache.get("search", "store", "a")
+    cache.set("search", "store", "d", {"search": "d"})
+    kept = [utterance for utterance in "abcd" if cache.contains("search", "store", utterance)]
+    details["lru"] = {"kept": kept}
+    checks["lru_evicts_the_least_recently_used"] = kept == ["a", "c", "d"]
+
+    # Redis TTLs are whole seconds, so this part waits for one.
+    redis = FakeRedis()
+    writer = ResponseCache(default_ttl=1, backend=RedisBackend(redis))
+    writer.set("answer", "store", "shared", {"answer": "shared"})
+    time.sleep(0.6)
+    reader = ResponseCache(default_ttl=1, backend=RedisBackend(redis))
+    read = reader.get("answer", "store", "shared")
+    time.sleep(0.6)
+    details["redis"] = {"read": read, "reader_stats": reader.stats()}
+    checks["redis_hits_are_served"] = read == {"answer": "shared"}
+    checks["redis_hits_keep_the_remaining_ttl"] = (
+        not reader.contains("answer", "store", "shared") and reader.get("answer", "store", "shared") is None
+    )
+    return {"details": details, "checks": checks}
+
+def wait_idle(prefetcher: Prefetcher, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while prefetcher.stats()["pending"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+def check_prefetch(args) -> dict:
+    """
+    Checks the prefetcher's in-flight dedup, max_pending cap, token bucket and failure count.
+    """
+    checks = {}
+    details = {}
+    release = threading.Event()
+    fetched = []
+
+    def fetch(query):
+        release.wait()
+        if query.startswith("fail"):
+            raise RuntimeError("injected failure")
+        fetched.append(query)
+
+    prefetcher = Prefetcher(fetch, max_workers=1, max_pending=args.max_pending, rate=args.rate)
+    scheduled = prefetcher.submit(["shared", "shared"]) + prefetcher.submit(["shared"])
+    checks["in_flight_queries_are_not_resubmitted"] = scheduled == 1 and prefetcher.stats()["dropped"] == 0
+
+    queries = [f"query {i}" for i in range(args.max_pending * 2)]
+    scheduled = prefetcher.submit(queries)
+    details["max_pending"] = {"submitted": len(queries), "scheduled": scheduled, "stats": prefetcher.stats()}
+    checks["max_pending_drops_extra_work"] = (
+        scheduled == args.max_pending - 1 and prefetcher.stats()["pending"] == args.max_pending
+    )
+    release.set()
+    wait_idle(prefetcher)
+    checks["finished_queries_are_fetched"] = sorted(fetched) == sorted(["shared"] + queries[:scheduled])
+
+    # The burst above spent the bucket, which refills at `rate` per second.
+    burst = prefetcher.submit([f"burst {i}" for i in range(args.max_pending)])
+    time.sleep(2 / args.rate)
+    refilled = prefetcher.submit([f"refill {i}" for i in range(args.max_pending)])
+    details["token_bucket"] = {"burst": burst, "refilled": refilled}
+    checks["token_bucket_limits_the_rate"] = burst <= 1 and 1 <= refilled <= 3
+    wait_idle(prefetcher)
+    time.sleep(1.5 / args.rate)
+    checks["finished_queries_can_be_prefetched_again"] = prefetcher.submit(["shared"]) == 1
+
+    time.sleep(args.max_pending / args.rate)
+    wait_idle(prefetcher)
+    failures = prefetcher.submit([f"fail {i}" for i in range(args.max_pending)])
+    wait_idle(prefetcher)
+    details["stats"] = prefetcher.stats()
+    checks["failures_are_counted"] = failures == args.max_pending and prefetcher.stats()["failed"] == failures
+    prefetcher._executor.shutdown(wait=True)
+    return {"details": details, "checks": checks}
+
+def fail():
+    raise RuntimeError("injected failure")
+
+def check_breaker(args) -> dict:
+    """
+    Checks the circuit breaker's state changes and the /answer fallback order.
+
+    The fake server has no Answer API, so every answer call fails and the
+    webhook falls back: to a cached answer even if it expired, then to the
+    extractive answer from search, then to the error message.
+    """
+    checks = {}
+    details = {}
+    breaker = CircuitBreaker(
+        "check", failure_rate=0.5, min_calls=args.failures, window=args.failures * 2, open_seconds=args.open_seconds
+    )
+    for _ in range(args.failures - 1):
+        timed(lambda: breaker.call(fail))
+    checks["stays_closed_below_min_calls"] = breaker.state == CLOSED
+    timed(lambda: breaker.call(fail))
+    checks["opens_after_n_failures"] = breaker.state == OPEN
+    calls = []
+    result, _ = timed(lambda: breaker.call(lambda: calls.append(True)))
+    checks["open_breaker_rejects_without_calling"] = isinstance(result, CircuitOpenError) and not calls
+
+    time.sleep(args.open_seconds)
+    started, release = threading.Event(), threading.Event()
+
+    def trial():
+        started.set()
+        release.wait()
+        return "trial"
+
+    trial_thread = threading.Thread(target=lambda: breaker.call(trial))
+    trial_thread.start()
+    started.wait()
+    others = [timed(lambda: breaker.call(lambda: calls.append(True)))[0] for _ in range(args.failures)]
+    checks["half_open_lets_one_trial_through"] = (
+        breaker.state == HALF_OPEN and not calls and all(isinstance(other, CircuitOpenError) for other in others)
+    )
+    release.set()
+    trial_thread.join()
+    checks["trial_success_closes"] = breaker.state == CLOSED
+
+    for _ in range(args.failures):
+        timed(lambda: breaker.call(fail))
+    time.sleep(args.open_seconds)
+    result, _ = timed(lambda: breaker.call(fail))
+    checks["trial_failure_reopens"] = isinstance(result, RuntimeError) and breaker.state == OPEN
+    details["breaker"] = {"state": breaker.state, "rejected": breaker.rejected}
+
+    datastore_id = os.environ["datastore_id"]
+    client = webhook.app.test_client()
+    answer = lambda text: client.post("/answer", json={"text": text}).get_json(force=True)["sessionInfo"]["parameters"]
+    response_cache.clear()
+    with FakeSearchServer() as server:
+        use_local_engines(server.address)
+        ttls = dict(response_cache.ttls)
+        response_cache.ttls["answer"] = -1
+        response_cache.set("answer", datastore_id, "stale question", {"answer": "cached answer", "related_questions": []})
+        response_cache.ttls = ttls
+        before = dict(fallbacks)
+        cached = answer("stale question")
+        searched = answer("search question")
+    with FakeSearchServer(failures=10**6) as server:
+        use_local_engines(server.address)
+        failed = answer("error question")
+    tiers = {tier: fallbacks[("answer", tier)] - before.get(("answer", tier), 0) for tier in ("cache", "search", "error")}
+    details["fallbacks"] = {"cached": cached, "searched": searched, "failed": failed, "tiers": tiers}
+    checks["fallback_serves_an_expired_cached_answer_first"] = cached.get("ds_answer") == "cached answer"
+    checks["fallback_then_serves_the_search_answer"] = searched.get("ds_answer") == "answer to search question"
+    checks["fallback_finally_returns_the_error"] = failed.get("ds_error") is True
+    checks["fallback_tiers_are_counted"] = tiers == {"cache": 1, "search": 1, "error": 1}
+    return {"details": details, "checks": checks}
+
+@contextlib.contextmanager
+def timing_installed(app, enabled: bool):
+    """
+    Runs with the request hooks of install_timing, or with them removed.
+    """
+    before = list(app.before_request_funcs.get(None, []))
+    after = list(app.after_request_funcs.get(None, []))
+    if not enabled:
+        app.before_request_funcs[None] = [fn for fn in before if fn.__name__ != "_start_timing"]
+        app.after_request_funcs[None] = [fn for fn in after if fn.__name__ != "_finish_timing"]
+    try:
+        yield
+    finally:
+        app.before_request_funcs[None] = before
+        app.after_request_funcs[None] = after
+
+def compare_timing(app, send, rounds: int, requests: int) -> dict:
+    """
+    Replays send(client) through the app with timing on and off, in alternating rounds.
+
+    Rounds alternate which mode goes first, so drift in the machine's speed
+    hits both modes alike. The overhead compares the medians of the per-round
+    median latencies.
+    """
+    client = app.test_client()
+    medians = {True: [], False: []}
+    headers = {True: [], False: []}
+    statuses = set()
+    for round_number in range(rounds + 1):
+        for enabled in ((True, False) if round_number % 2 else (False, True)):
+            latencies = []
+            with timing_installed(app, enabled):
+                for _ in range(requests):
+                    start = time.perf_counter()
+                    response = send(client)
+                    latencies.append(time.perf_counter() - start)
+                    headers[enabled].append("Server-Timing" in response.headers)
+                    statuses.add(response.status_code)
+            # The first round only warms up the server, clients and caches.
+            if round_number:
+                medians[enabled].append(statistics.median(latencies))
+    on, off = statistics.median(medians[True]), statistics.median(medians[False])
+    overhead = (on - off) / off
+    return {
+        "details": {
+            "timing_on_ms": round(on * 1000, 3),
+            "timing_off_ms": round(off * 1000, 3),
+            "overhead_us": round((on - off) * 1e6, 1),
+            "overhead_pct": round(overhead * 100, 3),
+        },
+        "checks": {
+            "requests_succeed": statuses == {200},
+            "timed_responses_carry_server_timing": all(headers[True]),
+            "untimed_responses_do_not": not any(headers[False]),
+            "overhead_below_1_pct": overhead < 0.01,
+        },
+    }
+
+def check_timing(args) -> dict:
+    """
+    Checks that per-request timing costs less than 1% of a /search request against the fake server.
+    """
+    queries = itertools.count()
+    with FakeSearchServer(latency=args.latency) as server:
+        use_local_engines(server.address)
+        # A new query per request, so every request goes to the server.
+        result = compare_timing(
+            webhook.app,
+            lambda client: client.post("/search", json={"text": f"timing query {next(queries)}"}),
+            args.rounds,
+            args.requests,
+        )
+    result["details"].update({"route": "/search", "latency_s": args.latency, "server_calls": server.calls})
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    clients_parser = subparsers.add_parser("clients", help="A client per request vs pooled clients.")
+    clients_parser.add_argument("--requests", type=int, default=200)
+    clients_parser.set_defaults(run=benchmark_clients)
+
+    async_parser = subparsers.add_parser("async", help="Check Flask vs ASGI serving under concurrent webhooks.")
+    async_parser.add_argument("--callers", type=int, default=64)
+    async_parser.add_argument("--requests", type=int, default=640)
+    async_parser.add_argument("--latency", type=float, default=0.05)
+    async_parser.set_defaults(run=check_async)
+
+    requests_parser = subparsers.add_parser("requests", help="SearchRequest built per request vs copied from a profile.")
+    requests_parser.add_argument("--iterations", type=int, default=20000)
+    requests_parser.set_defaults(run=benchmark_requests)
+
+    responses_parser = subparsers.add_parser("responses", help="Old vs current rendering of large conversation responses.")
+    responses_parser.add_argument("--messages", type=int, nargs="+", default=[10, 50, 200])
+    responses_parser.add_argument("--chars", type=int, default=500)
+    responses_parser.add_argument("--iterations", type=int, default=500)
+    responses_parser.set_defaults(run=benchmark_responses)
+
+    deadlines_parser = subparsers.add_parser("deadlines", help="Check deadlines and retries against a slow or failing server.")
+    deadlines_parser.add_argument("--deadline", type=float, default=0.5)
+    deadlines_parser.add_argument("--latency", type=float, default=2.0)
+    deadlines_parser.add_argument("--slack", type=float, default=0.25)
+    deadlines_parser.set_defaults(run=check_deadlines)
+
+    singleflight_parser = subparsers.add_parser("singleflight", help="Check that concurrent identical searches share one RPC.")
+    singleflight_parser.add_argument("--callers", type=int, default=50)
+    singleflight_parser.add_argument("--latency", type=float, default=0.2)
+    singleflight_parser.set_defaults(run=check_singleflight)
+
+    hedging_parser = subparsers.add_parser("hedging", help="Check that hedging cuts p99 latency within its rate cap.")
+    hedging_parser.add_argument("--requests", type=int, default=1000)
+    hedging_parser.add_argument("--callers", type=int, default=4)
+    hedging_parser.add_argument("--latency", type=float, default=0.01)
+    hedging_parser.add_argument("--tail-latency", type=float, default=0.2)
+    hedging_parser.add_argument("--tail-rate", type=float, default=0.03)
+    hedging_parser.add_argument("--max-rate", type=float, default=0.1)
+    hedging_parser.add_argument("--min-samples", type=int, default=50)
+    hedging_parser.set_defaults(run=check_hedging)
+
+    cache_parser = subparsers.add_parser("cache", help="Check response cache eviction, TTLs and stale reads.")
+    cache_parser.add_argument("--ttl", type=float, default=0.2)
+    cache_parser.set_defaults(run=check_cache)
+
+    prefetch_parser = subparsers.add_parser("prefetch", help="Check the prefetcher's dedup, pending cap and rate limit.")
+    prefetch_parser.add_argument("--max-pending", type=int, default=4)
+    prefetch_parser.add_argument("--rate", type=float, default=10.0)
+    prefetch_parser.set_defaults(run=check_prefetch)
+
+    breaker_parser = subparsers.add_parser("breaker", help="Check the circuit breaker states and the answer fallback order.")
+    breaker_parser.add_argument("--failures", type=int, default=5)
+    breaker_parser.add_argument("--open-seconds", type=float, default=0.2)
+    breaker_parser.set_defaults(run=check_breaker)
+
+    timing_parser = subparsers.add_parser("timing", help="Check that request timing costs under 1% of a request.")
+    timing_parser.add_argument("--requests", type=int, default=100)
+    timing_parser.add_argument("--rounds", type=int, default=8)
+    timing_parser.add_argument("--latency", type=float, default=0.02)
+    timing_parser.set_defaults(run=check_timing)
+
+    os.environ.setdefault("datastore_id", DATA_STORE_ID)
+    args = parser.parse_args()
+    result = args.run(args)
+    print(json.dumps(result, indent=2))
+    if not all(result.get("checks", {}).values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
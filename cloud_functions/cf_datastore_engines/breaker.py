@@ -0,0 +1,234 @@
+import os
+import time
+import threading
+from collections import Counter, deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from timing import metrics
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a backend whose circuit is open.
+    """
+
+class CircuitBreaker:
+    """
+    A count-window circuit breaker for one backend.
+
+    The breaker opens when, over the last `window` calls (and at least
+    `min_calls`), the share of failed calls reaches `failure_rate` or the
+    share of calls slower than `slow_call` seconds reaches `slow_rate`.
+    While open, calls fail immediately with CircuitOpenError. After
+    `open_seconds` one trial call is let through: success closes the
+    breaker, failure opens it again. Calls started before the breaker
+    last changed state are not counted, so a slow call that started while
+    closed cannot pass for the trial.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        slow_call: float = 3.0,
+        slow_rate: float = 0.8,
+        window: int = 20,
+        min_calls: int = 5,
+        open_seconds: float = 30.0,
+    ):
+        """
+        Initializes the breaker.
+
+        Args:
+            name (str): The backend name, e.g. "answer".
+            failure_rate (float, optional): Share of failed calls that opens the breaker. Defaults to 0.5.
+            slow_call (float, optional): Seconds after which a call counts as slow. Defaults to 3.0.
+            slow_rate (float, optional): Share of slow calls that opens the breaker. Defaults to 0.8.
+            window (int, optional): Number of recent calls considered. Defaults to 20.
+            min_calls (int, optional): Calls needed before the breaker can open. Defaults to 5.
+            open_seconds (float, optional): Seconds the breaker stays open before a trial call. Defaults to 30.0.
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.rejected = 0
+        self._calls: "deque[tuple]" = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._generation = object()
+        self._trial: Optional[object] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, name: str) -> "CircuitBreaker":
+        return cls(
+            name,
+            failure_rate=float(os.environ.get("breaker_failure_rate", 0.5)),
+            slow_call=float(os.environ.get("breaker_slow_call", 3.0)),
+            slow_rate=float(os.environ.get("breaker_slow_rate", 0.8)),
+            window=int(os.environ.get("breaker_window", 20)),
+            min_calls=int(os.environ.get("breaker_min_calls", 5)),
+            open_seconds=float(os.environ.get("breaker_open_seconds", 30.0)),
+        )
+
+    def allow(self) -> Optional[object]:
+        """
+        Checks whether a call may go to the backend.
+
+        Returns:
+            Optional[object]: A token to pass to record with the call's outcome, or None while
+                the breaker is open or a trial call is running.
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return self._generation
+            if self.state == HALF_OPEN and self._trial is None:
+                self._trial = object()
+                return self._trial
+            self.rejected += 1
+            return None
+
+    def record(self, success: bool, elapsed: float, token: object):
+        """
+        Records the outcome of a call and updates the state.
+
+        Only the trial call's token closes or reopens a half-open breaker;
+        outcomes of calls started before the last state change are dropped.
+
+        Args:
+            success (bool): Whether the call succeeded.
+            elapsed (float): Seconds the call took.
+            token (object): The token allow returned for the call.
+        """
+        slow = elapsed >= self.slow_call
+        with self._lock:
+            if token is self._trial:
+                self._trial = None
+                if success and not slow:
+                    self.state = CLOSED
+                    self._generation = object()
+                    self._calls.clear()
+                else:
+                    self._open()
+                return
+            if self.state != CLOSED or token is not self._generation:
+                return
+            self._calls.append((success, slow))
+            if len(self._calls) >= self.min_calls:
+                failures = sum(1 for ok, _ in self._calls if not ok) / len(self._calls)
+                slow_calls = sum(1 for _, is_slow in self._calls if is_slow) / len(self._calls)
+                if failures >= self.failure_rate or slow_calls >= self.slow_rate:
+                    self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self._generation = object()
+        self._opened_at = time.monotonic()
+        self._calls.clear()
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        """
+        Calls the backend through the breaker.
+
+        Args:
+            fn (Callable[[], Any]): The backend call.
+
+        Returns:
+            Any: The result of fn.
+
+        Raises:
+            CircuitOpenError: If the breaker is open.
+        """
+        token = self.allow()
+        if token is None:
+            raise CircuitOpenError(f"Circuit for {self.name} is open")
+        start = time.monotonic()
+        try:
+            result = fn()
+        except BaseException:
+            self.record(False, time.monotonic() - start, token)
+            raise
+        self.record(True, time.monotonic() - start, token)
+        return result
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Awaits the backend through the breaker.
+
+        Args:
+            fn (Callable[[], Awaitable[Any]]): Returns the backend coroutine.
+
+        Returns:
+            Any: The result of the coroutine.
+
+        Raises:
+            CircuitOpenError: If the breaker is open.
+        """
+        token = self.allow()
+        if token is None:
+            raise CircuitOpenError(f"Circuit for {self.name} is open")
+        start = time.monotonic()
+        try:
+            result = await fn()
+        except BaseException:
+            self.record(False, time.monotonic() - start, token)
+            raise
+        self.record(True, time.monotonic() - start, token)
+        return result
+
+BREAKER_ENABLED = os.environ.get("breaker_enabled", "true").lower() == "true"
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+fallbacks: Counter = Counter()
+
+def get_breaker(backend: str) -> CircuitBreaker:
+    """
+    Returns the breaker for a backend, creating it on first use.
+
+    Args:
+        backend (str): "search", "answer" or "conversation".
+
+    Returns:
+        CircuitBreaker: The breaker shared by every request on this instance.
+    """
+    breaker = _breakers.get(backend)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(backend, CircuitBreaker.from_env(backend))
+    return breaker
+
+def call_backend(backend: str, fn: Callable[[], Any]) -> Any:
+    if not BREAKER_ENABLED:
+        return fn()
+    return get_breaker(backend).call(fn)
+
+async def acall_backend(backend: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+    if not BREAKER_ENABLED:
+        return await fn()
+    return await get_breaker(backend).acall(fn)
+
+def record_fallback(route: str, tier: str):
+    with _breakers_lock:
+        fallbacks[(route, tier)] += 1
+
+metrics.register_gauge(
+    "breaker_state", "Circuit breaker state per backend (0 closed, 1 half open, 2 open).",
+    lambda: {(("backend", name),): STATE_VALUES[b.state] for name, b in list(_breakers.items())},
+)
+metrics.register_gauge(
+    "breaker_rejected_total", "Calls rejected by an open circuit breaker.",
+    lambda: {(("backend", name),): b.rejected for name, b in list(_breakers.items())},
+    metric_type="counter",
+)
+metrics.register_gauge(
+    "fallback_responses_total", "Responses served by a fallback tier.",
+    lambda: {(("route", route), ("tier", tier)): count for (route, tier), count in list(fallbacks.items())},
+    metric_type="counter",
+)
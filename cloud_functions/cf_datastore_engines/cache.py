@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+DEFAULT_MAX_SIZE = 1024
+DEFAULT_TTL = 300
+
+class CacheBackend:
+    """
+    Interface for a cache tier shared across Cloud Function instances.
+    """
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def get_with_ttl(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[float]]:
+        """
+        Gets a value and the seconds it has left.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            Tuple[Optional[Dict[str, Any]], Optional[float]]: The value, or None on a miss, and its
+                remaining TTL, or None if the backend does not know it.
+        """
+        return self.get(key), None
+
+    def set(self, key: str, value: Dict[str, Any], ttl: float):
+        raise NotImplementedError
+
+class RedisBackend(CacheBackend):
+    """
+    A cache backend for any client exposing Redis `get`, `pttl`, `setex` and `pipeline`.
+
+    Works with redis.Redis as well as local stand-ins such as fakeredis.
+    """
+
+    def __init__(self, client, prefix: str = "ds_cache:"):
+        """
+        Initializes the backend.
+
+        Args:
+            client (Any): A Redis-compatible client.
+            prefix (str, optional): Prefix for every key. Defaults to "ds_cache:".
+        """
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def get_with_ttl(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[float]]:
+        pipeline = self.client.pipeline()
+        pipeline.get(self.prefix + key)
+        pipeline.pttl(self.prefix + key)
+        value, pttl = pipeline.execute()
+        if value is None:
+            return None, None
+        # PTTL is -1 for a key without an expiry.
+        return json.loads(value), pttl / 1000 if pttl >= 0 else None
+
+    def set(self, key: str, value: Dict[str, Any], ttl: float):
+        self.client.setex(self.prefix + key, max(int(ttl), 1), json.dumps(value))
+
+class ResponseCache:
+    """
+    A thread-safe, bounded in-process cache with LRU and TTL eviction.
+
+    Entries are keyed by route and by the normalized utterance from
+    get_utterance, and an optional backend is consulted on a local miss.
+    """
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_MAX_SIZE,
+        default_ttl: float = DEFAULT_TTL,
+        ttls: Dict[str, float] = None,
+        backend: CacheBackend = None,
+    ):
+        """
+        Initializes the cache.
+
+        Args:
+            max_size (int, optional): Maximum number of local entries. Defaults to 1024.
+            default_ttl (float, optional): Seconds an entry lives. Defaults to 300.
+            ttls (Dict[str, float], optional): Per-route TTL overrides. Defaults to None.
+            backend (CacheBackend, optional): A shared cache tier. Defaults to None.
+        """
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build_key(route: str, datastore_id: str, utterance: str) -> str:
+        return f"{route}:{datastore_id}:{utterance}"
+
+    def get_ttl(self, route: str) -> float:
+        return self.ttls.get(route, self.default_ttl)
+
+    def get(
+        self, route: str, datastore_id: str, utterance: str, stale: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Gets a cached response.
+
+        Expired local entries stay until LRU eviction, so they can still be
+        served with `stale` when the backend is failing.
+
+        Args:
+            route (str): The route name, e.g. "search" or "answer".
+            datastore_id (str): The data store the response came from.
+            utterance (str): The normalized utterance.
+            stale (bool, optional): Return an expired local entry instead of missing. Defaults to False.
+
+        Returns:
+            Optional[Dict[str, Any]]: The cached response, or None on a miss.
+        """
+        key = self.build_key(route, datastore_id, utterance)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and (stale or entry[0] > now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        value, ttl = None, None
+        if self.backend:
+            try:
+                value, ttl = self.backend.get_with_ttl(key)
+            except Exception as e:
+                logging.error(f"Failed to read from the cache backend: {e}")
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # The local copy expires with the shared entry, not a full TTL after this read.
+            ttl = self.get_ttl(route) if ttl is None else min(ttl, self.get_ttl(route))
+            self._store(key, value, now + ttl)
+        return value
+
+    def contains(self, route: str, datastore_id: str, utterance: str) -> bool:
+        """
+        Checks for a fresh local entry without counting a hit or miss.
+
+        Args:
+            route (str): The route name, e.g. "search" or "answer".
+            datastore_id (str): The data store the response came from.
+            utterance (str): The normalized utterance.
+
+        Returns:
+            bool: True if the local tier holds an unexpired entry.
+        """
+        key = self.build_key(route, datastore_id, utterance)
+        with self._lock:
+            entry = self._entries.get(key)
+            return bool(entry) and entry[0] > time.monotonic()
+
+    def set(self, route: str, datastore_id: str, utterance: str, value: Dict[str, Any]):
+        """
+        Caches a response.
+
+        Args:
+            route (str): The route name, e.g. "search" or "answer".
+            datastore_id (str): The data store the response came from.
+            utterance (str): The normalized utterance.
+            value (Dict[str, Any]): The parsed route response.
+        """
+        key = self.build_key(route, datastore_id, utterance)
+        ttl = self.get_ttl(route)
+        with self._lock:
+            self._store(key, value, time.monotonic() + ttl)
+        if self.backend:
+            try:
+                self.backend.set(key, value, ttl)
+            except Exception as e:
+                logging.error(f"Failed to write to the cache backend: {e}")
+
+    def _store(self, key: str, value: Dict[str, Any], expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the cache counters.
+
+        Returns:
+            Dict[str, Any]: Hits, misses, hit rate and current size.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+            }
+
+def build_backend_from_env() -> Optional[CacheBackend]:
+    """
+    Builds the shared cache backend configured by `cache_redis_url`.
+
+    Returns:
+        Optional[CacheBackend]: A RedisBackend, or None if no URL is configured.
+    """
+    redis_url = os.environ.get("cache_redis_url")
+    if not redis_url:
+        return None
+    import redis
+    return RedisBackend(redis.Redis.from_url(redis_url))
+
+response_cache = ResponseCache(
+    max_size=int(os.environ.get("cache_max_size", DEFAULT_MAX_SIZE)),
+    default_ttl=float(os.environ.get("cache_ttl", DEFAULT_TTL)),
+    ttls={
+        "search": float(os.environ.get("cache_ttl_search", DEFAULT_TTL)),
+        "answer": float(os.environ.get("cache_ttl_answer", DEFAULT_TTL)),
+    },
+    backend=build_backend_from_env(),
+)
+CACHE_ENABLED = os.environ.get("cache_enabled", "true").lower() == "true"
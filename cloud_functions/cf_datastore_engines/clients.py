@@ -0,0 +1,150 @@
+import threading
+import logging
+from typing import Dict, Any, List, Optional, Tuple, Type
+
+SCOPES = [
+    "https://www.googleapis.com/auth/cloud-platform",
+    "https://www.googleapis.com/auth/dialogflow",
+]
+
+def load_credentials(
+    creds_path: str = None,
+    creds_dict: Dict = None,
+    creds=None,
+    scope: Optional[List[str]] = None,
+):
+    """
+    Resolves and refreshes credentials the way dfcx_scrapi's ScrapiBase does.
+
+    dfcx_scrapi imports Vertex AI and google-genai at module load, which is
+    most of the cold start, so only google.auth is used here.
+
+    Args:
+        creds_path (str, optional): Path to a service account JSON file. Defaults to None.
+        creds_dict (Dict, optional): Service account info. Defaults to None.
+        creds (Any, optional): A credentials object to use as is. Defaults to None.
+        scope (List[str], optional): Scopes to request on top of SCOPES. Defaults to None.
+
+    Returns:
+        Any: The refreshed credentials.
+    """
+    from google.auth import default
+    from google.auth.transport.requests import Request
+    from google.oauth2 import service_account
+
+    scopes = SCOPES + list(scope or [])
+    if creds is None and creds_path:
+        creds = service_account.Credentials.from_service_account_file(creds_path, scopes=scopes)
+    elif creds is None and creds_dict:
+        creds = service_account.Credentials.from_service_account_info(creds_dict, scopes=scopes)
+    elif creds is None:
+        creds, _ = default()
+        if creds.requires_scopes:
+            creds = creds.with_scopes(scopes)
+    creds.refresh(Request())
+    return creds
+
+def get_client_options(resource_id: str) -> Dict[str, str]:
+    """
+    Gets the regional API endpoint and quota project of a Discovery Engine resource.
+
+    Args:
+        resource_id (str): A resource name starting with projects/<project>/locations/<location>.
+
+    Returns:
+        Dict[str, str]: The api_endpoint and quota_project_id client options.
+    """
+    try:
+        project_id, location = resource_id.split("/")[1], resource_id.split("/")[3]
+    except IndexError:
+        logging.error(f"Please provide the fully qualified Resource ID: {resource_id}")
+        raise
+    api_endpoint = "discoveryengine.googleapis.com:443"
+    if location != "global":
+        api_endpoint = f"{location}-{api_endpoint}"
+    return {"api_endpoint": api_endpoint, "quota_project_id": project_id}
+
+class ClientPool:
+    """
+    A thread-safe pool of Discovery Engine service clients.
+
+    Each client owns a gRPC channel, so building one per request pays the
+    channel setup, TLS handshake and auth on every call. The pool keeps one
+    client per (client class, api endpoint, credentials) for the lifetime of
+    the Cloud Function instance.
+    """
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, str, int], Tuple[Any, Any]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def build_key(client_cls: Type, credentials, client_options) -> Tuple[str, str, int]:
+        """
+        Builds the pool key for a client.
+
+        Args:
+            client_cls (Type): The service client class.
+            credentials (Any): The credentials object used by the client.
+            client_options (Any): The client options from get_client_options.
+
+        Returns:
+            Tuple[str, str, int]: The key identifying a reusable client.
+        """
+        if isinstance(client_options, dict):
+            api_endpoint = client_options.get("api_endpoint", None)
+        else:
+            api_endpoint = getattr(client_options, "api_endpoint", None)
+        return (client_cls.__name__, api_endpoint, id(credentials))
+
+    def get(self, client_cls: Type, credentials=None, client_options=None):
+        """
+        Returns a pooled client, creating it on first use.
+
+        Args:
+            client_cls (Type): The service client class, e.g. SearchServiceClient.
+            credentials (Any, optional): The credentials object. Defaults to None.
+            client_options (Any, optional): The client options for the endpoint. Defaults to None.
+
+        Returns:
+            Any: An instance of client_cls shared by all callers with the same key.
+        """
+        key = self.build_key(client_cls, credentials, client_options)
+        entry = self._clients.get(key)
+        if entry:
+            return entry[0]
+        with self._lock:
+            entry = self._clients.get(key)
+            if not entry:
+                logging.info(f"Creating {key[0]} for endpoint {key[1]}")
+                client = self.create(client_cls, credentials, client_options)
+                # Keep a reference to the credentials so id() stays unique.
+                entry = (client, credentials)
+                self._clients[key] = entry
+        return entry[0]
+
+    def create(self, client_cls: Type, credentials=None, client_options=None):
+        """
+        Builds a new client.
+
+        Args:
+            client_cls (Type): The service client class.
+            credentials (Any, optional): The credentials object. Defaults to None.
+            client_options (Any, optional): The client options for the endpoint. Defaults to None.
+
+        Returns:
+            Any: A new instance of client_cls.
+        """
+        return client_cls(credentials=credentials, client_options=client_options)
+
+    def clear(self):
+        """
+        Drops every pooled client.
+        """
+        with self._lock:
+            self._clients.clear()
+
+    def __len__(self):
+        return len(self._clients)
+
+client_pool = ClientPool()
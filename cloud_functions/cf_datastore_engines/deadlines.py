@@ -0,0 +1,135 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Any, Callable, Optional
+from google.api_core import exceptions
+
+# Dialogflow CX cancels a webhook after 5 seconds by default.
+DEFAULT_WEBHOOK_DEADLINE = 4.5
+MIN_RPC_TIMEOUT = 0.05
+MAX_ATTEMPTS = 3
+INITIAL_BACKOFF = 0.1
+MAX_BACKOFF = 1.0
+
+TRANSIENT_ERRORS = (
+    exceptions.ServiceUnavailable,
+    exceptions.TooManyRequests,
+    exceptions.InternalServerError,
+    exceptions.Aborted,
+)
+
+class Deadline:
+    """
+    The time budget of a single webhook request.
+    """
+
+    def __init__(self, timeout: float):
+        """
+        Initializes the deadline.
+
+        Args:
+            timeout (float): Seconds from now until the request must be answered.
+        """
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+
+    @classmethod
+    def from_env(cls) -> "Deadline":
+        """
+        Builds a deadline from the `webhook_deadline` environment variable.
+
+        Returns:
+            Deadline: A deadline starting now.
+        """
+        return cls(float(os.environ.get("webhook_deadline", DEFAULT_WEBHOOK_DEADLINE)))
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() < MIN_RPC_TIMEOUT
+
+def get_backoff(attempt: int, deadline: Deadline) -> Optional[float]:
+    """
+    Picks a full-jitter backoff for a retry, or None if it would exhaust the deadline.
+
+    Args:
+        attempt (int): The number of attempts made so far.
+        deadline (Deadline): The request deadline.
+
+    Returns:
+        Optional[float]: Seconds to sleep before retrying, or None to stop retrying.
+    """
+    if attempt >= MAX_ATTEMPTS:
+        return None
+    backoff = random.uniform(0, min(INITIAL_BACKOFF * 2 ** (attempt - 1), MAX_BACKOFF))
+    if backoff >= deadline.remaining() - MIN_RPC_TIMEOUT:
+        return None
+    return backoff
+
+def call_with_deadline(rpc: Callable, request: Any, deadline: Optional[Deadline] = None) -> Any:
+    """
+    Calls a Discovery Engine RPC with the time left in the request deadline.
+
+    Transient errors are retried with jittered exponential backoff until the
+    attempts or the deadline run out.
+
+    Args:
+        rpc (Callable): A client method such as SearchServiceClient.search.
+        request (Any): The request message.
+        deadline (Optional[Deadline]): The request deadline. Defaults to None for no timeout.
+
+    Returns:
+        Any: The RPC response.
+
+    Raises:
+        google.api_core.exceptions.DeadlineExceeded: If the deadline expired before a response.
+    """
+    if deadline is None:
+        return rpc(request)
+    attempt = 0
+    while True:
+        if deadline.expired():
+            raise exceptions.DeadlineExceeded("Webhook deadline exhausted before the RPC")
+        attempt += 1
+        try:
+            return rpc(request, timeout=deadline.remaining(), retry=None)
+        except TRANSIENT_ERRORS as e:
+            backoff = get_backoff(attempt, deadline)
+            if backoff is None:
+                raise
+            logging.warning(f"Retrying after attempt {attempt} failed: {e}")
+            time.sleep(backoff)
+
+async def acall_with_deadline(rpc: Callable, request: Any, deadline: Optional[Deadline] = None) -> Any:
+    """
+    Awaits an async Discovery Engine RPC with the time left in the request deadline.
+
+    Args:
+        rpc (Callable): An async client method such as SearchServiceAsyncClient.search.
+        request (Any): The request message.
+        deadline (Optional[Deadline]): The request deadline. Defaults to None for no timeout.
+
+    Returns:
+        Any: The RPC response.
+
+    Raises:
+        google.api_core.exceptions.DeadlineExceeded: If the deadline expired before a response.
+    """
+    if deadline is None:
+        return await rpc(request)
+    attempt = 0
+    while True:
+        if deadline.expired():
+            raise exceptions.DeadlineExceeded("Webhook deadline exhausted before the RPC")
+        attempt += 1
+        try:
+            return await rpc(request, timeout=deadline.remaining(), retry=None)
+        except TRANSIENT_ERRORS as e:
+            backoff = get_backoff(attempt, deadline)
+            if backoff is None:
+                raise
+            logging.warning(f"Retrying after attempt {attempt} failed: {e}")
+            await asyncio.sleep(backoff)
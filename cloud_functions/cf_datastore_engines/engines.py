@@ -13,10 +13,14 @@ from google.cloud.discoveryengine import (
     ConversationalSearchServiceClient,
     ConverseConversationRequest
     )
+# Loaded with google.cloud.discoveryengine already, so importing it here is free.
 from google.cloud.discoveryengine_v1beta import types
-from dfcx_scrapi.core import scrapi_base
+from clients import client_pool, ClientPool, load_credentials, get_client_options
+from deadlines import Deadline, call_with_deadline
+from timing import span
+from hedging import HedgePolicy
 
-class Engines(scrapi_base.ScrapiBase):
+class Engines:
     """
     A class to interact with Google Cloud Discovery Engine Search APIs.
     """
@@ -27,6 +31,8 @@ class Engines(scrapi_base.ScrapiBase):
         creds_dict: Dict = None,
         creds=None,
         scope=False,
+        pool: ClientPool = None,
+        hedge_policy: HedgePolicy = None,
     ):
         """
         Initializes the Search class with credentials.
@@ -36,12 +42,69 @@ class Engines(scrapi_base.ScrapiBase):
             creds_dict (Dict, optional): Dictionary containing credentials. Defaults to None.
             creds (Any, optional): Credentials object. Defaults to None.
             scope (bool, optional): Whether to use scope. Defaults to False.
+            pool (ClientPool, optional): Pool of service clients. Defaults to the process-wide pool.
+            hedge_policy (HedgePolicy, optional): Hedges slow search and answer RPCs. Defaults to None.
         """
-        super().__init__(
+        self.creds = load_credentials(
             creds_path=creds_path,
             creds_dict=creds_dict,
             creds=creds,
-            scope=scope,
+            scope=scope or None,
+        )
+        self.pool = pool if pool is not None else client_pool
+        self.hedge_policy = hedge_policy
+
+    @staticmethod
+    def _client_options_discovery_engine(resource_id: str) -> Dict[str, str]:
+        return get_client_options(resource_id)
+
+    def hedge(self, operation: str, fn):
+        """
+        Calls fn through the hedge policy, if one is configured.
+
+        Args:
+            operation (str): The operation name, e.g. "search" or "answer".
+            fn (Callable[[], Any]): The idempotent call to make.
+
+        Returns:
+            Any: The result of fn.
+        """
+        if self.hedge_policy is None:
+            return fn()
+        return self.hedge_policy.call(operation, fn)
+
+    def get_search_client(self, serving_config: str) -> SearchServiceClient:
+        """
+        Returns a pooled SearchServiceClient for the serving config's endpoint.
+
+        Args:
+            serving_config (str): The serving config resource name.
+
+        Returns:
+            SearchServiceClient: A client shared across requests on this instance.
+        """
+        client_options = self._client_options_discovery_engine(serving_config)
+        return self.pool.get(
+            SearchServiceClient, credentials=self.creds, client_options=client_options
+        )
+
+    def get_conversational_client(
+        self, serving_config: str
+    ) -> ConversationalSearchServiceClient:
+        """
+        Returns a pooled ConversationalSearchServiceClient for the serving config's endpoint.
+
+        Args:
+            serving_config (str): The serving config resource name.
+
+        Returns:
+            ConversationalSearchServiceClient: A client shared across requests on this instance.
+        """
+        client_options = self._client_options_discovery_engine(serving_config)
+        return self.pool.get(
+            ConversationalSearchServiceClient,
+            credentials=self.creds,
+            client_options=client_options,
         )
 
     @staticmethod
@@ -257,8 +320,60 @@ class Engines(scrapi_base.ScrapiBase):
         else:
             return None
 
+    def build_search_request(self, search_config: Dict[str, Any]) -> SearchRequest:
+        """
+        Builds a SearchRequest from a search config dictionary.
+
+        Args:
+            search_config (Dict[str, Any]): Dictionary containing search request parameters.
+                See query_by_search for the supported keys.
+
+        Returns:
+            SearchRequest: The request to send to the Search API.
+        """
+        serving_config = (
+            f"{search_config.get('data_store_id', None)}"
+            "/servingConfigs/default_serving_config"
+        )
+
+        branch_stub = "/".join(serving_config.split("/")[0:8])
+        branch = branch_stub + "/branches/0"
+
+        request = SearchRequest(
+            serving_config=serving_config,
+            branch=branch,
+            query=search_config.get("query", None),
+            image_query=self.build_image_query(search_config),
+            page_size=search_config.get("page_size", 10),
+            page_token=search_config.get("page_token", None),
+            offset=search_config.get("offset", 0),
+            filter=search_config.get("filter", None),
+            canonical_filter=search_config.get("canonical_filter", None),
+            order_by=search_config.get("order_by", None),
+            user_info=self.build_user_info(search_config),
+            facet_specs=self.build_facet_specs(search_config),
+            boost_spec=self.build_boost_spec(search_config),
+            params=search_config.get("params", None),
+            query_expansion_spec=self.build_query_expansion_spec(search_config),
+            spell_correction_spec=self.build_spell_correction_spec(
+                search_config
+            ),
+            user_pseudo_id=search_config.get("user_pseudo_id", None),
+            content_search_spec=self.build_content_search_spec(search_config),
+            embedding_spec=self.build_embedding_spec(search_config),
+            ranking_expression=search_config.get("ranking_expression", None),
+            safe_search=search_config.get("safe_search", False),
+            user_labels=search_config.get("user_labels", None),
+        )
+
+        return request
+
 	# pylint: disable=C0301
-    def query_by_search(self, search_config: Dict[str, Any], total_results: int = 10):
+    def query_by_search(
+        self,
+        search_config: Dict[str, Any],
+        total_results: int = 10,
+        deadline: Deadline = None):
         """Performs a search against an indexed Vertex Data Store.
 
         Args:
@@ -296,76 +411,85 @@ class Engines(scrapi_base.ScrapiBase):
 			total_results: Total number of results to return for the search. If
 				not specified, will default to 10 results. Increasing this to a
 				high number can result in long search times.
+            deadline (Deadline, optional): The request deadline bounding the RPC and its retries. Defaults to None.
 
         Returns:
                 A List of SearchResponse objects.
         """
-        serving_config = (
-            f"{search_config.get('data_store_id', None)}"
-            "/servingConfigs/default_serving_config"
-        )
+        with span("build_request"):
+            request = self.build_search_request(search_config)
+        return self.run_search(request, total_results, deadline)
 
-        branch_stub = "/".join(serving_config.split("/")[0:8])
-        branch = branch_stub + "/branches/0"
+    def query_by_profile(
+        self,
+        profile,
+        query: str,
+        total_results: int = None,
+        deadline: Deadline = None,
+        **request_fields):
+        """
+        Performs a search with a compiled SearchProfile.
 
-        request = SearchRequest(
-            serving_config=serving_config,
-            branch=branch,
-            query=search_config.get("query", None),
-            image_query=self.build_image_query(search_config),
-            page_size=search_config.get("page_size", 10),
-            page_token=search_config.get("page_token", None),
-            offset=search_config.get("offset", 0),
-            filter=search_config.get("filter", None),
-            canonical_filter=search_config.get("canonical_filter", None),
-            order_by=search_config.get("order_by", None),
-            user_info=self.build_user_info(search_config),
-            facet_specs=self.build_facet_specs(search_config),
-            boost_spec=self.build_boost_spec(search_config),
-            params=search_config.get("params", None),
-            query_expansion_spec=self.build_query_expansion_spec(search_config),
-            spell_correction_spec=self.build_spell_correction_spec(
-                search_config
-            ),
-            user_pseudo_id=search_config.get("user_pseudo_id", None),
-            content_search_spec=self.build_content_search_spec(search_config),
-            embedding_spec=self.build_embedding_spec(search_config),
-            ranking_expression=search_config.get("ranking_expression", None),
-            safe_search=search_config.get("safe_search", False),
-            user_labels=search_config.get("user_labels", None),
-        )
+        Args:
+            profile (SearchProfile): The compiled static search configuration.
+            query (str): The search query string.
+            total_results (int, optional): Total number of results to return. Defaults to the profile's value.
+            deadline (Deadline, optional): The request deadline bounding the RPC and its retries. Defaults to None.
+            **request_fields: Per-request fields accepted by SearchProfile.build_request.
 
-        client_options = self._client_options_discovery_engine(serving_config)
-        client = SearchServiceClient(
-            credentials=self.creds, client_options=client_options
-        )
-        response = client.search(request)
+        Returns:
+                A List of SearchResponse objects.
+        """
+        with span("build_request"):
+            request = profile.build_request(query, **request_fields)
+        return self.run_search(request, total_results or profile.total_results, deadline)
 
-        all_results = []
-        for search_result in response:
-            if len(all_results) < total_results:
-                all_results.append(search_result)
-            else:
-                break
+    def run_search(
+        self,
+        request: SearchRequest,
+        total_results: int = 10,
+        deadline: Deadline = None):
+        """
+        Sends a SearchRequest and collects the results.
 
-        return all_results
+        Args:
+            request (SearchRequest): The request to send to the Search API.
+            total_results (int, optional): Total number of results to return. Defaults to 10.
+            deadline (Deadline, optional): The request deadline bounding the RPC and its retries. Defaults to None.
 
-    def query_by_answer(
+        Returns:
+                A List of SearchResponse objects.
+        """
+        client = self.get_search_client(request.serving_config)
+
+        def search():
+            response = call_with_deadline(client.search, request, deadline)
+
+            all_results = []
+            for search_result in response:
+                if len(all_results) < total_results:
+                    all_results.append(search_result)
+                else:
+                    break
+
+            return all_results
+
+        with span("rpc"):
+            return self.hedge("search", search)
+
+    def build_answer_request(
         self,
         answer_config: Dict[str, Any],
-        total_results: int = 10,
-        related_question: bool = False):
+        related_question: bool = False) -> AnswerQueryRequest:
         """
-        Queries for an answer and related questions using Discovery Engine's AnswerQuery API.
+        Builds an AnswerQueryRequest from an answer config dictionary.
 
         Args:
             answer_config (Dict[str, Any]): A dictionary containing configuration parameters for the AnswerQueryRequest.
-                Must include 'data_store_id' and 'query'. Can also include 'user_labels' and 'session'.
-            total_results (int, optional): The total number of results to return. Defaults to 10.
             related_question (bool, optional): Whether to enable related questions in the response. Defaults to False.
 
         Returns:
-            google.cloud.discoveryengine_v1beta.types.AnswerQueryResponse: The response from the AnswerQuery API.
+            AnswerQueryRequest: The request to send to the AnswerQuery API.
         """
         serving_config = (
             f"{answer_config.get('data_store_id', None)}"
@@ -381,29 +505,51 @@ class Engines(scrapi_base.ScrapiBase):
             session=answer_config.get("session", None)
         )
         request.related_questions_spec.enable = related_question
-        client_options = self._client_options_discovery_engine(serving_config)
-        client = ConversationalSearchServiceClient(
-            credentials=self.creds, client_options=client_options
-        )
-        response = client.answer_query(request)
+        return request
+
+    def query_by_answer(
+        self,
+        answer_config: Dict[str, Any],
+        total_results: int = 10,
+        related_question: bool = False,
+        deadline: Deadline = None):
+        """
+        Queries for an answer and related questions using Discovery Engine's AnswerQuery API.
+
+        Args:
+            answer_config (Dict[str, Any]): A dictionary containing configuration parameters for the AnswerQueryRequest.
+                Must include 'data_store_id' and 'query'. Can also include 'user_labels' and 'session'.
+            total_results (int, optional): The total number of results to return. Defaults to 10.
+            related_question (bool, optional): Whether to enable related questions in the response. Defaults to False.
+            deadline (Deadline, optional): The request deadline bounding the RPC and its retries. Defaults to None.
+
+        Returns:
+            google.cloud.discoveryengine_v1beta.types.AnswerQueryResponse: The response from the AnswerQuery API.
+        """
+        with span("build_request"):
+            request = self.build_answer_request(answer_config, related_question)
+        client = self.get_conversational_client(request.serving_config)
+        with span("rpc"):
+            response = self.hedge(
+                "answer", lambda: call_with_deadline(client.answer_query, request, deadline)
+            )
         return response
 
-    def query_by_conversation(
+    def build_conversation_request(
         self,
         conv_config: Dict[str, Any],
         conversation: types.conversation = None,
-        ):
+        ) -> ConverseConversationRequest:
         """
-        Queries for a conversation using Discovery Engine's ConverseConversation API.
+        Builds a ConverseConversationRequest from a conversation config dictionary.
 
         Args:
             conv_config (Dict[str, Any]): A dictionary containing configuration parameters for the ConverseConversationRequest.
-                Must include 'data_store_id' and 'query'.
             conversation (google.cloud.discoveryengine_v1beta.types.conversation, optional): An existing Conversation object.
-                If provided, the query is added to this conversation. Otherwise, a new conversation is started. Defaults to None.
+                Defaults to None.
 
         Returns:
-            google.cloud.discoveryengine_v1beta.types.ConverseConversationResponse: The response from the ConverseConversation API.
+            ConverseConversationRequest: The request to send to the ConverseConversation API.
         """
         serving_config = (
             f"{conv_config.get('data_store_id', None)}"
@@ -421,10 +567,31 @@ class Engines(scrapi_base.ScrapiBase):
             conversation=conversation
         )
 
-        client_options = self._client_options_discovery_engine(serving_config)
-        client = ConversationalSearchServiceClient(
-            credentials=self.creds, client_options=client_options
-        )
-        response = client.converse_conversation(request)
+        return request
+
+    def query_by_conversation(
+        self,
+        conv_config: Dict[str, Any],
+        conversation: types.conversation = None,
+        deadline: Deadline = None,
+        ):
+        """
+        Queries for a conversation using Discovery Engine's ConverseConversation API.
+
+        Args:
+            conv_config (Dict[str, Any]): A dictionary containing configuration parameters for the ConverseConversationRequest.
+                Must include 'data_store_id' and 'query'.
+            conversation (google.cloud.discoveryengine_v1beta.types.conversation, optional): An existing Conversation object.
+                If provided, the query is added to this conversation. Otherwise, a new conversation is started. Defaults to None.
+            deadline (Deadline, optional): The request deadline bounding the RPC and its retries. Defaults to None.
+
+        Returns:
+            google.cloud.discoveryengine_v1beta.types.ConverseConversationResponse: The response from the ConverseConversation API.
+        """
+        with span("build_request"):
+            request = self.build_conversation_request(conv_config, conversation)
+        client = self.get_conversational_client(request.serving_config)
+        with span("rpc"):
+            response = call_with_deadline(client.converse_conversation, request, deadline)
 
         return response
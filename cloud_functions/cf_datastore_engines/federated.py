@@ -0,0 +1,270 @@
+import os
+import asyncio
+import logging
+from concurrent import futures
+from typing import Optional, Dict, Any, List, Tuple
+
+from engines import Engines
+from deadlines import Deadline
+from breaker import call_backend, acall_backend
+
+DEFAULT_DEADLINE = 2.0
+DEFAULT_FUSION = "rrf"
+RRF_K = 60
+
+_executor = futures.ThreadPoolExecutor(
+    max_workers=int(os.environ.get("federated_max_workers", 16)),
+    thread_name_prefix="federated-search",
+)
+
+def get_datastore_ids() -> List[str]:
+    """
+    Gets the data stores to search from the environment.
+
+    Reads the comma-separated `datastore_ids` variable and falls back to the
+    single `datastore_id` variable.
+
+    Returns:
+        List[str]: The full resource names of the data stores.
+    """
+    datastore_ids = os.environ.get("datastore_ids")
+    if datastore_ids:
+        return [ds.strip() for ds in datastore_ids.split(",") if ds.strip()]
+    datastore_id = os.environ.get("datastore_id")
+    return [datastore_id] if datastore_id else []
+
+def get_result_score(search_result: Any, rank: int) -> float:
+    """
+    Gets the relevance score of a search result.
+
+    Args:
+        search_result (SearchResponse.SearchResult): A single search result.
+        rank (int): The zero-based rank of the result in its data store.
+
+    Returns:
+        float: The model relevance score, or a rank-based score if the data store did not return one.
+    """
+    try:
+        return float(search_result.model_scores["relevance_score"].values[0])
+    except Exception:
+        return 1.0 / (rank + 1)
+
+def get_document_key(search_result: Any) -> Optional[str]:
+    """
+    Gets the identity of the document behind a search result.
+
+    The same document ingested into several data stores keeps its source
+    link and document ID, while its resource name differs per data store.
+
+    Args:
+        search_result (SearchResponse.SearchResult): A single search result.
+
+    Returns:
+        Optional[str]: The document's source link or ID, or None if it has neither.
+    """
+    try:
+        link = search_result.document.derived_struct_data.get("link")
+    except Exception:
+        link = None
+    return link or search_result.document.id or search_result.id or None
+
+def fuse_results(
+    results: Dict[str, List[Any]],
+    fusion: str = DEFAULT_FUSION,
+    datastore_ids: Optional[List[str]] = None,
+) -> List[Tuple[float, str, Any]]:
+    """
+    Merges the per data store result lists into one ranked list.
+
+    Results for the same document are merged across data stores: their
+    reciprocal ranks are summed with "rrf", and the best score is kept with
+    "score". Ties go to the data store listed first, then to the better rank.
+
+    Args:
+        results (Dict[str, List[Any]]): Search results keyed by data store ID.
+        fusion (str, optional): "rrf" for reciprocal-rank fusion or "score" for relevance scores. Defaults to "rrf".
+        datastore_ids (Optional[List[str]]): The data stores in priority order. Defaults to the order of results.
+
+    Returns:
+        List[Tuple[float, str, Any]]: (score, data store ID, search result) sorted best first.
+    """
+    merged: Dict[Tuple[str, ...], List[Any]] = {}
+    for priority, datastore_id in enumerate(datastore_ids or list(results)):
+        for rank, search_result in enumerate(results.get(datastore_id, [])):
+            if fusion == "score":
+                score = get_result_score(search_result, rank)
+            else:
+                score = 1.0 / (RRF_K + rank + 1)
+            document_key = get_document_key(search_result)
+            key = (document_key,) if document_key else (datastore_id, str(rank))
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = [score, (priority, rank), datastore_id, search_result]
+            elif fusion == "score":
+                entry[0] = max(entry[0], score)
+            else:
+                entry[0] += score
+    fused = sorted(merged.values(), key=lambda entry: (-entry[0], entry[1]))
+    return [(score, datastore_id, search_result) for score, _, datastore_id, search_result in fused]
+
+def get_extractive_answer(search_result: Any) -> Optional[str]:
+    """
+    Gets the first extractive answer of a search result.
+
+    Args:
+        search_result (SearchResponse.SearchResult): A single search result.
+
+    Returns:
+        Optional[str]: The extractive answer content, or None if the result has none.
+    """
+    try:
+        return search_result.document.derived_struct_data.get("extractive_answers")[0].get("content")
+    except Exception:
+        return None
+
+def get_backend(datastore_id: str, backend: str = "search") -> str:
+    """
+    Names the circuit breaker of one federated data store, so a failing data store does not open the others.
+    """
+    return f"{backend}:{datastore_id}"
+
+def federated_search(
+    engines: Engines,
+    query: str,
+    profiles: Dict[str, Any],
+    deadline: float = DEFAULT_DEADLINE,
+    fusion: str = DEFAULT_FUSION,
+    total_results: int = 5,
+    request_deadline: Deadline = None,
+    backend: str = "search",
+) -> Dict[str, Any]:
+    """
+    Sends one query to several data stores concurrently and merges the results.
+
+    Each data store is searched with its compiled SearchProfile behind its own
+    circuit breaker. Data stores that have not answered when the deadline
+    expires are skipped, so a slow data store yields partial results instead
+    of a webhook timeout.
+
+    Args:
+        engines (Engines): The Engines object used for every data store.
+        query (str): The search query string.
+        profiles (Dict[str, SearchProfile]): The compiled search profiles keyed by data store ID, in priority order.
+        deadline (float, optional): Seconds to wait for the data stores. Defaults to 2.0.
+        fusion (str, optional): "rrf" or "score". Defaults to "rrf".
+        total_results (int, optional): Results to request from each data store. Defaults to 5.
+        request_deadline (Deadline, optional): The webhook deadline, which caps the data store deadline. Defaults to None.
+        backend (str, optional): The prefix of the per data store circuit breakers. Defaults to "search".
+
+    Returns:
+        Dict[str, Any]: A dictionary containing the best extractive answer and the data stores that responded,
+            or an empty dictionary if no data store returned an extractive answer.
+    """
+    if request_deadline is not None:
+        deadline = min(deadline, request_deadline.remaining())
+    store_deadline = Deadline(deadline)
+    pending = {
+        _executor.submit(
+            call_backend,
+            get_backend(datastore_id, backend),
+            lambda profile=profile: engines.query_by_profile(
+                profile, query=query, total_results=total_results, deadline=store_deadline
+            ),
+        ): datastore_id
+        for datastore_id, profile in profiles.items()
+    }
+    done, not_done = futures.wait(pending, timeout=deadline)
+    for future in not_done:
+        future.cancel()
+        logging.warning(f"Data store {pending[future]} missed the {deadline}s search deadline")
+
+    results: Dict[str, List[Any]] = {}
+    for future in done:
+        datastore_id = pending[future]
+        try:
+            results[datastore_id] = future.result()
+        except Exception as e:
+            logging.error(f"Failed to search data store {datastore_id}: {e}")
+    return build_federated_response(results, fusion, list(profiles), partial=bool(not_done))
+
+async def afederated_search(
+    engines: Engines,
+    query: str,
+    profiles: Dict[str, Any],
+    deadline: float = DEFAULT_DEADLINE,
+    fusion: str = DEFAULT_FUSION,
+    total_results: int = 5,
+    request_deadline: Deadline = None,
+    backend: str = "search",
+) -> Dict[str, Any]:
+    """
+    Sends one query to several data stores concurrently on the event loop. See federated_search.
+
+    Args:
+        engines (AsyncEngines): The AsyncEngines object used for every data store.
+        query (str): The search query string.
+        profiles (Dict[str, SearchProfile]): The compiled search profiles keyed by data store ID, in priority order.
+        deadline (float, optional): Seconds to wait for the data stores. Defaults to 2.0.
+        fusion (str, optional): "rrf" or "score". Defaults to "rrf".
+        total_results (int, optional): Results to request from each data store. Defaults to 5.
+        request_deadline (Deadline, optional): The webhook deadline, which caps the data store deadline. Defaults to None.
+        backend (str, optional): The prefix of the per data store circuit breakers. Defaults to "search".
+
+    Returns:
+        Dict[str, Any]: See federated_search.
+    """
+    if request_deadline is not None:
+        deadline = min(deadline, request_deadline.remaining())
+    store_deadline = Deadline(deadline)
+    pending = {
+        asyncio.ensure_future(acall_backend(
+            get_backend(datastore_id, backend),
+            lambda profile=profile: engines.query_by_profile(
+                profile, query=query, total_results=total_results, deadline=store_deadline
+            ),
+        )): datastore_id
+        for datastore_id, profile in profiles.items()
+    }
+    done, not_done = await asyncio.wait(pending, timeout=deadline)
+    for task in not_done:
+        task.cancel()
+        logging.warning(f"Data store {pending[task]} missed the {deadline}s search deadline")
+
+    results: Dict[str, List[Any]] = {}
+    for task in done:
+        datastore_id = pending[task]
+        try:
+            results[datastore_id] = task.result()
+        except Exception as e:
+            logging.error(f"Failed to search data store {datastore_id}: {e}")
+    return build_federated_response(results, fusion, list(profiles), partial=bool(not_done))
+
+def build_federated_response(
+    results: Dict[str, List[Any]],
+    fusion: str = DEFAULT_FUSION,
+    datastore_ids: Optional[List[str]] = None,
+    partial: bool = False,
+) -> Dict[str, Any]:
+    """
+    Builds the search route response from the results of each data store.
+
+    Args:
+        results (Dict[str, List[Any]]): Search results keyed by data store ID.
+        fusion (str, optional): "rrf" or "score". Defaults to "rrf".
+        datastore_ids (Optional[List[str]]): The data stores in priority order. Defaults to the order of results.
+        partial (bool, optional): Whether some data stores missed the deadline. Defaults to False.
+
+    Returns:
+        Dict[str, Any]: A dictionary containing the best extractive answer and the data stores that responded,
+            or an empty dictionary if no data store returned an extractive answer.
+    """
+    for _, datastore_id, search_result in fuse_results(results, fusion, datastore_ids):
+        content = get_extractive_answer(search_result)
+        if content:
+            return {
+                "search": content,
+                "datastore_id": datastore_id,
+                "responded": sorted(results),
+                "partial": partial,
+            }
+    return {}
@@ -0,0 +1,291 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from bisect import insort
+from collections import deque
+from concurrent import futures
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+DEFAULT_PERCENTILE = 0.95
+DEFAULT_MAX_RATE = 0.1
+DEFAULT_MIN_SAMPLES = 50
+DEFAULT_WINDOW = 1000
+
+class LatencyHistogram:
+    """
+    A sliding window of recent latencies that answers percentile queries.
+    """
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self._samples: deque = deque(maxlen=window)
+        self._sorted = []
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        with self._lock:
+            if len(self._samples) == self._samples.maxlen:
+                self._sorted.remove(self._samples[0])
+            self._samples.append(latency)
+            insort(self._sorted, latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if not self._sorted:
+                return None
+            return self._sorted[min(int(q * len(self._sorted)), len(self._sorted) - 1)]
+
+    def __len__(self):
+        return len(self._samples)
+
+class HedgePolicy:
+    """
+    Sends a duplicate request when the first one is slower than the learned
+    latency percentile, and uses whichever response arrives first.
+
+    Each operation (e.g. "search", "answer") learns its own latency histogram
+    from primary requests. Hedges are capped at max_rate of recent requests.
+    """
+
+    def __init__(
+        self,
+        percentile: float = DEFAULT_PERCENTILE,
+        max_rate: float = DEFAULT_MAX_RATE,
+        min_samples: int = DEFAULT_MIN_SAMPLES,
+        window: int = DEFAULT_WINDOW,
+        max_workers: int = 32,
+    ):
+        """
+        Initializes the policy.
+
+        Args:
+            percentile (float, optional): Latency percentile after which a hedge is sent. Defaults to 0.95.
+            max_rate (float, optional): Maximum fraction of recent requests that may be hedged. Defaults to 0.1.
+            min_samples (int, optional): Samples needed before hedging starts. Defaults to 50.
+            window (int, optional): Number of recent requests remembered. Defaults to 1000.
+            max_workers (int, optional): Threads running hedged requests and their hedges. Defaults to 32.
+        """
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.window = window
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.max_workers = max_workers
+        self.hedged = deque(maxlen=window)
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hedged-rpc"
+        )
+
+    @classmethod
+    def from_env(cls) -> Optional["HedgePolicy"]:
+        """
+        Builds a policy when `hedge_enabled` is true.
+
+        Returns:
+            Optional[HedgePolicy]: The policy, or None if hedging is disabled.
+        """
+        if os.environ.get("hedge_enabled", "false").lower() != "true":
+            return None
+        return cls(
+            percentile=float(os.environ.get("hedge_percentile", DEFAULT_PERCENTILE)),
+            max_rate=float(os.environ.get("hedge_max_rate", DEFAULT_MAX_RATE)),
+            min_samples=int(os.environ.get("hedge_min_samples", DEFAULT_MIN_SAMPLES)),
+            max_workers=int(os.environ.get("hedge_max_workers", 32)),
+        )
+
+    def get_histogram(self, operation: str) -> LatencyHistogram:
+        histogram = self.histograms.get(operation)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(operation, LatencyHistogram(self.window))
+        return histogram
+
+    def get_threshold(self, operation: str) -> Optional[float]:
+        """
+        Gets the delay after which a hedge is sent.
+
+        Args:
+            operation (str): The operation name.
+
+        Returns:
+            Optional[float]: Seconds to wait, or None while too few samples are known.
+        """
+        histogram = self.get_histogram(operation)
+        if len(histogram) < self.min_samples:
+            return None
+        return histogram.percentile(self.percentile)
+
+    def _record_request(self, hedged: bool):
+        with self._lock:
+            self.hedged.append(hedged)
+
+    def _hedge_available(self) -> bool:
+        with self._lock:
+            return sum(self.hedged) < self.max_rate * (len(self.hedged) + 1)
+
+    def _acquire_hedge(self, worker: bool = True) -> bool:
+        """
+        Takes a hedge from the budget and, with worker, a pool worker to run it, if both are free.
+        """
+        with self._lock:
+            allowed = sum(self.hedged) < self.max_rate * (len(self.hedged) + 1)
+            if worker:
+                allowed = allowed and self._busy < self.max_workers
+            self.hedged.append(allowed)
+            if allowed:
+                self.hedges += 1
+                if worker:
+                    self._busy += 1
+            return allowed
+
+    def _acquire_worker(self) -> bool:
+        with self._lock:
+            if self._busy >= self.max_workers:
+                return False
+            self._busy += 1
+            return True
+
+    def _run(self, operation: str, fn: Callable, start: Optional[float]) -> Any:
+        """
+        Runs fn on a pool worker taken by _acquire_worker or _acquire_hedge,
+        recording its latency since start unless start is None.
+        """
+        try:
+            result = fn()
+            if start is not None:
+                self.get_histogram(operation).record(time.monotonic() - start)
+            return result
+        finally:
+            with self._lock:
+                self._busy -= 1
+
+    def call(self, operation: str, fn: Callable[[], Any]) -> Any:
+        """
+        Calls fn, hedging it with a second call if it is slow.
+
+        While no hedge can follow (too few samples, the hedge budget is spent,
+        or every pool worker is busy), fn runs on the caller's thread.
+        Otherwise the primary call and its hedge both run on the pool, and
+        the caller takes whichever response comes first. The losing call is
+        left to finish.
+
+        Args:
+            operation (str): The operation name used for the latency histogram.
+            fn (Callable[[], Any]): The idempotent call to make.
+
+        Returns:
+            Any: The first successful result.
+        """
+        start = time.monotonic()
+        threshold = self.get_threshold(operation)
+        if threshold is None or not self._hedge_available() or not self._acquire_worker():
+            self._record_request(False)
+            result = fn()
+            self.get_histogram(operation).record(time.monotonic() - start)
+            return result
+
+        primary = self._executor.submit(self._run, operation, fn, start)
+        try:
+            result = primary.result(timeout=max(threshold - (time.monotonic() - start), 0))
+        except futures.TimeoutError:
+            pass
+        else:
+            self._record_request(False)
+            return result
+        if not self._acquire_hedge():
+            return primary.result()
+
+        logging.info(f"Hedging {operation} after {threshold:.3f}s")
+        hedge = self._executor.submit(self._run, operation, fn, None)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _record_task(self, task: asyncio.Future, operation: str, start: Optional[float]):
+        """
+        Records a finished task's latency since start unless start is None.
+        """
+        if task.cancelled():
+            return
+        # Retrieving the exception also keeps a losing call's error out of the loop's log.
+        if task.exception() is None and start is not None:
+            self.get_histogram(operation).record(time.monotonic() - start)
+
+    async def acall(self, operation: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Awaits fn, hedging it with a second call if it is slow. See call.
+
+        Both calls are tasks on the running event loop, so hedging takes no
+        threads. As with call, the losing call is left to finish.
+
+        Args:
+            operation (str): The operation name used for the latency histogram.
+            fn (Callable[[], Awaitable[Any]]): Returns the idempotent coroutine to await.
+
+        Returns:
+            Any: The first successful result.
+        """
+        start = time.monotonic()
+        threshold = self.get_threshold(operation)
+        if threshold is None or not self._hedge_available():
+            self._record_request(False)
+            result = await fn()
+            self.get_histogram(operation).record(time.monotonic() - start)
+            return result
+
+        primary = asyncio.ensure_future(fn())
+        primary.add_done_callback(lambda task: self._record_task(task, operation, start))
+        done, _ = await asyncio.wait({primary}, timeout=max(threshold - (time.monotonic() - start), 0))
+        if done:
+            self._record_request(False)
+            return primary.result()
+        if not self._acquire_hedge(worker=False):
+            return await primary
+
+        logging.info(f"Hedging {operation} after {threshold:.3f}s")
+        hedge = asyncio.ensure_future(fn())
+        hedge.add_done_callback(lambda task: self._record_task(task, operation, None))
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the hedging counters and current thresholds.
+
+        Returns:
+            Dict[str, Any]: Hedges sent, hedges that won, recent hedge rate and per-operation thresholds.
+        """
+        with self._lock:
+            rate = sum(self.hedged) / len(self.hedged) if self.hedged else 0.0
+        return {
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": rate,
+            "thresholds": {
+                operation: self.get_threshold(operation) for operation in list(self.histograms)
+            },
+        }
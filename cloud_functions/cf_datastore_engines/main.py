@@ -1,12 +1,19 @@
 import os
+import asyncio
 import logging
-import json
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from typing import Dict, Any, List
-from dfcx_scrapi.tools import webhook_util
 from routers import answer_route_controller, search_route_controller, conversation_route_controller
+from routers import query_by_search, query_by_answer, clean_text
+from batch import run_batch, stream_ndjson
+from deadlines import Deadline
+from cache import response_cache
+from responses import response_builder
+from timing import metrics, span, install_timing, start_request, finish_request, build_server_timing
+from profiling import profile_request, PROFILE_HEADER
 
 app = Flask(__name__)
+install_timing(app)
 
 @app.route('/conversation', methods=['GET', 'POST'])
 def use_conversation():
@@ -20,7 +27,8 @@ def use_conversation():
         str: JSON string of the webhook response.
     """
     response = conversation_route_controller(data=request.get_json())
-    return fetch_wb_for_conversation(response)
+    with span("render"):
+        return fetch_wb_for_conversation(response)
 
 @app.route('/search', methods=['GET', 'POST'])
 def use_search():
@@ -34,7 +42,8 @@ def use_search():
         str: JSON string of the webhook response.
     """
     response = search_route_controller(data=request.get_json())
-    return fetch_wb_for_search(response)
+    with span("render"):
+        return fetch_wb_for_search(response)
 
 @app.route('/answer', methods=['GET', 'POST'])
 def use_answer():
@@ -48,7 +57,100 @@ def use_answer():
         str: JSON string of the webhook response.
     """
     response = answer_route_controller(data=request.get_json())
-    return fetch_wb_for_answer(response)
+    with span("render"):
+        return fetch_wb_for_answer(response)
+
+@app.route('/search/batch', methods=['POST'])
+def use_search_batch():
+    """
+    Handles batch search requests.
+
+    Expects a JSON body with a list of `utterances` and an optional
+    `parallelism`, and streams one NDJSON line per utterance.
+
+    Returns:
+        Response: NDJSON stream of batch items.
+    """
+    data = request.get_json()
+    return fetch_batch_response(
+        data, lambda utterance: query_by_search(
+            query=clean_text(utterance), deadline=get_batch_deadline(), backend="search_batch"
+        )
+    )
+
+@app.route('/answer/batch', methods=['POST'])
+def use_answer_batch():
+    """
+    Handles batch answer requests.
+
+    Expects a JSON body with a list of `utterances` and an optional
+    `parallelism`, and streams one NDJSON line per utterance.
+
+    Returns:
+        Response: NDJSON stream of batch items.
+    """
+    data = request.get_json()
+    return fetch_batch_response(
+        data, lambda utterance: query_by_answer(
+            query=clean_text(utterance), deadline=get_batch_deadline(), backend="answer_batch"
+        )
+    )
+
+def get_batch_deadline() -> Deadline:
+    """
+    Builds the deadline of one batch item.
+
+    Batch requests are not bound by the Dialogflow CX webhook timeout, so
+    each item gets `batch_item_deadline` seconds (default 30) instead of
+    `webhook_deadline`.
+
+    Returns:
+        Deadline: A deadline starting now.
+    """
+    return Deadline(float(os.environ.get("batch_item_deadline", 30.0)))
+
+def fetch_batch_response(data: Dict[str, Any], fn):
+    """
+    Runs a batch request and builds its streaming response.
+
+    Args:
+        data (Dict[str, Any]): The request body with `utterances` and optional `parallelism`.
+        fn (Callable[[str], Dict[str, Any]]): The route query run for every utterance.
+
+    Returns:
+        Response: NDJSON stream of batch items, or a 400 error if there are no utterances
+            or parallelism is not a positive integer.
+    """
+    utterances = (data or {}).get("utterances")
+    if not isinstance(utterances, list):
+        return jsonify({"error": "Request needs a list of utterances"}), 400
+    parallelism = data.get("parallelism")
+    if parallelism is not None and (
+        not isinstance(parallelism, int) or isinstance(parallelism, bool) or parallelism < 1
+    ):
+        return jsonify({"error": "parallelism must be a positive integer"}), 400
+    items = run_batch(utterances, fn, parallelism=parallelism)
+    return Response(stream_ndjson(items), mimetype="application/x-ndjson")
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """
+    Returns the response cache counters.
+
+    Returns:
+        Response: JSON with hits, misses, hit rate and size.
+    """
+    return jsonify(response_cache.stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Returns the per-route stage latency histograms.
+
+    Returns:
+        Response: The metrics in the Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 def fetch_wb_for_conversation(res):
     """
@@ -61,8 +163,7 @@ def fetch_wb_for_conversation(res):
         str: JSON string of the webhook response.
     """
     if res:
-        wbhk_util = webhook_util.WebhookUtil()
-        session_info = wbhk_util.build_session_info(
+        session_info = response_builder.build_session_info(
             parameters={
                 "ds_reply": res["reply"],
                 "ds_summary": res["summary"],
@@ -71,13 +172,11 @@ def fetch_wb_for_conversation(res):
                 
             }
         )
-        wb_response = wbhk_util.build_response(
+        response = response_builder.render(
                 response_text=res["reply"],
                 session_info=session_info,
                 append=True
             )
-        response = json.dumps(wb_response)
-        logging.info(response)
     else:
         return fetch_error_message({
             "ds_error": True,
@@ -96,13 +195,10 @@ def fetch_wb_for_search(res):
         str: JSON string of the webhook response.
     """
     if res:
-        wbhk_util = webhook_util.WebhookUtil()
-        wb_response = wbhk_util.build_response(
+        response = response_builder.render(
                 response_text=res["search"],
                 append=True
             )
-        response = json.dumps(wb_response)
-        logging.info(response)
     else:
         return fetch_error_message({
             "ds_error": True,
@@ -121,8 +217,7 @@ def fetch_wb_for_answer(res):
         str: JSON string of the webhook response.
     """
     if res:
-        wbhk_util = webhook_util.WebhookUtil()
-        session_info = wbhk_util.build_session_info(
+        session_info = response_builder.build_session_info(
             parameters={
                 "ds_answer": res["answer"],
                 "ds_related_questions": res["related_questions"]
@@ -132,13 +227,11 @@ def fetch_wb_for_answer(res):
             session_info["ds_session"] = res["session_id"]
         if "state" in res:
             session_info["ds_state"] = res["state"]
-        wb_response = wbhk_util.build_response(
+        response = response_builder.render(
                 response_text=res["answer"],
                 session_info=session_info,
                 append=True
             )
-        response = json.dumps(wb_response)
-        logging.info(response)
     else:
         return fetch_error_message({
             "ds_error": True,
@@ -156,19 +249,16 @@ def fetch_error_message(error: Dict[str, Any]):
     Returns:
         str: JSON string of the error webhook response.
     """
-    wbhk_util = webhook_util.WebhookUtil()
-    session_info = wbhk_util.build_session_info(
+    session_info = response_builder.build_session_info(
         parameters={
             "ds_error": error["ds_error"],
             "ds_error_message": error["error_message"]
         }
     )
-    wb_response = wbhk_util.build_response(
+    return response_builder.render(
             response_text="Sorry, I am unable to answer your question.",
+            session_info=session_info,
         )
-    response = json.dumps(wb_response)
-    logging.info(response)
-    return response
 
 def hello_http(request):
     """
@@ -181,9 +271,85 @@ def hello_http(request):
         The result of the Flask application's dispatch.
     """
     logging.info(f"Request body is :{request}")
+    return dispatch(request.path, request.method, request.headers, request.data)
+
+def dispatch(path: str, method: str, headers, data: bytes):
+    """
+    Runs a request through the Flask application.
+
+    Args:
+        path (str): The request path.
+        method (str): The HTTP method.
+        headers (Mapping[str, str]): The request headers.
+        data (bytes): The request body.
+
+    Returns:
+        Response: The Flask response.
+    """
     with app.test_request_context(
-        path=request.path, method=request.method, 
-        headers={k: v for k, v in request.headers.items()}, 
-        data=request.data
+        path=path, method=method, 
+        headers={k: v for k, v in headers.items()}, 
+        data=data
     ):
-        return app.full_dispatch_request()
+        return profile_request(headers, app.full_dispatch_request)
+
+async def hello_http_async(request):
+    """
+    Handles HTTP requests when functions-framework serves the function over ASGI.
+
+    The /search, /answer and /conversation webhooks run the async route
+    controllers on the server's event loop, so a request waiting on
+    Discovery Engine holds no thread. Other routes, and requests carrying
+    the profiling header, run through the Flask application in a worker thread.
+
+    Args:
+        request (starlette.requests.Request): The HTTP request object.
+
+    Returns:
+        starlette.responses.Response: The webhook response.
+    """
+    import async_routers
+    from starlette.responses import Response as AsgiResponse
+
+    routes = {
+        "/search": (async_routers.search_route_controller, fetch_wb_for_search),
+        "/answer": (async_routers.answer_route_controller, fetch_wb_for_answer),
+        "/conversation": (async_routers.conversation_route_controller, fetch_wb_for_conversation),
+    }
+    path = request.url.path
+    if path not in routes or request.method not in ("GET", "POST") or PROFILE_HEADER in request.headers:
+        data = await request.body()
+        response = await asyncio.to_thread(dispatch, path, request.method, request.headers, data)
+        return build_asgi_response(response)
+
+    try:
+        data = await request.json()
+    except ValueError:
+        return AsgiResponse("The request body is not valid JSON", status_code=400)
+    controller, render = routes[path]
+    token = start_request()
+    try:
+        response = await controller(data=data)
+        with span("render"):
+            body = render(response)
+    finally:
+        stages = finish_request(path, token)
+    headers = {"Server-Timing": build_server_timing(stages)} if stages else None
+    return AsgiResponse(body, media_type="application/json", headers=headers)
+
+def build_asgi_response(response):
+    """
+    Converts a Flask response for the ASGI server, streaming it if Flask would.
+
+    Args:
+        response (Response): The Flask response.
+
+    Returns:
+        starlette.responses.Response: The same status, headers and body.
+    """
+    from starlette.responses import Response as AsgiResponse, StreamingResponse
+
+    headers = dict(response.headers)
+    if response.is_streamed:
+        return StreamingResponse(response.response, status_code=response.status_code, headers=headers)
+    return AsgiResponse(response.get_data(), status_code=response.status_code, headers=headers)
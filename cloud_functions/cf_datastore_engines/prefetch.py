@@ -0,0 +1,131 @@
+import os
+import time
+import logging
+import threading
+from concurrent import futures
+from typing import Any, Callable, Iterable, Optional
+
+DEFAULT_MAX_WORKERS = 2
+DEFAULT_MAX_PENDING = 8
+DEFAULT_RATE = 2.0
+
+class Prefetcher:
+    """
+    Runs speculative queries in the background under a strict budget.
+
+    A small thread pool bounds concurrency, max_pending bounds queued work,
+    and a token bucket bounds the prefetch rate, so foreground requests are
+    never starved. Work over budget is dropped, not queued.
+
+    Prefetches run after the response is sent. Cloud Functions throttles
+    the CPU of an instance between requests unless CPU is always allocated
+    (`--no-cpu-throttling` on the underlying Cloud Run service), so
+    prefetching is only useful with that setting.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Any],
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        rate: float = DEFAULT_RATE,
+    ):
+        """
+        Initializes the prefetcher.
+
+        Args:
+            fetch (Callable[[str], Any]): Runs and caches one query.
+            max_workers (int, optional): Concurrent prefetches. Defaults to 2.
+            max_pending (int, optional): Prefetches queued or running. Defaults to 8.
+            rate (float, optional): Prefetches started per second on average. Defaults to 2.0.
+        """
+        self.fetch = fetch
+        self.max_pending = max_pending
+        self.rate = rate
+        self.submitted = 0
+        self.dropped = 0
+        self.failed = 0
+        self._pending = 0
+        self._tokens = float(max_pending)
+        self._refilled_at = time.monotonic()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="prefetch"
+        )
+
+    @classmethod
+    def from_env(cls, fetch: Callable[[str], Any]) -> Optional["Prefetcher"]:
+        """
+        Builds a prefetcher when `prefetch_enabled` is true.
+
+        Args:
+            fetch (Callable[[str], Any]): Runs and caches one query.
+
+        Returns:
+            Optional[Prefetcher]: The prefetcher, or None if prefetching is disabled.
+        """
+        if os.environ.get("prefetch_enabled", "false").lower() != "true":
+            return None
+        return cls(
+            fetch,
+            max_workers=int(os.environ.get("prefetch_max_workers", DEFAULT_MAX_WORKERS)),
+            max_pending=int(os.environ.get("prefetch_max_pending", DEFAULT_MAX_PENDING)),
+            rate=float(os.environ.get("prefetch_rate", DEFAULT_RATE)),
+        )
+
+    def _acquire(self, query: str) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._tokens + (now - self._refilled_at) * self.rate, float(self.max_pending)
+            )
+            self._refilled_at = now
+            if query in self._in_flight:
+                return False
+            if self._pending >= self.max_pending or self._tokens < 1:
+                self.dropped += 1
+                return False
+            self._tokens -= 1
+            self._pending += 1
+            self._in_flight.add(query)
+            self.submitted += 1
+            return True
+
+    def _run(self, query: str):
+        try:
+            self.fetch(query)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logging.warning(f"Failed to prefetch {query}: {e}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._in_flight.discard(query)
+
+    def submit(self, queries: Iterable[str]) -> int:
+        """
+        Schedules queries for prefetching, dropping any over budget.
+
+        Args:
+            queries (Iterable[str]): Normalized queries not yet cached.
+
+        Returns:
+            int: The number of queries scheduled.
+        """
+        scheduled = 0
+        for query in queries:
+            if self._acquire(query):
+                self._executor.submit(self._run, query)
+                scheduled += 1
+        return scheduled
+
+    def stats(self):
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "pending": self._pending,
+            }
@@ -0,0 +1,96 @@
+from typing import Dict, Any, Optional
+from google.cloud.discoveryengine import SearchRequest, UserInfo
+from engines import Engines
+
+# Fields that change per request; everything else is compiled into the template.
+REQUEST_FIELDS = ("query", "user_info", "user_pseudo_id", "page_token", "image_query")
+
+class SearchProfile:
+    """
+    A compiled, static search configuration.
+
+    The nested specs (facets, boosts, content search, query expansion, spell
+    correction, embeddings) and the serving config and branch are validated
+    and built once. Each request is a copy of the template with only the
+    per-request fields set.
+    """
+
+    def __init__(self, template: SearchRequest, total_results: int = 10):
+        """
+        Initializes the profile.
+
+        Args:
+            template (SearchRequest): The fully built static part of the request.
+            total_results (int, optional): Total number of results to return. Defaults to 10.
+        """
+        self.template = template
+        self.serving_config = template.serving_config
+        self.total_results = total_results
+        self._template_pb = SearchRequest.pb(template)
+
+    @classmethod
+    def compile(cls, engines, search_config: Dict[str, Any], total_results: int = 10):
+        """
+        Validates a static search config and builds its template request.
+
+        Args:
+            engines (Engines): The Engines object whose spec builders are used.
+            search_config (Dict[str, Any]): See Engines.query_by_search. Per-request
+                keys (query, user_info, user_pseudo_id, page_token, image_query) are ignored.
+            total_results (int, optional): Total number of results to return. Defaults to 10.
+
+        Returns:
+            SearchProfile: The compiled profile.
+
+        Raises:
+            ValueError: If the config has no valid data_store_id.
+        """
+        data_store_id = search_config.get("data_store_id", None)
+        if not data_store_id or len(data_store_id.split("/")) < 8:
+            raise ValueError(
+                "search_config needs a data_store_id of the form projects/<PROJECT_ID>/locations/<LOCATION>"
+                f"/collections/<COLLECTION_ID>/dataStores/<DATASTORE_ID>, got: {data_store_id}"
+            )
+        static_config = {
+            key: value for key, value in search_config.items() if key not in REQUEST_FIELDS
+        }
+        template = engines.build_search_request(static_config)
+        return cls(template, total_results=total_results)
+
+    def build_request(
+        self,
+        query: str,
+        user_pseudo_id: Optional[str] = None,
+        user_info: Optional[Dict[str, Any]] = None,
+        page_token: Optional[str] = None,
+        image_query: Optional[Dict[str, Any]] = None,
+    ) -> SearchRequest:
+        """
+        Builds a request by copying the template and setting the per-request fields.
+
+        Args:
+            query (str): The search query string.
+            user_pseudo_id (Optional[str]): The pseudo ID of the end user. Defaults to None.
+            user_info (Optional[Dict[str, Any]]): A dictionary with user_id and user_agent. Defaults to None.
+            page_token (Optional[str]): The page token of a previous search. Defaults to None.
+            image_query (Optional[Dict[str, Any]]): A dictionary with image_bytes to search by. Defaults to None.
+
+        Returns:
+            SearchRequest: The request to send to the Search API.
+        """
+        raw = type(self._template_pb)()
+        raw.CopyFrom(self._template_pb)
+        request = SearchRequest.wrap(raw)
+        request.query = query
+        if user_pseudo_id:
+            request.user_pseudo_id = user_pseudo_id
+        if user_info:
+            request.user_info = UserInfo(
+                user_id=user_info.get("user_id", None),
+                user_agent=user_info.get("user_agent", None),
+            )
+        if page_token:
+            request.page_token = page_token
+        if image_query:
+            request.image_query = Engines.build_image_query({"image_query": image_query})
+        return request
@@ -0,0 +1,178 @@
+import os
+import hmac
+import json
+import time
+import uuid
+import random
+import hashlib
+import logging
+import cProfile
+import pstats
+import threading
+import tracemalloc
+from typing import Any, Callable, Optional
+
+PROFILE_HEADER = "X-Debug-Profile"
+PROFILE_ID_HEADER = "X-Debug-Profile-Id"
+PROFILE_SECRET = os.environ.get("profile_secret")
+PROFILE_SAMPLE_RATE = float(os.environ.get("profile_sample_rate", 0.0))
+PROFILE_TOP_N = int(os.environ.get("profile_top_n", 20))
+MAX_TOKEN_AGE = 300
+
+# cProfile and tracemalloc hooks are process-wide, so one request at a time.
+_profile_lock = threading.Lock()
+
+def build_profile_logger() -> logging.Logger:
+    """
+    Builds the logger for profile summaries.
+
+    It writes to its own stderr handler at INFO and does not propagate, so
+    summaries are logged whatever level the root logger is at.
+
+    Returns:
+        logging.Logger: The profile summary logger.
+    """
+    logger = logging.getLogger("debug_profile")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+    return logger
+
+profile_logger = build_profile_logger()
+
+def sign_token(secret: str, timestamp: Optional[int] = None) -> str:
+    """
+    Builds a debug header value that enables profiling for one request.
+
+    Args:
+        secret (str): The shared `profile_secret`.
+        timestamp (Optional[int]): Unix time the token is issued. Defaults to now.
+
+    Returns:
+        str: "<timestamp>.<hex HMAC-SHA256 of the timestamp>".
+    """
+    timestamp = str(int(timestamp if timestamp is not None else time.time()))
+    signature = hmac.new(secret.encode("utf-8"), timestamp.encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"{timestamp}.{signature}"
+
+def verify_token(token: str, secret: Optional[str], now: Optional[float] = None) -> bool:
+    """
+    Checks a debug header value against the secret and its age.
+
+    Args:
+        token (str): The header value.
+        secret (Optional[str]): The shared `profile_secret`. Without one, no token is valid.
+        now (Optional[float]): The current Unix time. Defaults to now.
+
+    Returns:
+        bool: True if the signature matches and the token is at most five minutes old.
+    """
+    if not (token and secret):
+        return False
+    timestamp, _, signature = token.partition(".")
+    if not timestamp.isdigit():
+        return False
+    if abs((now if now is not None else time.time()) - int(timestamp)) > MAX_TOKEN_AGE:
+        return False
+    expected = sign_token(secret, int(timestamp)).partition(".")[2]
+    return hmac.compare_digest(expected, signature)
+
+def get_profile_reason(headers) -> Optional[str]:
+    """
+    Decides whether to profile a request.
+
+    Args:
+        headers (Mapping[str, str]): The request headers.
+
+    Returns:
+        Optional[str]: "header" or "sampled", or None to skip profiling.
+    """
+    if verify_token(headers.get(PROFILE_HEADER), PROFILE_SECRET):
+        return "header"
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+def summarize_profile(profiler: cProfile.Profile, top_n: int) -> list:
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top_n]
+    return [
+        {
+            "function": f"{filename}:{line}({name})",
+            "calls": calls,
+            "tottime_ms": round(tottime * 1000, 3),
+            "cumtime_ms": round(cumtime * 1000, 3),
+        }
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in rows
+    ]
+
+def summarize_allocations(snapshot: tracemalloc.Snapshot, top_n: int) -> list:
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, __file__)])
+    return [
+        {
+            "site": str(stat.traceback[0]),
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+        }
+        for stat in snapshot.statistics("lineno")[:top_n]
+    ]
+
+def profile_request(headers, dispatch: Callable[[], Any]) -> Any:
+    """
+    Dispatches a request, wrapping it in cProfile and tracemalloc if selected.
+
+    A request is profiled when it carries a valid signed `X-Debug-Profile`
+    header, or when it is picked at `profile_sample_rate`. The summary (top
+    functions by cumulative time and top allocation sites) is logged as
+    JSON, and its id is returned in the `X-Debug-Profile-Id` header. Only one
+    request is profiled at a time; others run normally. tracemalloc is
+    process-wide, so allocation sites can include concurrent requests.
+
+    Args:
+        headers (Mapping[str, str]): The request headers.
+        dispatch (Callable[[], Any]): Runs the request and returns the response.
+
+    Returns:
+        Any: The response from dispatch.
+    """
+    reason = get_profile_reason(headers)
+    if not reason or not _profile_lock.acquire(blocking=False):
+        return dispatch()
+
+    profile_id = uuid.uuid4().hex
+    profiler = cProfile.Profile()
+    started_tracing = not tracemalloc.is_tracing()
+    try:
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = dispatch()
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+    finally:
+        _profile_lock.release()
+
+    profile_logger.info(json.dumps({
+        "debug_profile": profile_id,
+        "reason": reason,
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "peak_memory_kb": round(peak / 1024, 1),
+        "functions": summarize_profile(profiler, PROFILE_TOP_N),
+        "allocations": summarize_allocations(snapshot, PROFILE_TOP_N),
+    }))
+    if hasattr(response, "headers"):
+        response.headers[PROFILE_ID_HEADER] = profile_id
+    return response
+
+if __name__ == "__main__":
+    # Prints a header value for a one-off profiled request.
+    print(f"{PROFILE_HEADER}: {sign_token(os.environ['profile_secret'])}")
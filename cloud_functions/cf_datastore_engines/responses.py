@@ -0,0 +1,135 @@
+import os
+import json
+import queue
+import random
+import logging
+import logging.handlers
+from typing import Dict, Any, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LOG_SAMPLE_RATE = float(os.environ.get("response_log_sample_rate", 0.0))
+LOG_MAX_CHARS = int(os.environ.get("response_log_max_chars", 2000))
+
+def dumps(obj: Dict[str, Any]) -> str:
+    """
+    Serializes a webhook response to a JSON string.
+
+    Uses orjson when it is installed and falls back to the json module.
+
+    Args:
+        obj (Dict[str, Any]): The webhook response.
+
+    Returns:
+        str: JSON string of the webhook response.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode("utf-8")
+    return json.dumps(obj, default=str)
+
+def build_response_logger() -> logging.Logger:
+    """
+    Builds the logger used for webhook responses.
+
+    Records are put on a queue and written by a QueueListener thread, so
+    request threads never block on the log handlers.
+
+    Returns:
+        logging.Logger: The webhook response logger.
+    """
+    logger = logging.getLogger("webhook_responses")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    log_queue = queue.SimpleQueue()
+    handlers = logging.getLogger().handlers or [logging.StreamHandler()]
+    listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    listener.start()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    return logger
+
+response_logger = build_response_logger()
+
+def log_response(response: str):
+    """
+    Logs a sampled, truncated webhook response without blocking the request.
+
+    Nothing is logged unless `response_log_sample_rate` is set above 0.
+
+    Args:
+        response (str): JSON string of the webhook response.
+    """
+    if LOG_SAMPLE_RATE <= 0.0 or (LOG_SAMPLE_RATE < 1.0 and random.random() >= LOG_SAMPLE_RATE):
+        return
+    if len(response) > LOG_MAX_CHARS:
+        response = f"{response[:LOG_MAX_CHARS]}... ({len(response)} chars)"
+    response_logger.info(response)
+
+class WebhookResponseBuilder:
+    """
+    Builds Dialogflow CX webhook responses in the same shape as
+    dfcx_scrapi's WebhookUtil.build_response without instantiating it per request.
+    """
+
+    SKELETON = {
+        "fulfillmentResponse": None,
+        "pageInfo": None,
+        "sessionInfo": None,
+    }
+
+    @staticmethod
+    def build_session_info(parameters: Dict[str, Any]) -> Dict[str, Any]:
+        return {"parameters": parameters}
+
+    def build_response(
+        self,
+        response_text: Optional[str] = None,
+        session_info: Optional[Dict[str, Any]] = None,
+        append: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Builds a webhook response.
+
+        Args:
+            response_text (Optional[str]): The text response to be displayed to the user.
+            session_info (Optional[Dict[str, Any]]): The object returned by build_session_info.
+            append (bool, optional): Whether messages are appended instead of replaced. Defaults to False.
+
+        Returns:
+            Dict[str, Any]: The webhook response.
+        """
+        message = self.SKELETON.copy()
+        if response_text:
+            message["fulfillmentResponse"] = {
+                "mergeBehavior": "APPEND" if append else "REPLACE",
+                "messages": [{"text": {"text": [response_text]}}],
+            }
+        message["sessionInfo"] = session_info
+        return message
+
+    def render(
+        self,
+        response_text: Optional[str] = None,
+        session_info: Optional[Dict[str, Any]] = None,
+        append: bool = False,
+    ) -> str:
+        """
+        Builds, serializes and logs a webhook response.
+
+        Args:
+            response_text (Optional[str]): The text response to be displayed to the user.
+            session_info (Optional[Dict[str, Any]]): The object returned by build_session_info.
+            append (bool, optional): Whether messages are appended instead of replaced. Defaults to False.
+
+        Returns:
+            str: JSON string of the webhook response.
+        """
+        response = dumps(self.build_response(response_text, session_info, append))
+        log_response(response)
+        return response
+
+response_builder = WebhookResponseBuilder()
@@ -2,34 +2,63 @@ import os
 import logging
 import string
 import json
+import threading
 from typing import Optional, Dict, Any, List
-from google.cloud.discoveryengine_v1beta import types
-from google.api_core import datetime_helpers
 
 from engines import Engines
-from google.cloud.discoveryengine_v1beta import types
+from profiles import SearchProfile
+from federated import get_datastore_ids, federated_search
+from cache import response_cache, CACHE_ENABLED
+from sessions import SESSION_MODE, save_session, load_session
+from deadlines import Deadline
+from hedging import HedgePolicy
+from singleflight import single_flight
+from prefetch import Prefetcher
+from timing import span
+from breaker import call_backend, record_fallback
+
+_engines: Optional[Engines] = None
+_engines_lock = threading.Lock()
+_search_profiles: Dict[str, SearchProfile] = {}
+_prefetcher = False
+
+def get_engines() -> Engines:
+    """
+    Returns the Engines instance shared by every request on this instance.
 
-def search_route_controller(data):
+    Returns:
+        Engines: A lazily created Engines object whose clients are pooled.
+    """
+    global _engines
+    if _engines is None:
+        with _engines_lock:
+            if _engines is None:
+                _engines = Engines(hedge_policy=HedgePolicy.from_env())
+    return _engines
+
+def search_route_controller(data, deadline: Deadline = None):
     """
     Handles search requests.
 
     Args:
         data (Dict[str, Any]): The request data containing user utterance.
+        deadline (Deadline, optional): The webhook deadline. Defaults to one built from `webhook_deadline`.
 
     Returns:
         Optional[Dict[str, Any]]: A dictionary containing search results, or None if no utterance.
     """
     utterance = get_utterance(data)
     if utterance:
-        return query_by_search(query=utterance)
+        return query_by_search(query=utterance, deadline=deadline or Deadline.from_env())
     return None
 
-def answer_route_controller(data):
+def answer_route_controller(data, deadline: Deadline = None):
     """
     Handles answer requests.
 
     Args:
         data (Dict[str, Any]): The request data containing user utterance and session parameters.
+        deadline (Deadline, optional): The webhook deadline. Defaults to one built from `webhook_deadline`.
 
     Returns:
         Optional[Dict[str, Any]]: A dictionary containing answer results, or None if no utterance.
@@ -39,27 +68,116 @@ def answer_route_controller(data):
     if data.get("parameters"):
         session = data.get("parameters").get("ds_session", None)
     if utterance:
-        return query_by_answer(query=utterance, session=session)
+        deadline = deadline or Deadline.from_env()
+        response = query_by_answer(query=utterance, session=session, deadline=deadline)
+        if not response:
+            return fallback_answer(query=utterance, deadline=deadline)
+        prefetch_related_questions(response)
+        return response
     return None
 
-def conversation_route_controller(data):
+def conversation_route_controller(data, deadline: Deadline = None):
     """
     Handles conversation requests.
 
     Args:
         data (Dict[str, Any]): The request data containing user utterance and session parameters.
+        deadline (Deadline, optional): The webhook deadline. Defaults to one built from `webhook_deadline`.
 
     Returns:
         Optional[Dict[str, Any]]: A dictionary containing conversation results, or None if no utterance.
     """
     utterance = get_utterance(data)
-    session = None
+    session_json = None
     if data.get("parameters"):
         session_json = data.get("parameters").get("ds_session", None)
     if utterance:
-        return query_by_conversation(query=utterance, session=session_json)
+        deadline = deadline or Deadline.from_env()
+        response = query_by_conversation(query=utterance, session=session_json, deadline=deadline)
+        if not response:
+            return fallback_conversation(query=utterance, session=session_json, deadline=deadline)
+        return response
     return None
 
+def has_fallback_budget(deadline: Optional[Deadline]) -> bool:
+    """
+    Checks whether enough of the webhook deadline is left to try the search fallback.
+
+    Args:
+        deadline (Optional[Deadline]): The webhook deadline, or None for no deadline.
+
+    Returns:
+        bool: True if at least `fallback_min_budget` seconds (default 0.3) remain.
+    """
+    return deadline is None or deadline.remaining() >= float(os.environ.get("fallback_min_budget", 0.3))
+
+def get_cached_answer(query: str) -> Dict[str, Any]:
+    """
+    Gets a cached session-less answer, even an expired one.
+
+    Args:
+        query (str): The normalized query.
+
+    Returns:
+        Dict[str, Any]: The cached answer, or an empty dictionary.
+    """
+    if not CACHE_ENABLED:
+        return {}
+    return response_cache.get("answer", os.environ.get("datastore_id"), query, stale=True) or {}
+
+def fallback_answer(query: str, deadline: Deadline = None) -> Dict[str, Any]:
+    """
+    Answers from the fallback tiers when the Answer API failed or its circuit is open.
+
+    Tries a cached answer, then the extractive answer from search. If both
+    miss, the empty result makes the webhook return the canned error.
+
+    Args:
+        query (str): The normalized query.
+        deadline (Deadline, optional): The webhook deadline. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: A dictionary containing the answer and related questions, or an empty dictionary.
+    """
+    cached = get_cached_answer(query)
+    if cached:
+        record_fallback("answer", "cache")
+        return cached
+    if has_fallback_budget(deadline):
+        searched = query_by_search(query=query, deadline=deadline)
+        if searched:
+            record_fallback("answer", "search")
+            return {"answer": searched["search"], "related_questions": []}
+    record_fallback("answer", "error")
+    return {}
+
+def fallback_conversation(query: str, session: Any = None, deadline: Deadline = None) -> Dict[str, Any]:
+    """
+    Replies from the fallback tiers when the Converse API failed or its circuit is open.
+
+    The reply comes from a cached answer or the extractive answer from
+    search, and the incoming session is handed back unchanged so the
+    conversation can resume once the API recovers.
+
+    Args:
+        query (str): The normalized query.
+        session (Any, optional): The incoming session. Defaults to None.
+        deadline (Deadline, optional): The webhook deadline. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: A dictionary containing the reply, or an empty dictionary.
+    """
+    reply = get_cached_answer(query).get("answer")
+    tier = "cache"
+    if not reply and has_fallback_budget(deadline):
+        reply = query_by_search(query=query, deadline=deadline).get("search")
+        tier = "search"
+    if not reply:
+        record_fallback("conversation", "error")
+        return {}
+    record_fallback("conversation", tier)
+    return {"reply": reply, "summary": "", "session": session, "state": None}
+
 def get_utterance(req):
     """
     Gets the user utterance from the request.
@@ -78,32 +196,194 @@ def get_utterance(req):
             logging.warning("no transcript in request")
             return None
 
+    with span("utterance"):
+        return clean_text(text)
+
+def clean_text(text: str) -> str:
+    """
+    Normalizes text the same way as user utterances.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The lowercased text without punctuation.
+    """
     clean_utterance = text.lower().translate(
         str.maketrans("", "", string.punctuation))
 
     return clean_utterance
 
-def query_by_search(query: str) -> Dict[str, Any]:
+def prefetch_answer(query: str):
+    """
+    Answers a query in the background so the answer lands in the response cache.
+
+    Prefetches go through their own "prefetch" circuit breaker, so their
+    failures and slow calls never open the breaker of user-facing answers.
+
+    Args:
+        query (str): The normalized query.
+    """
+    query_by_answer(
+        query=query,
+        deadline=Deadline(float(os.environ.get("prefetch_deadline", 10.0))),
+        backend="prefetch",
+    )
+
+def get_prefetcher() -> Optional[Prefetcher]:
+    """
+    Returns the related question prefetcher, if `prefetch_enabled` is true.
+
+    Returns:
+        Optional[Prefetcher]: The prefetcher shared by every request on this instance.
+    """
+    global _prefetcher
+    if _prefetcher is False:
+        with _engines_lock:
+            if _prefetcher is False:
+                _prefetcher = Prefetcher.from_env(prefetch_answer)
+    return _prefetcher
+
+def prefetch_related_questions(response: Dict[str, Any]):
+    """
+    Schedules the related questions of an answer for prefetching.
+
+    Users often pick a related question next, so its session-less answer is
+    fetched in the background and the follow-up turn is served from the cache.
+
+    Args:
+        response (Dict[str, Any]): The parsed answer route response.
+    """
+    prefetcher = get_prefetcher()
+    if not (prefetcher and CACHE_ENABLED and response):
+        return
+    datastore_id = os.environ.get("datastore_id")
+    questions = [clean_text(question) for question in response.get("related_questions", [])]
+    prefetcher.submit(
+        question for question in questions
+        if question and not response_cache.contains("answer", datastore_id, question)
+    )
+
+def get_search_profile(datastore_id: Optional[str] = None, engines: Optional[Engines] = None) -> SearchProfile:
+    """
+    Returns the compiled search profile for a data store.
+
+    The static part of the search config is read once from the optional
+    `search_config` environment variable (a JSON object) and compiled for
+    each data store.
+
+    Args:
+        datastore_id (Optional[str]): The data store. Defaults to `datastore_id`.
+        engines (Optional[Engines]): The Engines object whose spec builders compile the profile.
+            Defaults to the shared Engines instance.
+
+    Returns:
+        SearchProfile: The profile shared by every search on this instance.
+    """
+    datastore_id = datastore_id or os.environ.get("datastore_id")
+    profile = _search_profiles.get(datastore_id)
+    if profile is None:
+        engines = engines or get_engines()
+        with _engines_lock:
+            profile = _search_profiles.get(datastore_id)
+            if profile is None:
+                search_config = json.loads(os.environ.get("search_config", "{}"))
+                search_config["data_store_id"] = datastore_id
+                profile = SearchProfile.compile(
+                    engines, search_config, total_results=1
+                )
+                _search_profiles[datastore_id] = profile
+    return profile
+
+def get_search_profiles(datastore_ids: List[str], engines: Optional[Engines] = None) -> Dict[str, SearchProfile]:
+    """
+    Returns the compiled search profiles of the federated data stores, in their configured order.
+
+    Args:
+        datastore_ids (List[str]): The data stores.
+        engines (Optional[Engines]): See get_search_profile. Defaults to the shared Engines instance.
+
+    Returns:
+        Dict[str, SearchProfile]: The profiles keyed by data store ID.
+    """
+    return {datastore_id: get_search_profile(datastore_id, engines) for datastore_id in datastore_ids}
+
+def query_by_search(query: str, deadline: Deadline = None, backend: str = "search") -> Dict[str, Any]:
     """
     Queries by search.
 
+    When `datastore_ids` lists more than one data store, the query is fanned out
+    to all of them with federated_search. Responses are served from the
+    response cache when possible, and concurrent identical queries share one
+    backend call.
+
     Args:
         query (str): The search query string.
+        deadline (Deadline, optional): The webhook deadline. Defaults to None.
+        backend (str, optional): The circuit breaker guarding the call. Defaults to "search".
 
     Returns:
         Dict[str, Any]: A dictionary containing search results, or an empty dictionary if an error occurred or no result was found.
     """
-    datastore_id = os.environ.get("datastore_id")
-    search_config: Dict[str, Any] = {
-        "data_store_id": datastore_id,
-        "query": query
-    }
-    s = Engines()
+    datastore_ids = get_datastore_ids()
+    cache_key = ",".join(datastore_ids)
+    if CACHE_ENABLED:
+        with span("cache"):
+            cached = response_cache.get("search", cache_key, query)
+        if cached:
+            return cached
+
+    def fetch() -> Dict[str, Any]:
+        if len(datastore_ids) > 1:
+            try:
+                profiles = get_search_profiles(datastore_ids)
+            except Exception as e:
+                logging.error(f"Failed to generate a search: {e}")
+                return {}
+            with span("federated"):
+                return federated_search(
+                    get_engines(),
+                    query=query,
+                    profiles=profiles,
+                    deadline=float(os.environ.get("federated_deadline", 2.0)),
+                    fusion=os.environ.get("federated_fusion", "rrf"),
+                    request_deadline=deadline,
+                    backend=backend,
+                )
+        s = get_engines()
+        try:
+            res = call_backend(
+                backend,
+                lambda: s.query_by_profile(get_search_profile(), query=query, deadline=deadline),
+            )
+        except Exception as e:
+            logging.error(f"Failed to generate a search: {e}")
+            return {}
+        with span("parse"):
+            return parse_search_results(res)
+
     try:
-        res = s.query_by_search(search_config=search_config, total_results=1)
-    except Exception as e:
+        parsed_response = single_flight.do(
+            f"search:{cache_key}:{query}", fetch,
+            timeout=deadline.remaining() if deadline else None,
+        )
+    except TimeoutError as e:
         logging.error(f"Failed to generate a search: {e}")
         return {}
+    if CACHE_ENABLED and parsed_response and not parsed_response.get("partial"):
+        response_cache.set("search", cache_key, query, parsed_response)
+    return parsed_response
+
+def parse_search_results(res: List[Any]) -> Dict[str, Any]:
+    """
+    Parses search results into the search route response.
+
+    Args:
+        res (List[Any]): The search results returned by Engines.query_by_search.
+
+    Returns:
+        Dict[str, Any]: A dictionary containing the extractive answer, or an empty dictionary if no content was found.
+    """
     if res:
         try:
             search_result = res[0].document.derived_struct_data.get("extractive_answers")[0].get("content")
@@ -116,16 +396,16 @@ def query_by_search(query: str) -> Dict[str, Any]:
         return parsed_response
     return {}
 
-def query_by_answer(query: str, session: Optional[str] = None) -> Dict[str, Any]:
+def build_answer_config(query: str, session: Optional[str] = None) -> Dict[str, Any]:
     """
-    Queries for an answer and related questions, optionally within a session.
+    Builds the answer config for the configured data store.
 
     Args:
         query (str): The query string.
         session (Optional[str]): An optional session object.
 
     Returns:
-        Dict[str, Any]: A dictionary containing the answer and related questions, or an empty dictionary if an error occurred or no result was found.
+        Dict[str, Any]: The answer config passed to Engines.query_by_answer.
     """
     datastore_id = os.environ.get("datastore_id")
     answer_config: Dict[str, Any] = {
@@ -133,13 +413,86 @@ def query_by_answer(query: str, session: Optional[str] = None) -> Dict[str, Any]
         "query": query
     }
     answer_config["session"] = session.name if session else f"{datastore_id}/sessions/-"
+    return answer_config
+
+def query_by_answer(
+    query: str,
+    session: Optional[str] = None,
+    deadline: Deadline = None,
+    backend: str = "answer",
+) -> Dict[str, Any]:
+    """
+    Queries for an answer and related questions, optionally within a session.
 
-    s = Engines()
-    try:
-        res = s.query_by_answer(answer_config=answer_config, related_question=True)
-    except Exception as e:
-        logging.error(f"Failed to generate an answer: {e}")
-        return {}
+    Session-less answers are served from the response cache when possible, and
+    concurrent identical session-less queries share one backend call.
+
+    Args:
+        query (str): The query string.
+        session (Optional[str]): An optional session object.
+        deadline (Deadline, optional): The webhook deadline. Defaults to None.
+        backend (str, optional): The circuit breaker guarding the call. Defaults to "answer".
+
+    Returns:
+        Dict[str, Any]: A dictionary containing the answer and related questions, or an empty dictionary if an error occurred or no result was found.
+    """
+    answer_config = build_answer_config(query, session)
+    use_cache = CACHE_ENABLED and not session
+    if use_cache:
+        with span("cache"):
+            cached = response_cache.get("answer", answer_config["data_store_id"], query)
+        if cached:
+            return cached
+
+    leader = []
+
+    def fetch() -> Dict[str, Any]:
+        leader.append(True)
+        s = get_engines()
+        try:
+            res = call_backend(
+                backend,
+                lambda: s.query_by_answer(answer_config=answer_config, related_question=True, deadline=deadline),
+            )
+        except Exception as e:
+            logging.error(f"Failed to generate an answer: {e}")
+            return {}
+        with span("parse"):
+            return parse_answer_response(res)
+
+    if session:
+        parsed_response = fetch()
+    else:
+        try:
+            parsed_response = single_flight.do(
+                f"answer:{answer_config['data_store_id']}:{query}", fetch,
+                timeout=deadline.remaining() if deadline else None,
+            )
+        except TimeoutError as e:
+            logging.error(f"Failed to generate an answer: {e}")
+            return {}
+    if parsed_response and (use_cache or not leader):
+        # The session belongs to the first caller, so it is not shared.
+        shared_response = {
+            "answer": parsed_response["answer"],
+            "related_questions": parsed_response["related_questions"],
+        }
+        if use_cache:
+            response_cache.set("answer", answer_config["data_store_id"], query, shared_response)
+        if not leader:
+            return shared_response
+    return parsed_response
+
+def parse_answer_response(res: Any) -> Dict[str, Any]:
+    """
+    Parses an AnswerQueryResponse into the answer route response.
+
+    Args:
+        res (types.AnswerQueryResponse): The response returned by Engines.query_by_answer.
+
+    Returns:
+        Dict[str, Any]: A dictionary containing the answer and related questions, or an empty dictionary if no answer was found.
+    """
     if res and res.answer:
         related_questions: List[str] = list(res.answer.related_questions) if res.answer.related_questions else []
         parsed_response: Dict[str, Any] = {
@@ -151,35 +504,44 @@ def query_by_answer(query: str, session: Optional[str] = None) -> Dict[str, Any]
         return parsed_response
     return {}
 
-def build_conv_session(session: Dict[str, Any])  -> types.conversation:
+def build_conv_session(session: Dict[str, Any])  -> "types.conversation":
     """
     Builds a Conversation object from a session dictionary.
 
     Args:
-        session (Dict[str, Any]): A dictionary containing session information.
+        session (Dict[str, Any]): A dictionary containing session information, or its JSON string.
 
     Returns:
         types.conversation: A Conversation object.
     """
+    from google.api_core import datetime_helpers
+    from google.cloud.discoveryengine_v1beta import types
+
+    if isinstance(session, str):
+        session = json.loads(session)
     start_time = (
-        datetime_helpers.DatetimeWithNanoseconds.from_rfc3339(session.get("start_date")) 
-        if session.get("start_date") else None
+        datetime_helpers.DatetimeWithNanoseconds.from_rfc3339(session.get("start_time")) 
+        if session.get("start_time") else None
     )
     end_time = (
         datetime_helpers.DatetimeWithNanoseconds.from_rfc3339(session.get("end_time")) 
         if session.get("end_time") else None
     )
+    messages = [
+        types.ConversationMessage.from_json(json.dumps(message), ignore_unknown_fields=True)
+        for message in session.get("messages") or []
+    ]
     conversation = types.Conversation(
         name=session.get("name"),
-        state=types.State(session.get("state")),
-        user_pseudo_id=session.user_pseudo_id,
-        messages=list(session.get("messages")),
+        state=session.get("state") or 0,
+        user_pseudo_id=session.get("user_pseudo_id"),
+        messages=messages,
         start_time=start_time,
         end_time=end_time
     )
     return conversation
 
-def build_session_to_json(conversation: types.conversation) -> Dict[str, Any]:
+def build_session_to_dict(conversation: "types.conversation") -> Dict[str, Any]:
     """
     Converts a Conversation object to a JSON-serializable dictionary.
 
@@ -189,43 +551,125 @@ def build_session_to_json(conversation: types.conversation) -> Dict[str, Any]:
     Returns:
         Dict[str, Any]: A dictionary representing the Conversation object.
     """
-    conversation_data = {
+    from google.cloud.discoveryengine_v1beta import types
+
+    return {
         "name": conversation.name,
-        "state": conversation.state,
+        "state": int(conversation.state),
         "user_pseudo_id": conversation.user_pseudo_id,
-        "messages": conversation.messages,
+        "messages": [
+            json.loads(types.ConversationMessage.to_json(message))
+            for message in conversation.messages
+        ],
         "start_time": conversation.start_time.rfc3339() if conversation.start_time else None,
         "end_time": conversation.end_time.rfc3339() if conversation.end_time else None,
     }
 
-    return json.dumps(conversation_data, indent=2, default=str) 
+def build_session_to_json(conversation: "types.conversation") -> str:
+    """
+    Converts a Conversation object to a JSON string.
 
-def query_by_conversation(query: str, session: Dict[str, Any] = None) -> Dict[str, Any]:
+    Args:
+        conversation (types.conversation): A Conversation object.
+
+    Returns:
+        str: A JSON string representing the Conversation object.
     """
-    Queries for a conversation and, optionally within a session.
+    return json.dumps(build_session_to_dict(conversation), separators=(",", ":"), default=str)
+
+def build_session_handle(conversation: "types.conversation") -> str:
+    """
+    Builds the ds_session value returned to Dialogflow.
+
+    In the default "full" session mode this is the whole serialized session.
+    In "compact" mode the session is stored server-side with a capped message
+    history and only the conversation name is returned.
+
+    Args:
+        conversation (types.conversation): A Conversation object.
+
+    Returns:
+        str: The session JSON or the session handle.
+    """
+    if SESSION_MODE == "compact":
+        return save_session(build_session_to_dict(conversation))
+    return build_session_to_json(conversation)
+
+def load_session_from_handle(session: str) -> Dict[str, Any]:
+    """
+    Resolves the ds_session value sent by Dialogflow to a session dictionary.
+
+    Args:
+        session (str): The session JSON or, in "compact" mode, the session handle.
+
+    Returns:
+        Dict[str, Any]: The session dictionary.
+    """
+    if SESSION_MODE == "compact":
+        # The conversation still exists server-side if the stored copy expired.
+        return load_session(session) or {"name": session}
+    return json.loads(session) if isinstance(session, str) else session
+
+def build_conv_config(query: str, session: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Builds the conversation config for the configured data store.
 
     Args:
         query (str): The query string.
         session (Optional[Dict[str, Any]]): An optional session object.
 
     Returns:
-        Dict[str, Any]: A dictionary containing the reply, or an empty dictionary if an error occurred or no result was found.
+        Dict[str, Any]: The conversation config passed to Engines.query_by_conversation.
     """
     datastore_id = os.environ.get("datastore_id")
     conv_config: Dict[str, Any] = {
         "data_store_id": datastore_id,
         "query": query
     }
-    conv_config["conversation"] = build_conv_session(session) if session else None
+    conv_config["conversation"] = (
+        build_conv_session(load_session_from_handle(session)) if session else None
+    )
+    return conv_config
+
+def query_by_conversation(query: str, session: Dict[str, Any] = None, deadline: Deadline = None) -> Dict[str, Any]:
+    """
+    Queries for a conversation and, optionally within a session.
 
-    s = Engines()
+    Args:
+        query (str): The query string.
+        session (Optional[Dict[str, Any]]): An optional session object.
+        deadline (Deadline, optional): The webhook deadline. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: A dictionary containing the reply, or an empty dictionary if an error occurred or no result was found.
+    """
+    with span("session"):
+        conv_config = build_conv_config(query, session)
+
+    s = get_engines()
     try:
-        res = s.query_by_conversation(conv_config=conv_config, conversation=conv_config["conversation"])
+        res = call_backend(
+            "conversation",
+            lambda: s.query_by_conversation(conv_config=conv_config, conversation=conv_config["conversation"], deadline=deadline),
+        )
     except Exception as e:
         logging.error(f"Failed to generate an answer: {e}")
         return {}
+    with span("parse"):
+        return parse_conversation_response(res)
+
+def parse_conversation_response(res: Any) -> Dict[str, Any]:
+    """
+    Parses a ConverseConversationResponse into the conversation route response.
+
+    Args:
+        res (types.ConverseConversationResponse): The response returned by Engines.query_by_conversation.
+
+    Returns:
+        Dict[str, Any]: A dictionary containing the reply, or an empty dictionary if no reply was found.
+    """
     if res:
-        session_json = build_session_to_json(res.conversation)
+        session_json = build_session_handle(res.conversation)
         parsed_response: Dict[str, Any] = {
             "reply": res.reply.reply if res.reply else "",
             "summary": res.reply.summary.summary_text if res.reply else "",
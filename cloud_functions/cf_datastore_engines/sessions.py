@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+SESSION_MODE = os.environ.get("session_mode", "full").lower()
+MAX_MESSAGES = int(os.environ.get("session_max_messages", 10))
+DEFAULT_MAX_SIZE = 10000
+DEFAULT_TTL = 3600
+
+class SessionStore:
+    """
+    Interface for a server-side conversation session store.
+    """
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Dict[str, Any]):
+        raise NotImplementedError
+
+class MemorySessionStore(SessionStore):
+    """
+    A thread-safe in-process session store with LRU and TTL eviction.
+
+    Sessions only survive while requests for a conversation reach the same
+    instance; use a shared store when the function scales out.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, ttl: float = DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._sessions.get(key)
+            if not entry:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._sessions[key]
+                return None
+            self._sessions.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: Dict[str, Any]):
+        with self._lock:
+            self._sessions[key] = (time.monotonic() + self.ttl, value)
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+
+class FileSessionStore(SessionStore):
+    """
+    A session store keeping one JSON file per conversation in a directory.
+
+    Stands in for a shared store (e.g. a mounted volume) in local runs.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._file(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        file_path = self._file(key)
+        tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(value, f, separators=(",", ":"))
+        os.replace(tmp_path, file_path)
+
+def build_store_from_env() -> SessionStore:
+    """
+    Builds the session store configured by `session_store` and `session_store_path`.
+
+    Returns:
+        SessionStore: A FileSessionStore for "file", otherwise a MemorySessionStore.
+    """
+    if os.environ.get("session_store", "memory").lower() == "file":
+        return FileSessionStore(os.environ.get("session_store_path", "/tmp/ds_sessions"))
+    return MemorySessionStore(
+        max_size=int(os.environ.get("session_store_max_size", DEFAULT_MAX_SIZE)),
+        ttl=float(os.environ.get("session_store_ttl", DEFAULT_TTL)),
+    )
+
+session_store = build_store_from_env()
+
+def save_session(session: Dict[str, Any], max_messages: int = MAX_MESSAGES) -> str:
+    """
+    Stores a session server-side and returns its handle.
+
+    Args:
+        session (Dict[str, Any]): The session dictionary built from a Conversation.
+        max_messages (int, optional): Number of most recent messages to keep. Defaults to session_max_messages.
+
+    Returns:
+        str: The handle to return to Dialogflow, which is the conversation name.
+    """
+    if max_messages and len(session.get("messages") or []) > max_messages:
+        session = dict(session, messages=session["messages"][-max_messages:])
+    session_store.set(session["name"], session)
+    return session["name"]
+
+def load_session(handle: str) -> Optional[Dict[str, Any]]:
+    """
+    Loads a session stored by save_session.
+
+    Args:
+        handle (str): The conversation name returned by save_session.
+
+    Returns:
+        Optional[Dict[str, Any]]: The session dictionary, or None if it expired or was never stored.
+    """
+    session = session_store.get(handle)
+    if session is None:
+        logging.warning(f"No stored session for conversation {handle}")
+    return session
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+class _Call:
+    """
+    A call in flight and the outcome shared with its waiters.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls into one.
+
+    The first caller for a key runs the call; callers arriving while it is in
+    flight wait for it and receive the same result or exception. Works for
+    threads (do) and for coroutines on one event loop (ado).
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._tasks: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """
+        Runs fn once for all concurrent callers with the same key.
+
+        Args:
+            key (str): Identifies identical calls.
+            fn (Callable[[], Any]): The call to make.
+            timeout (Optional[float]): Seconds a waiter waits for the call in flight. Defaults to None.
+
+        Returns:
+            Any: The result of fn.
+
+        Raises:
+            TimeoutError: If a waiter's timeout expires first.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            if not call.event.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for the in-flight call {key}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        """
+        Awaits fn once for all concurrent coroutines with the same key.
+
+        Args:
+            key (str): Identifies identical calls.
+            fn (Callable[[], Awaitable[Any]]): Returns the coroutine to await.
+            timeout (Optional[float]): Seconds a waiter waits for the call in flight. Defaults to None.
+
+        Returns:
+            Any: The result of the coroutine.
+
+        Raises:
+            TimeoutError: If a waiter's timeout expires first.
+        """
+        task = self._tasks.get(key)
+        leader = task is None
+        if leader:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+            self.executed += 1
+        else:
+            self.shared += 1
+        # A cancelled waiter must not cancel the call the others share.
+        if leader:
+            return await asyncio.shield(task)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Timed out waiting for the in-flight call {key}") from None
+
+    def stats(self) -> Dict[str, int]:
+        return {"executed": self.executed, "shared": self.shared}
+
+single_flight = SingleFlight()
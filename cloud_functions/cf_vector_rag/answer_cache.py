@@ -0,0 +1,210 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+import numpy as np
+from timing import metrics
+from manifest import build_version_store, read_corpus_version
+
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 3600))
+ANSWER_CACHE_MAX_SIZE = int(os.environ.get("ANSWER_CACHE_MAX_SIZE", 1000))
+ANSWER_CACHE_CHECK_INTERVAL = float(os.environ.get("ANSWER_CACHE_CHECK_INTERVAL", 60))
+
+class CachedAnswer:
+    """
+    An answer cached for a query, with the LLM time it took and the corpus version it came from.
+    """
+
+    def __init__(self, query: str, answer: Any, llm_seconds: float, expires_at: float, version: Optional[str]):
+        self.query = query
+        self.answer = answer
+        self.llm_seconds = llm_seconds
+        self.expires_at = expires_at
+        self.version = version
+
+class SemanticAnswerCache:
+    """
+    A bounded in-process cache of QA answers, looked up by query similarity.
+
+    Query embeddings are kept normalized in one matrix, so a lookup is a
+    single matrix-vector product: the most similar unexpired query with the
+    same context (e.g. the metadata filter) is a hit if its cosine
+    similarity reaches `threshold`. Entries expire after `ttl` seconds, the
+    least recently used one is evicted beyond `max_size`, and everything is
+    dropped when the corpus version changes.
+    """
+
+    def __init__(
+        self,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_size: int = ANSWER_CACHE_MAX_SIZE,
+        version_source: Callable[[], Optional[str]] = None,
+        check_interval: float = ANSWER_CACHE_CHECK_INTERVAL,
+    ):
+        """
+        Initializes the cache.
+
+        Args:
+            threshold: Cosine similarity a cached query needs to be a hit. Defaults to `ANSWER_CACHE_THRESHOLD` or 0.95.
+            ttl: Seconds an answer lives. Defaults to `ANSWER_CACHE_TTL` or 3600.
+            max_size: Maximum number of answers. Defaults to `ANSWER_CACHE_MAX_SIZE` or 1000.
+            version_source: Returns the current corpus version. Defaults to None.
+            check_interval: Seconds between version checks. Defaults to `ANSWER_CACHE_CHECK_INTERVAL` or 60.
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.version_source = version_source
+        self.check_interval = check_interval
+        self.version: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.llm_seconds_saved = 0.0
+        self._checked_at: Optional[float] = None
+        # Slot -> answer, least recently used first.
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._vectors: Optional[np.ndarray] = None
+        self._expires = np.zeros(max_size)
+        self._contexts = np.empty(max_size, dtype=object)
+        self._lock = threading.Lock()
+
+    def check_version(self):
+        """
+        Clears the cache if the corpus version changed, at most every `check_interval` seconds.
+        """
+        now = time.monotonic()
+        if not self.version_source or (self._checked_at is not None and now - self._checked_at < self.check_interval):
+            return
+        self._checked_at = now
+        try:
+            version = self.version_source()
+        except Exception as e:
+            logging.error(f"Failed to read the corpus version: {e}")
+            return
+        if version != self.version:
+            self.invalidate(version)
+
+    def invalidate(self, version: Optional[str]):
+        """
+        Drops every answer and moves to a new corpus version.
+        """
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self.version = version
+            self._entries.clear()
+            self._expires[:] = 0
+            self._contexts[:] = None
+
+    def lookup(self, query_vector, context: str = "") -> Optional[CachedAnswer]:
+        """
+        Finds the answer to the most similar cached query.
+
+        Args:
+            query_vector: The query embedding.
+            context: Anything besides the query that the answer depends on. Defaults to "".
+
+        Returns:
+            The cached answer, or None on a miss.
+        """
+        self.check_version()
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        now = time.monotonic()
+        with self._lock:
+            if self._vectors is not None and self._entries:
+                valid = (self._expires > now) & (self._contexts == context)
+                scores = np.where(valid, self._vectors @ query, -np.inf)
+                slot = int(np.argmax(scores))
+                if scores[slot] >= self.threshold:
+                    entry = self._entries[slot]
+                    self._entries.move_to_end(slot)
+                    self.hits += 1
+                    self.llm_seconds_saved += entry.llm_seconds
+                    return entry
+            self.misses += 1
+            return None
+
+    def store(
+        self, query: str, query_vector, answer: Any, llm_seconds: float,
+        context: str = "", version: Optional[str] = None,
+    ):
+        """
+        Caches an answer.
+
+        Args:
+            query: The query text.
+            query_vector: The query embedding.
+            answer: The answer.
+            llm_seconds: The time the chain took, counted as saved on every hit.
+            context: Anything besides the query that the answer depends on. Defaults to "".
+            version: The corpus version read before answering. The answer is
+                dropped if the version has changed since. Defaults to None.
+        """
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        now = time.monotonic()
+        with self._lock:
+            if version != self.version:
+                return
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, len(query_vector)), dtype=np.float32)
+            slot = self._take_slot(now)
+            self._vectors[slot] = query_vector / (np.linalg.norm(query_vector) or 1)
+            self._expires[slot] = now + self.ttl
+            self._contexts[slot] = context
+            self._entries[slot] = CachedAnswer(query, answer, llm_seconds, now + self.ttl, version)
+
+    def _take_slot(self, now: float) -> int:
+        if len(self._entries) < self.max_size:
+            return next(slot for slot in range(self.max_size) if slot not in self._entries)
+        expired = [slot for slot, entry in self._entries.items() if entry.expires_at <= now]
+        for slot in expired:
+            del self._entries[slot]
+        if expired:
+            return expired[0]
+        slot, _ = self._entries.popitem(last=False)
+        return slot
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the cache counters.
+
+        Returns:
+            Hits, misses, hit rate, LLM seconds saved, invalidations and current size.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "llm_seconds_saved": round(self.llm_seconds_saved, 3),
+                "invalidations": self.invalidations,
+                "size": len(self._entries),
+            }
+
+_version_store = build_version_store(os.environ.get("BUCKET_NAME"))
+
+answer_cache = SemanticAnswerCache(version_source=lambda: read_corpus_version(_version_store))
+
+metrics.register_gauge(
+    "answer_cache_hits_total", "QA answers served from the semantic answer cache.",
+    lambda: {(): answer_cache.hits},
+    metric_type="counter",
+)
+metrics.register_gauge(
+    "answer_cache_misses_total", "QA questions not found in the semantic answer cache.",
+    lambda: {(): answer_cache.misses},
+    metric_type="counter",
+)
+metrics.register_gauge(
+    "answer_cache_llm_seconds_saved_total", "Chain seconds saved by semantic answer cache hits.",
+    lambda: {(): round(answer_cache.llm_seconds_saved, 3)},
+    metric_type="counter",
+)
@@ -0,0 +1,633 @@
+"""
+Benchmarks for the vector RAG ingestion and retrieval paths.
+
+Run against local stand-ins, so no GCS, BigQuery or Vertex AI access is needed:
+
+    python benchmarks.py loader --directory ./sample_docs
+    python benchmarks.py parse-timeout --hung 4
+    python benchmarks.py memory --documents 100 1000 3000
+    python benchmarks.py embeddings --chunks 5000 --quota-rate 0.05
+    python benchmarks.py index --rows 100000 --dimensions 768
+    python benchmarks.py manifest --documents 20
+    python benchmarks.py timing --requests 200 --latency 0.02
+
+The parse-timeout, manifest and timing checks exit with status 1 if any of its checks fail.
+"""
+import os
+import sys
+import math
+import uuid
+import time
+import json
+import random
+import argparse
+import tempfile
+import threading
+import statistics
+import contextlib
+import tracemalloc
+
+from loaders import ParallelLoader, list_local_blobs, parse_file
+from pipeline import IngestStats, split_stream, write_in_batches
+from embeddings import AdaptiveEmbedder
+
+def benchmark_loader(args) -> dict:
+    """
+    Compares sequential and parallel loading of a local directory of PDF and HTML files.
+    """
+    blobs = list_local_blobs(args.directory)
+    start = time.perf_counter()
+    sequential_docs = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for i, blob in enumerate(blobs):
+            file_path = os.path.join(tmp_dir, str(i))
+            blob.download_to_filename(file_path)
+            sequential_docs += len(parse_file(file_path, blob.name, f"gs://{blob.bucket.name}/{blob.name}"))
+    sequential = time.perf_counter() - start
+
+    loader = ParallelLoader(
+        download_workers=args.download_workers,
+        parse_workers=args.parse_workers,
+        file_timeout=args.file_timeout,
+    )
+    start = time.perf_counter()
+    parallel_docs = len(loader.load_all(blobs))
+    parallel = time.perf_counter() - start
+    return {
+        "files": len(blobs),
+        "sequential_s": round(sequential, 3),
+        "sequential_docs": sequential_docs,
+        "parallel_s": round(parallel, 3),
+        "parallel_docs": parallel_docs,
+        "speedup": round(sequential / parallel, 2) if parallel else None,
+        "failures": loader.failures,
+    }
+
+PARSE_SECONDS = 0.2
+
+def timed_parse(file_path: str, blob_name: str, source: str):
+    # Runs in a parse process. Files named hang-* never finish, like a parser stuck on a malformed PDF.
+    time.sleep(3600 if os.path.basename(blob_name).startswith("hang") else PARSE_SECONDS)
+    return [blob_name]
+
+def check_parse_timeout(args) -> dict:
+    """
+    Loads a directory in which some files hang the parser, and checks that the run still ends.
+    """
+    import multiprocessing
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        hung = [f"hang-{i}.html" for i in range(args.hung)]
+        ok = [f"doc-{i}.html" for i in range(args.files)]
+        for name in hung + ok:
+            with open(os.path.join(tmp_dir, name), "w") as f:
+                f.write(name)
+        # Hung files first, so they hold every parse process at the start.
+        blobs = sorted(list_local_blobs(tmp_dir), key=lambda blob: not blob.name.startswith("hang"))
+        loader = ParallelLoader(
+            download_workers=args.download_workers,
+            parse_workers=args.parse_workers,
+            file_timeout=args.file_timeout,
+            parse=timed_parse,
+        )
+        start = time.perf_counter()
+        docs = loader.load_all(blobs)
+        elapsed = time.perf_counter() - start
+    bound = (
+        args.file_timeout * math.ceil(args.hung / args.parse_workers)
+        + PARSE_SECONDS * math.ceil(args.files / args.parse_workers)
+        + args.slack
+    )
+    return {
+        "details": {"elapsed_s": round(elapsed, 2), "bound_s": round(bound, 2), "failures": loader.failures},
+        "checks": {
+            "hung_files_time_out": loader.failures == {name: "timed out" for name in hung},
+            "other_files_load": sorted(docs) == sorted(ok),
+            "run_ends_within_the_timeouts": elapsed < bound,
+            "no_parse_processes_left": not multiprocessing.active_children(),
+        },
+    }
+
+class FakeDocument:
+    """
+    A stand-in for a LangChain Document.
+    """
+
+    def __init__(self, page_content: str, metadata: dict):
+        self.page_content = page_content
+        self.metadata = metadata
+
+class FakeSplitter:
+    """
+    Splits documents into fixed-size character chunks.
+    """
+
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+
+    def split_documents(self, docs):
+        return [
+            FakeDocument(doc.page_content[i:i + self.chunk_size], dict(doc.metadata))
+            for doc in docs
+            for i in range(0, len(doc.page_content), self.chunk_size)
+        ]
+
+def generate_corpus(documents: int, pages: int, page_chars: int):
+    for i in range(documents):
+        yield [
+            FakeDocument(f"document {i} page {p} " * (page_chars // 16), {"blob_name": f"doc-{i}.pdf"})
+            for p in range(pages)
+        ]
+
+def fake_write(batch):
+    # Stands in for embedding and inserting: one 768-float vector per chunk.
+    vectors = [[0.0] * 768 for _ in batch]
+    return [f"{chunk.metadata['blob_name']}:{chunk.metadata['chunk']}" for chunk, _ in zip(batch, vectors)]
+
+def measure_peak(fn) -> float:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+def benchmark_memory(args) -> dict:
+    """
+    Compares peak memory of eager and streaming ingestion as the corpus grows.
+    """
+    splitter = FakeSplitter(args.chunk_size)
+    results = []
+    for documents in args.documents:
+        def eager():
+            all_documents = [doc for docs in generate_corpus(documents, args.pages, args.page_chars) for doc in docs]
+            splits = splitter.split_documents(all_documents)
+            for i, split in enumerate(splits):
+                split.metadata["chunk"] = i
+            fake_write(splits)
+
+        def streaming():
+            chunks = split_stream(generate_corpus(documents, args.pages, args.page_chars), splitter)
+            write_in_batches(chunks, fake_write, batch_size=args.batch_size, stats=IngestStats())
+
+        results.append({
+            "documents": documents,
+            "eager_peak_mb": round(measure_peak(eager), 2),
+            "streaming_peak_mb": round(measure_peak(streaming), 2),
+        })
+    return {"runs": results}
+
+class QuotaError(Exception):
+    """
+    Raised by FakeEmbeddingModel like a 429 from Vertex AI.
+    """
+
+class FakeEmbeddingModel:
+    """
+    A local embedding model with Vertex AI-like latency and quota.
+
+    Each request takes `base_latency` plus `per_token_latency` per estimated
+    token, and fails with QuotaError with probability `quota_rate`, or always
+    while more than `max_concurrent` requests are in flight.
+    """
+
+    def __init__(self, base_latency: float, per_token_latency: float, quota_rate: float, max_concurrent: int, dimensions: int = 768):
+        self.base_latency = base_latency
+        self.per_token_latency = per_token_latency
+        self.quota_rate = quota_rate
+        self.max_concurrent = max_concurrent
+        self.dimensions = dimensions
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts, batch_size: int = None):
+        with self._lock:
+            self.in_flight += 1
+            over_quota = self.in_flight > self.max_concurrent or random.random() < self.quota_rate
+        try:
+            if over_quota:
+                time.sleep(self.base_latency / 2)
+                raise QuotaError("429 Quota exceeded for online prediction requests")
+            tokens = sum(len(text) // 4 + 1 for text in texts)
+            time.sleep(self.base_latency + self.per_token_latency * tokens)
+            return [[0.0] * self.dimensions for _ in texts]
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+def benchmark_embeddings(args) -> dict:
+    """
+    Compares one-request-at-a-time embedding with the adaptive embedder on a fake model.
+    """
+    texts = [f"chunk {i} " * (args.chunk_chars // 8) for i in range(args.chunks)]
+    model = FakeEmbeddingModel(args.base_latency, args.per_token_latency, args.quota_rate, args.max_concurrent)
+
+    # What add_documents does: fixed batches of 5, one request at a time.
+    sequential = AdaptiveEmbedder(
+        lambda batch: model.embed_documents(batch), max_texts=5, max_tokens=10 ** 9,
+        max_concurrency=1, base_backoff=args.base_backoff,
+    )
+    start = time.perf_counter()
+    sequential.embed(texts)
+    sequential_s = time.perf_counter() - start
+
+    adaptive = AdaptiveEmbedder.for_vertex(model)
+    adaptive.base_backoff = args.base_backoff
+    start = time.perf_counter()
+    vectors = adaptive.embed(texts)
+    adaptive_s = time.perf_counter() - start
+    assert len(vectors) == len(texts) and all(vector is not None for vector in vectors)
+    return {
+        "chunks": args.chunks,
+        "sequential_s": round(sequential_s, 3),
+        "sequential": sequential.stats(),
+        "adaptive_s": round(adaptive_s, 3),
+        "adaptive": adaptive.stats(),
+        "speedup": round(sequential_s / adaptive_s, 2) if adaptive_s else None,
+    }
+
+def generate_vectors(rows: int, dimensions: int, clusters: int, seed: int = 0):
+    # Clustered vectors, like chunks of related documents, so near neighbours are close.
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimensions)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((rows, dimensions)).astype(np.float32)
+    return vectors, labels
+
+def benchmark_index(args) -> dict:
+    """
+    Measures snapshot search latency and recall against exact float64 brute force.
+    """
+    import numpy as np
+    from vector_index import VectorIndex, write_snapshot
+
+    vectors, labels = generate_vectors(args.rows, args.dimensions, args.clusters)
+    queries, _ = generate_vectors(args.queries, args.dimensions, args.clusters, seed=1)
+    exact = vectors.astype(np.float64)
+    exact /= np.linalg.norm(exact, axis=1, keepdims=True)
+    filter_value = f"doc-{0}.pdf"
+
+    def brute_force(query, mask=None):
+        scores = exact @ (query / np.linalg.norm(query))
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        return set(np.argsort(-scores)[:args.k].tolist())
+
+    rows = (
+        {"id": str(i), "content": f"chunk {i}", "metadata": {"document_name": f"doc-{label % 50}.pdf"}, "embedding": vector}
+        for i, (vector, label) in enumerate(zip(vectors, labels))
+    )
+    results = {"rows": args.rows, "dimensions": args.dimensions, "k": args.k}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        rows = list(rows)
+        mask = np.array([row["metadata"]["document_name"] == filter_value for row in rows])
+        for dtype in ("float32", "int8"):
+            directory = os.path.join(tmp_dir, dtype)
+            start = time.perf_counter()
+            write_snapshot(directory, rows, len(rows), dtype=dtype)
+            export_s = time.perf_counter() - start
+            start = time.perf_counter()
+            index = VectorIndex.load(directory)
+            load_s = time.perf_counter() - start
+            for name, filter in (("unfiltered", None), ("filtered", {"document_name": filter_value})):
+                latencies, hits = [], 0
+                for query in queries:
+                    start = time.perf_counter()
+                    found = index.search(query, k=args.k, filter=filter)
+                    latencies.append(time.perf_counter() - start)
+                    hits += len({int(document["id"]) for document, _ in found} & brute_force(query, mask if filter else None))
+                latencies.sort()
+                results[f"{dtype}_{name}"] = {
+                    "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+                    "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+                    f"recall@{args.k}": round(hits / (args.k * len(queries)), 4),
+                }
+            results[f"{dtype}_snapshot_mb"] = round(
+                sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)) / 1024 / 1024, 1
+            )
+            results[f"{dtype}_export_s"] = round(export_s, 2)
+            results[f"{dtype}_load_s"] = round(load_s, 3)
+    return results
+
+class FakeVectorStore:
+    """
+    A local stand-in for the BigQuery vector store table, keyed by row id.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.fail_after_batches = None
+        self.batches = 0
+
+    def add(self, chunks, clear_table: bool, stats: IngestStats, batch_size: int):
+        if clear_table:
+            self.rows.clear()
+
+        def write_batch(batch):
+            if self.fail_after_batches is not None and self.batches >= self.fail_after_batches:
+                raise RuntimeError("injected write failure")
+            self.batches += 1
+            ids = [uuid.uuid4().hex for _ in batch]
+            for row_id, chunk in zip(ids, batch):
+                self.rows[row_id] = (chunk.metadata["blob_name"], chunk.page_content)
+            return ids
+
+        return self, write_in_batches(chunks, write_batch, batch_size=batch_size, stats=stats)
+
+    def delete(self, ids):
+        for row_id in ids:
+            self.rows.pop(row_id, None)
+
+def expected_rows(directory: str, chunk_size: int) -> list:
+    # What a full rebuild of the current directory would write.
+    rows = []
+    for blob in list_local_blobs(directory):
+        with open(blob.path) as f:
+            content = f.read()
+        rows.extend((blob.name, content[i:i + chunk_size]) for i in range(0, len(content), chunk_size))
+    return sorted(rows)
+
+def check_manifest(args) -> dict:
+    """
+    Runs incremental ingestion against a local directory, manifest and vector store.
+
+    The source bucket is a local directory, the manifest and corpus version
+    are local files, and the BigQuery table is a FakeVectorStore. After each
+    run the table must hold exactly what a full rebuild would write.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source_dir = os.path.join(tmp_dir, "bucket")
+        os.makedirs(source_dir)
+        os.environ["MANIFEST_PATH"] = os.path.join(tmp_dir, "manifest.json")
+        os.environ["CORPUS_VERSION_PATH"] = os.path.join(tmp_dir, "version.json")
+        import routes
+        from manifest import build_version_store, read_corpus_version
+
+        store = FakeVectorStore()
+        runs = {}
+
+        def write_document(i: int, text: str):
+            with open(os.path.join(source_dir, f"doc-{i}.html"), "w") as f:
+                f.write(text)
+
+        def fake_process_docs(data, blobs=None, loader=None):
+            def documents():
+                for blob in blobs:
+                    with open(blob.path) as f:
+                        yield [FakeDocument(f.read(), {"blob_name": blob.name})]
+            return split_stream(documents(), FakeSplitter(routes.get_split_config(data)["chunk_size"]))
+
+        def ingest(name: str, data: dict) -> bool:
+            store.batches = 0
+            version = read_corpus_version(build_version_store(routes.BUCEKT_NAME))
+            try:
+                routes.preproc_run_route_controller(dict(data))
+                error = None
+            except Exception as e:
+                error = str(e)
+            runs[name] = {
+                "batches": store.batches,
+                "rows": len(store.rows),
+                "version_changed": read_corpus_version(build_version_store(routes.BUCEKT_NAME)) != version,
+                "error": error,
+            }
+            return sorted(store.rows.values()) == expected_rows(source_dir, data.get("chunk_size", routes.DEFAULT_CHUNK_SIZE))
+
+        def ids_of(blob_name: str) -> set:
+            return {row_id for row_id, (name, _) in store.rows.items() if name == blob_name}
+
+        originals = {
+            "list_source_blobs": routes.list_source_blobs,
+            "process_docs": routes.process_docs,
+            "add_docs_in_bqQueryVectorstore": routes.add_docs_in_bqQueryVectorstore,
+            "get_vector_store": routes.get_vector_store,
+            "VECTOR_INDEX_PATH": routes.VECTOR_INDEX_PATH,
+        }
+        routes.list_source_blobs = lambda bucket_name, folder_name=None: list_local_blobs(source_dir)
+        routes.process_docs = fake_process_docs
+        routes.add_docs_in_bqQueryVectorstore = lambda docs, clear_table=True, stats=None: store.add(
+            docs, clear_table, stats, args.batch_size
+        )
+        routes.get_vector_store = lambda embedding=None: store
+        routes.VECTOR_INDEX_PATH = None
+        checks = {}
+        try:
+            for i in range(args.documents):
+                write_document(i, f"document {i} " * args.words)
+            checks["first_run_ingests_everything"] = ingest("first", {}) and runs["first"]["version_changed"]
+
+            checks["unchanged_run_writes_nothing"] = (
+                ingest("unchanged", {}) and runs["unchanged"]["batches"] == 0
+                and not runs["unchanged"]["version_changed"]
+            )
+
+            kept = {name: ids_of(name) for name in ("doc-1.html", "doc-2.html")}
+            replaced = ids_of("doc-0.html")
+            write_document(0, "changed document " * args.words)
+            checks["modified_file_is_replaced"] = ingest("modified", {}) and runs["modified"]["version_changed"]
+            checks["modified_file_gets_new_rows"] = not (ids_of("doc-0.html") & replaced)
+            checks["other_files_keep_their_rows"] = all(ids_of(name) == ids for name, ids in kept.items())
+
+            os.remove(os.path.join(source_dir, "doc-1.html"))
+            checks["deleted_file_is_removed"] = (
+                ingest("deleted", {}) and not ids_of("doc-1.html") and runs["deleted"]["version_changed"]
+            )
+
+            before = dict(store.rows)
+            write_document(2, "rewritten document " * args.words * 4)
+            write_document(3, "rewritten document " * args.words * 4)
+            store.fail_after_batches = 1
+            ingest("failed_write", {})
+            store.fail_after_batches = None
+            checks["failed_write_is_rolled_back"] = (
+                runs["failed_write"]["error"] is not None and store.rows == before
+                and not runs["failed_write"]["version_changed"]
+            )
+            checks["next_run_ingests_rolled_back_files"] = ingest("retried", {})
+
+            checks["new_chunk_size_rebuilds_everything"] = (
+                ingest("chunk_size", {"chunk_size": args.new_chunk_size, "chunk_overlap": 0})
+                and not (set(store.rows) & set(before))
+            )
+        finally:
+            for name, value in originals.items():
+                setattr(routes, name, value)
+    return {"details": {"documents": args.documents, "runs": runs}, "checks": checks}
+
+@contextlib.contextmanager
+def timing_installed(app, enabled: bool):
+    """
+    Runs with the request hooks of install_timing, or with them removed.
+    """
+    before = list(app.before_request_funcs.get(None, []))
+    after = list(app.after_request_funcs.get(None, []))
+    if not enabled:
+        app.before_request_funcs[None] = [fn for fn in before if fn.__name__ != "_start_timing"]
+        app.after_request_funcs[None] = [fn for fn in after if fn.__name__ != "_finish_timing"]
+    try:
+        yield
+    finally:
+        app.before_request_funcs[None] = before
+        app.after_request_funcs[None] = after
+
+def compare_timing(app, send, rounds: int, requests: int) -> dict:
+    """
+    Replays send(client) through the app with timing on and off, in alternating rounds.
+
+    Rounds alternate which mode goes first, so drift in the machine's speed
+    hits both modes alike. The overhead compares the medians of the per-round
+    median latencies.
+    """
+    client = app.test_client()
+    medians = {True: [], False: []}
+    headers = {True: [], False: []}
+    statuses = set()
+    for round_number in range(rounds + 1):
+        for enabled in ((True, False) if round_number % 2 else (False, True)):
+            latencies = []
+            with timing_installed(app, enabled):
+                for _ in range(requests):
+                    start = time.perf_counter()
+                    response = send(client)
+                    latencies.append(time.perf_counter() - start)
+                    headers[enabled].append("Server-Timing" in response.headers)
+                    statuses.add(response.status_code)
+            # The first round only warms up the app and caches.
+            if round_number:
+                medians[enabled].append(statistics.median(latencies))
+    on, off = statistics.median(medians[True]), statistics.median(medians[False])
+    overhead = (on - off) / off
+    return {
+        "details": {
+            "timing_on_ms": round(on * 1000, 3),
+            "timing_off_ms": round(off * 1000, 3),
+            "overhead_us": round((on - off) * 1e6, 1),
+            "overhead_pct": round(overhead * 100, 3),
+        },
+        "checks": {
+            "requests_succeed": statuses == {200},
+            "timed_responses_carry_server_timing": all(headers[True]),
+            "untimed_responses_do_not": not any(headers[False]),
+            "overhead_below_1_pct": overhead < 0.01,
+        },
+    }
+
+class FakeQueryEmbeddings:
+    """
+    A query embedding model that answers after a fixed latency, standing in for Vertex AI.
+    """
+
+    def __init__(self, latency: float, dimensions: int = 768):
+        self.latency = latency
+        self.vector = [1.0] + [0.0] * (dimensions - 1)
+
+    def embed_query(self, text: str):
+        time.sleep(self.latency)
+        return self.vector
+
+def check_timing(args) -> dict:
+    """
+    Checks that per-request timing costs less than 1% of a QA request answered from the semantic cache.
+
+    The request embeds the question with a fake model of `latency` seconds
+    and finds the cached answer, so no LLM, BigQuery or Vertex AI is used.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["CORPUS_VERSION_PATH"] = os.path.join(tmp_dir, "version.json")
+        import main as webhook
+        import routes
+        from answer_cache import answer_cache
+
+        model = FakeQueryEmbeddings(args.latency)
+        original = routes.get_cached_embedding_model
+        routes.get_cached_embedding_model = lambda: model
+        try:
+            answer_cache.check_version()
+            answer_cache.store(
+                "what plans are there", model.vector, "There are three plans.", 1.0,
+                context="{}", version=answer_cache.version,
+            )
+            result = compare_timing(
+                webhook.app,
+                lambda client: client.post("/vectorStore/chains/qa", json={"text": "which plans exist"}),
+                args.rounds,
+                args.requests,
+            )
+        finally:
+            routes.get_cached_embedding_model = original
+    result["details"].update({
+        "route": "/vectorStore/chains/qa",
+        "latency_s": args.latency,
+        "answer_cache_hits": answer_cache.hits,
+    })
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    loader_parser = subparsers.add_parser("loader", help="Sequential vs parallel document loading.")
+    loader_parser.add_argument("--directory", required=True, help="Local directory standing in for the bucket.")
+    loader_parser.add_argument("--download-workers", type=int, default=8)
+    loader_parser.add_argument("--parse-workers", type=int, default=os.cpu_count() or 1)
+    loader_parser.add_argument("--file-timeout", type=float, default=120)
+    loader_parser.set_defaults(run=benchmark_loader)
+
+    parse_timeout_parser = subparsers.add_parser("parse-timeout", help="Check that hung parses do not stall loading.")
+    parse_timeout_parser.add_argument("--files", type=int, default=10)
+    parse_timeout_parser.add_argument("--hung", type=int, default=4)
+    parse_timeout_parser.add_argument("--download-workers", type=int, default=8)
+    parse_timeout_parser.add_argument("--parse-workers", type=int, default=2)
+    parse_timeout_parser.add_argument("--file-timeout", type=float, default=1.0)
+    parse_timeout_parser.add_argument("--slack", type=float, default=5.0)
+    parse_timeout_parser.set_defaults(run=check_parse_timeout)
+
+    memory_parser = subparsers.add_parser("memory", help="Peak memory of eager vs streaming ingestion.")
+    memory_parser.add_argument("--documents", type=int, nargs="+", default=[200, 2000])
+    memory_parser.add_argument("--pages", type=int, default=5)
+    memory_parser.add_argument("--page-chars", type=int, default=2000)
+    memory_parser.add_argument("--chunk-size", type=int, default=200)
+    memory_parser.add_argument("--batch-size", type=int, default=100)
+    memory_parser.set_defaults(run=benchmark_memory)
+
+    embeddings_parser = subparsers.add_parser("embeddings", help="Sequential vs adaptive embedding on a fake model.")
+    embeddings_parser.add_argument("--chunks", type=int, default=2000)
+    embeddings_parser.add_argument("--chunk-chars", type=int, default=800)
+    embeddings_parser.add_argument("--base-latency", type=float, default=0.05)
+    embeddings_parser.add_argument("--per-token-latency", type=float, default=0.00002)
+    embeddings_parser.add_argument("--quota-rate", type=float, default=0.02)
+    embeddings_parser.add_argument("--max-concurrent", type=int, default=6)
+    embeddings_parser.add_argument("--base-backoff", type=float, default=0.1)
+    embeddings_parser.set_defaults(run=benchmark_embeddings)
+
+    index_parser = subparsers.add_parser("index", help="Snapshot index latency and recall vs brute force.")
+    index_parser.add_argument("--rows", type=int, default=50000)
+    index_parser.add_argument("--dimensions", type=int, default=768)
+    index_parser.add_argument("--clusters", type=int, default=200)
+    index_parser.add_argument("--queries", type=int, default=200)
+    index_parser.add_argument("-k", type=int, default=4)
+    index_parser.set_defaults(run=benchmark_index)
+
+    manifest_parser = subparsers.add_parser("manifest", help="Check incremental ingestion against local stand-ins.")
+    manifest_parser.add_argument("--documents", type=int, default=20)
+    manifest_parser.add_argument("--words", type=int, default=100)
+    manifest_parser.add_argument("--batch-size", type=int, default=20)
+    manifest_parser.add_argument("--new-chunk-size", type=int, default=150)
+    manifest_parser.set_defaults(run=check_manifest)
+
+    timing_parser = subparsers.add_parser("timing", help="Check that request timing costs under 1% of a request.")
+    timing_parser.add_argument("--requests", type=int, default=100)
+    timing_parser.add_argument("--rounds", type=int, default=8)
+    timing_parser.add_argument("--latency", type=float, default=0.02)
+    timing_parser.set_defaults(run=check_timing)
+
+    args = parser.parse_args()
+    result = args.run(args)
+    print(json.dumps(result, indent=2))
+    if not all(result.get("checks", {}).values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+import os
+import array
+import sqlite3
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+from timing import metrics
+
+EMBED_CACHE_ENABLED = os.environ.get("EMBED_CACHE_ENABLED", "true").lower() == "true"
+EMBED_CACHE_MAX_SIZE = int(os.environ.get("EMBED_CACHE_MAX_SIZE", 5000))
+# /tmp is in memory on Cloud Functions, so the local tier is off there unless a path is set.
+ON_CLOUD_FUNCTIONS = bool(os.environ.get("K_SERVICE") or os.environ.get("FUNCTION_TARGET"))
+EMBED_CACHE_PATH = os.environ.get("EMBED_CACHE_PATH", "" if ON_CLOUD_FUNCTIONS else "/tmp/embedding_cache.sqlite")
+EMBED_CACHE_STORE_MAX_ROWS = int(os.environ.get("EMBED_CACHE_STORE_MAX_ROWS", 20000))
+
+def build_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+def pack(vector: Sequence[float]) -> bytes:
+    return array.array("f", vector).tobytes()
+
+def unpack(data: bytes) -> List[float]:
+    vector = array.array("f")
+    vector.frombytes(data)
+    return vector.tolist()
+
+class EmbeddingStore:
+    """
+    Interface for a persistent tier of the embedding cache.
+
+    Vectors are stored as packed float32 bytes under their content key.
+    """
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        raise NotImplementedError
+
+    def set_many(self, items: Dict[str, bytes]):
+        raise NotImplementedError
+
+class SqliteEmbeddingStore(EmbeddingStore):
+    """
+    Keeps up to `max_rows` embeddings in a local SQLite file, evicting the least recently used.
+    """
+
+    def __init__(self, path: str, max_rows: int = EMBED_CACHE_STORE_MAX_ROWS):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_rows = max_rows
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(embeddings)")]
+        if columns and "accessed_at" not in columns:
+            # A cache file from before eviction: start over rather than migrate.
+            self._conn.execute("DROP TABLE embeddings")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed_at ON embeddings (accessed_at)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        found = {}
+        with self._lock:
+            # Stay under SQLite's limit of 999 bound parameters.
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                )
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET accessed_at = ? WHERE key = ?", ((now, key) for key in found)
+                )
+                self._conn.commit()
+        return found
+
+    def set_many(self, items: Dict[str, bytes]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                ((key, value, now) for key, value in items.items()),
+            )
+            excess = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_rows
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY accessed_at LIMIT ?)",
+                    (excess,),
+                )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+class RedisEmbeddingStore(EmbeddingStore):
+    """
+    Keeps embeddings in any client exposing Redis `mget` and `mset`, shared across instances.
+    """
+
+    def __init__(self, client, prefix: str = "embedding:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, bytes]:
+        values = self.client.mget([self.prefix + key for key in keys])
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, items: Dict[str, bytes]):
+        self.client.mset({self.prefix + key: value for key, value in items.items()})
+
+class EmbeddingCache:
+    """
+    A content-addressed embedding cache with an in-memory LRU tier and persistent tiers.
+
+    Entries are keyed by a hash of the model name and the text, so the same
+    text is embedded once per model however many documents or queries it
+    appears in. A miss in memory falls through to the local store and then
+    the shared store; hits in a lower tier are copied into the tiers above.
+    Store errors are logged and treated as misses.
+    """
+
+    def __init__(
+        self,
+        max_size: int = EMBED_CACHE_MAX_SIZE,
+        store: EmbeddingStore = None,
+        shared: EmbeddingStore = None,
+    ):
+        """
+        Initializes the cache.
+
+        Args:
+            max_size: Vectors kept in memory. Defaults to `EMBED_CACHE_MAX_SIZE` or 5000.
+            store: The local persistent tier. Defaults to None.
+            shared: The tier shared across instances. Defaults to None.
+        """
+        self.max_size = max_size
+        self.store = store
+        self.shared = shared
+        self.hits = {"memory": 0, "store": 0, "shared": 0}
+        self.misses = 0
+        # Packed float32 vectors take an eighth of the memory of float lists.
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, items: Dict[str, bytes]):
+        with self._lock:
+            for key, value in items.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _read_tier(self, tier: str, store: Optional[EmbeddingStore], keys: List[str]) -> Dict[str, bytes]:
+        if not store or not keys:
+            return {}
+        try:
+            return store.get_many(keys)
+        except Exception as e:
+            logging.error(f"Failed to read from the {tier} embedding store: {e}")
+            return {}
+
+    def _write_tier(self, tier: str, store: Optional[EmbeddingStore], items: Dict[str, bytes]):
+        if not store or not items:
+            return
+        try:
+            store.set_many(items)
+        except Exception as e:
+            logging.error(f"Failed to write to the {tier} embedding store: {e}")
+
+    def get_many(self, model_name: str, texts: Iterable[str]) -> Dict[str, List[float]]:
+        """
+        Looks up cached vectors.
+
+        Args:
+            model_name: The embedding model.
+            texts: The texts to look up.
+
+        Returns:
+            The vectors found, by text.
+        """
+        keys = {build_key(model_name, text): text for text in texts}
+        found: Dict[str, bytes] = {}
+        with self._lock:
+            for key in keys:
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = value
+            self.hits["memory"] += len(found)
+
+        missing = [key for key in keys if key not in found]
+        from_store = self._read_tier("local", self.store, missing)
+        missing = [key for key in missing if key not in from_store]
+        from_shared = self._read_tier("shared", self.shared, missing)
+        self._write_tier("local", self.store, from_shared)
+        self._remember({**from_store, **from_shared})
+        with self._lock:
+            self.hits["store"] += len(from_store)
+            self.hits["shared"] += len(from_shared)
+            self.misses += len(missing) - len(from_shared)
+        found.update(from_store)
+        found.update(from_shared)
+        return {keys[key]: unpack(value) for key, value in found.items()}
+
+    def set_many(self, model_name: str, vectors: Dict[str, Sequence[float]]):
+        """
+        Caches vectors in every tier.
+
+        Args:
+            model_name: The embedding model.
+            vectors: The vectors by text.
+        """
+        items = {build_key(model_name, text): pack(vector) for text, vector in vectors.items()}
+        self._remember(items)
+        self._write_tier("local", self.store, items)
+        self._write_tier("shared", self.shared, items)
+
+    def embed(
+        self,
+        model_name: str,
+        texts: Sequence[str],
+        embed_texts: Callable[[List[str]], List[List[float]]],
+    ) -> List[List[float]]:
+        """
+        Embeds texts, calling the model only for distinct texts not in the cache.
+
+        Args:
+            model_name: The embedding model.
+            texts: The texts to embed.
+            embed_texts: Embeds a list of texts, e.g. AdaptiveEmbedder.embed.
+
+        Returns:
+            One vector per text, in order.
+        """
+        vectors = self.get_many(model_name, texts)
+        missing = [text for text in dict.fromkeys(texts) if text not in vectors]
+        if missing:
+            new_vectors = dict(zip(missing, embed_texts(missing)))
+            self.set_many(model_name, new_vectors)
+            vectors.update(new_vectors)
+        return [vectors[text] for text in texts]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the cache counters.
+
+        Returns:
+            Hits per tier, misses, hit rate and in-memory size.
+        """
+        with self._lock:
+            hits = sum(self.hits.values())
+            total = hits + self.misses
+            return {
+                **{f"{tier}_hits": count for tier, count in self.hits.items()},
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "size": len(self._entries),
+            }
+
+class CachedEmbeddings:
+    """
+    Implements the LangChain Embeddings interface over a model and an EmbeddingCache.
+
+    Can be passed anywhere a VertexAIEmbeddings model is, e.g. as the
+    embedding of a vector store so query embeddings are cached too.
+    """
+
+    def __init__(self, model, cache: "EmbeddingCache", embed_texts: Callable[[List[str]], List[List[float]]] = None):
+        """
+        Initializes the wrapper.
+
+        Args:
+            model: The embedding model, with model_name, embed_documents and embed_query.
+            cache: The embedding cache.
+            embed_texts: Embeds documents on a miss. Defaults to model.embed_documents.
+        """
+        self.model = model
+        self.cache = cache
+        self.model_name = model.model_name
+        self.embed_texts = embed_texts or model.embed_documents
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.cache.embed(self.model_name, texts, self.embed_texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        # Vertex AI embeds queries with a different task type than documents.
+        query_model = f"{self.model_name}#query"
+        return self.cache.embed(query_model, [text], lambda texts: [self.model.embed_query(texts[0])])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+def build_embedding_cache_from_env() -> EmbeddingCache:
+    """
+    Builds the embedding cache configured by `EMBED_CACHE_*`.
+
+    `EMBED_CACHE_PATH` is the SQLite file of the local tier (an empty value
+    disables it, the default on Cloud Functions), holding at most
+    `EMBED_CACHE_STORE_MAX_ROWS` vectors. `EMBED_CACHE_REDIS_URL` enables
+    the shared tier.
+
+    Returns:
+        The embedding cache.
+    """
+    store = None
+    if EMBED_CACHE_PATH:
+        try:
+            store = SqliteEmbeddingStore(EMBED_CACHE_PATH)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to open the embedding cache at {EMBED_CACHE_PATH}: {e}")
+    shared = None
+    redis_url = os.environ.get("EMBED_CACHE_REDIS_URL")
+    if redis_url:
+        import redis
+        shared = RedisEmbeddingStore(redis.Redis.from_url(redis_url))
+    return EmbeddingCache(store=store, shared=shared)
+
+embedding_cache = build_embedding_cache_from_env()
+
+metrics.register_gauge(
+    "embedding_cache_hits_total", "Embedding cache hits per tier.",
+    lambda: {(("tier", tier),): count for tier, count in embedding_cache.hits.items()},
+    metric_type="counter",
+)
+metrics.register_gauge(
+    "embedding_cache_misses_total", "Embedding cache misses.",
+    lambda: {(): embedding_cache.misses},
+    metric_type="counter",
+)
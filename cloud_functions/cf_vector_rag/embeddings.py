@@ -0,0 +1,201 @@
+import os
+import time
+import random
+import logging
+import threading
+from concurrent import futures
+from typing import Any, Callable, Dict, List, Sequence
+
+EMBED_MAX_TEXTS = int(os.environ.get("EMBED_MAX_TEXTS", 250))
+EMBED_MAX_TOKENS = int(os.environ.get("EMBED_MAX_TOKENS", 20000))
+EMBED_MAX_CONCURRENCY = int(os.environ.get("EMBED_MAX_CONCURRENCY", 8))
+EMBED_TARGET_LATENCY = float(os.environ.get("EMBED_TARGET_LATENCY", 5.0))
+EMBED_MAX_RETRIES = int(os.environ.get("EMBED_MAX_RETRIES", 6))
+
+def estimate_tokens(text: str) -> int:
+    # About four characters per token for English text.
+    return len(text) // 4 + 1
+
+def is_quota_error(error: BaseException) -> bool:
+    """
+    Recognizes 429 / RESOURCE_EXHAUSTED errors from Vertex AI or a stand-in.
+    """
+    name = type(error).__name__
+    return name in ("ResourceExhausted", "TooManyRequests", "QuotaError") or "429" in str(error)
+
+class AdaptiveEmbedder:
+    """
+    Embeds texts in token-bounded batches, several at a time.
+
+    Batches are packed up to a token budget and a text limit, and up to
+    `concurrency` of them are in flight. Both adapt like TCP congestion
+    control: fast successes grow the budget and, once per window of
+    `concurrency` requests, the concurrency by one; a quota error halves the
+    concurrency, or the budget once concurrency is down to one. Errors from
+    requests sent before the last decrease are not counted again. A failed
+    batch is retried on its own with jittered exponential backoff, so one 429
+    does not abort the run.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        max_texts: int = EMBED_MAX_TEXTS,
+        max_tokens: int = EMBED_MAX_TOKENS,
+        max_concurrency: int = EMBED_MAX_CONCURRENCY,
+        target_latency: float = EMBED_TARGET_LATENCY,
+        max_retries: int = EMBED_MAX_RETRIES,
+        base_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+    ):
+        """
+        Initializes the embedder.
+
+        Args:
+            embed_batch: Embeds one batch of texts in a single request.
+            max_texts: Texts per request. Defaults to `EMBED_MAX_TEXTS` or 250.
+            max_tokens: Estimated tokens per request. Defaults to `EMBED_MAX_TOKENS` or 20000.
+            max_concurrency: Requests in flight. Defaults to `EMBED_MAX_CONCURRENCY` or 8.
+            target_latency: Seconds per request above which the embedder stops growing. Defaults to 5.0.
+            max_retries: Retries per batch. Defaults to `EMBED_MAX_RETRIES` or 6.
+            base_backoff: First backoff in seconds. Defaults to 1.0.
+            max_backoff: Longest backoff in seconds. Defaults to 60.0.
+        """
+        self.embed_batch = embed_batch
+        self.max_texts = max_texts
+        self.max_tokens = max_tokens
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.token_budget = max(max_tokens // 4, 1)
+        self.concurrency = max(max_concurrency // 2, 1)
+        self.texts = 0
+        self.requests = 0
+        self.quota_errors = 0
+        self.retries = 0
+        self.wall_seconds = 0.0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_vertex(cls, model) -> "AdaptiveEmbedder":
+        """
+        Builds an embedder for a VertexAIEmbeddings model, one request per batch.
+        """
+        return cls(lambda texts: model.embed_documents(texts, batch_size=len(texts)))
+
+    def build_batches(self, texts: Sequence[str]) -> List[List[int]]:
+        """
+        Packs text indices into batches within the current token budget.
+        """
+        batches, batch, tokens = [], [], 0
+        budget = self.token_budget
+        for i, text in enumerate(texts):
+            text_tokens = estimate_tokens(text)
+            if batch and (tokens + text_tokens > budget or len(batch) >= self.max_texts):
+                batches.append(batch)
+                batch, tokens = [], 0
+            batch.append(i)
+            tokens += text_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _on_success(self, elapsed: float, size: int):
+        with self._lock:
+            self.requests += 1
+            self.texts += size
+            if elapsed < self.target_latency:
+                self.token_budget = min(int(self.token_budget * 1.25) + 1, self.max_tokens)
+                self._successes += 1
+                if self._successes >= self.concurrency:
+                    self._successes = 0
+                    self.concurrency = min(self.concurrency + 1, self.max_concurrency)
+            else:
+                self.concurrency = max(self.concurrency - 1, 1)
+
+    def _on_quota_error(self, sent_at: float):
+        with self._lock:
+            self.quota_errors += 1
+            if sent_at < self._last_decrease:
+                return
+            self._last_decrease = time.monotonic()
+            self._successes = 0
+            if self.concurrency > 1:
+                self.concurrency //= 2
+            else:
+                self.token_budget = max(self.token_budget // 2, 1)
+
+    def _embed_with_retry(self, texts: List[str]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            try:
+                vectors = self.embed_batch(texts)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                if is_quota_error(e):
+                    self._on_quota_error(start)
+                with self._lock:
+                    self.retries += 1
+                backoff = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+                logging.warning(f"Embedding batch of {len(texts)} failed, retrying in {backoff:.1f}s: {e}")
+                time.sleep(backoff)
+                continue
+            self._on_success(time.monotonic() - start, len(texts))
+            return vectors
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        """
+        Embeds texts, preserving their order.
+
+        Args:
+            texts: The texts to embed.
+
+        Returns:
+            One vector per text.
+
+        Raises:
+            Exception: The last error of a batch that failed every retry.
+        """
+        start = time.monotonic()
+        vectors: List[Any] = [None] * len(texts)
+        batches = iter(self.build_batches(texts))
+        with futures.ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="embed"
+        ) as executor:
+            pending: Dict[futures.Future, List[int]] = {}
+
+            def fill():
+                while len(pending) < self.concurrency:
+                    batch = next(batches, None)
+                    if batch is None:
+                        return
+                    pending[executor.submit(self._embed_with_retry, [texts[i] for i in batch])] = batch
+
+            fill()
+            while pending:
+                done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    batch = pending.pop(future)
+                    for i, vector in zip(batch, future.result()):
+                        vectors[i] = vector
+                fill()
+        with self._lock:
+            self.wall_seconds += time.monotonic() - start
+        return vectors
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "texts": self.texts,
+                "requests": self.requests,
+                "quota_errors": self.quota_errors,
+                "retries": self.retries,
+                "token_budget": self.token_budget,
+                "concurrency": self.concurrency,
+                "chunks_per_s": round(self.texts / self.wall_seconds, 2) if self.wall_seconds else None,
+            }
@@ -0,0 +1,261 @@
+import os
+import math
+import queue
+import shutil
+import hashlib
+import logging
+import tempfile
+import multiprocessing
+from concurrent import futures
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+DOWNLOAD_WORKERS = int(os.environ.get("LOADER_DOWNLOAD_WORKERS", 8))
+PARSE_WORKERS = int(os.environ.get("LOADER_PARSE_WORKERS", os.cpu_count() or 1))
+FILE_TIMEOUT = float(os.environ.get("LOADER_FILE_TIMEOUT", 120))
+
+def parse_file(file_path: str, blob_name: str, source: str) -> List[Any]:
+    """
+    Parses a downloaded PDF or HTML file into documents. Runs in a worker process.
+
+    Args:
+        file_path: The local copy of the blob.
+        blob_name: The blob name, used to pick the parser.
+        source: The gs:// URL recorded as the document source.
+
+    Returns:
+        The parsed documents with source, document_name and blob_name metadata.
+    """
+    if blob_name.endswith(".pdf"):
+        from langchain_community.document_loaders import PyPDFLoader
+        docs = PyPDFLoader(file_path).load()
+    else:
+        from langchain_community.document_loaders import UnstructuredHTMLLoader
+        docs = UnstructuredHTMLLoader(file_path).load()
+    for doc in docs:
+        doc.metadata["source"] = source
+        doc.metadata["document_name"] = blob_name.split("/")[-1]
+        doc.metadata["blob_name"] = blob_name
+    return docs
+
+def run_parse_worker(connection, parse: Callable[[str, str, str], List[Any]]):
+    """
+    Parses the files sent over connection until it receives None. Runs in a worker process.
+    """
+    while True:
+        task = connection.recv()
+        if task is None:
+            return
+        try:
+            connection.send((True, parse(*task)))
+        except Exception as e:
+            # The exception itself may not pickle.
+            connection.send((False, str(e)))
+
+class ParseWorker:
+    """
+    A parse process of its own, killed and replaced when a parse exceeds its timeout.
+    """
+
+    def __init__(self, parse: Callable[[str, str, str], List[Any]], context):
+        self.parse = parse
+        self.context = context
+        self._start()
+
+    def _start(self):
+        self.connection, child_connection = self.context.Pipe()
+        self.process = self.context.Process(
+            target=run_parse_worker, args=(child_connection, self.parse), daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+
+    def run(self, file_path: str, blob_name: str, source: str, timeout: float) -> List[Any]:
+        """
+        Parses one file in the worker process.
+
+        Raises:
+            TimeoutError: If the parse takes longer than timeout. The process is replaced.
+            RuntimeError: If the parse fails or the process dies.
+        """
+        if not self.process.is_alive():
+            self.restart()
+        self.connection.send((file_path, blob_name, source))
+        if not self.connection.poll(timeout):
+            self.restart()
+            raise TimeoutError()
+        try:
+            ok, result = self.connection.recv()
+        except EOFError:
+            self.restart()
+            raise RuntimeError("parse process exited")
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    def restart(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+        self._start()
+
+    def close(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+class LocalBlob:
+    """
+    A local file that stands in for a Cloud Storage blob.
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self.bucket = type("LocalBucket", (), {"name": os.path.basename(os.path.normpath(directory))})()
+        stat = os.stat(self.path)
+        self.generation = int(stat.st_mtime_ns)
+        with open(self.path, "rb") as f:
+            self.md5_hash = hashlib.md5(f.read()).hexdigest()
+
+    def download_to_filename(self, filename: str, timeout: float = None):
+        shutil.copyfile(self.path, filename)
+
+def list_local_blobs(directory: str) -> List[LocalBlob]:
+    """
+    Lists the PDF and HTML files under a directory as blobs.
+    """
+    return [
+        LocalBlob(directory, os.path.relpath(os.path.join(root, name), directory))
+        for root, _, names in os.walk(directory)
+        for name in sorted(names)
+        if name.endswith((".pdf", ".html"))
+    ]
+
+class ParallelLoader:
+    """
+    Downloads blobs in a thread pool and parses them in worker processes.
+
+    Downloads are I/O bound and run in threads; PyPDF and unstructured
+    parsing is CPU bound and runs in `parse_workers` processes. At most
+    `max_in_flight` files are downloaded or parsed at once, so a large
+    bucket does not fill the local disk. A downloaded file waits for a free
+    parse process before its parse timeout starts. A parse that exceeds
+    `file_timeout` has its process killed and replaced, so a hung parser
+    cannot hold a process, and no file waits longer than the parses queued
+    ahead of it could take. A file whose download or parse fails or times
+    out is logged, recorded in `failures` and skipped without stopping the
+    others.
+
+    Parse processes are started with "spawn": forking while download
+    threads hold locks could deadlock the children.
+    """
+
+    def __init__(
+        self,
+        download_workers: int = DOWNLOAD_WORKERS,
+        parse_workers: int = PARSE_WORKERS,
+        file_timeout: float = FILE_TIMEOUT,
+        max_in_flight: int = None,
+        parse: Callable[[str, str, str], List[Any]] = parse_file,
+    ):
+        """
+        Initializes the loader.
+
+        Args:
+            download_workers: Concurrent downloads. Defaults to `LOADER_DOWNLOAD_WORKERS` or 8.
+            parse_workers: Parsing processes. Defaults to `LOADER_PARSE_WORKERS` or the CPU count.
+            file_timeout: Seconds allowed per file for the download, and again for parsing. Defaults to `LOADER_FILE_TIMEOUT` or 120.
+            max_in_flight: Files downloaded or parsed at once. Defaults to download_workers.
+            parse: A module-level function with the signature of parse_file. Defaults to parse_file.
+        """
+        self.download_workers = download_workers
+        self.parse_workers = parse_workers
+        self.file_timeout = file_timeout
+        self.max_in_flight = max_in_flight or download_workers
+        self.parse = parse
+        self.failures: Dict[str, str] = {}
+
+    def _load_one(self, blob, parse_workers: "queue.Queue[ParseWorker]", tmp_dir: str) -> List[Any]:
+        file_path = os.path.join(tmp_dir, hashlib.sha1(blob.name.encode("utf-8")).hexdigest())
+        try:
+            blob.download_to_filename(file_path, timeout=self.file_timeout)
+            source = f"gs://{blob.bucket.name}/{blob.name}"
+            # Every parse ahead of this file ends within file_timeout, so this wait is bounded too.
+            wait = self.file_timeout * math.ceil(self.max_in_flight / self.parse_workers)
+            try:
+                worker = parse_workers.get(timeout=wait)
+            except queue.Empty:
+                raise TimeoutError("timed out waiting for a parse process")
+            try:
+                return worker.run(file_path, blob.name, source, self.file_timeout)
+            finally:
+                parse_workers.put(worker)
+        finally:
+            # A timed out parse has been killed, so nothing reads the file any more.
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def load(self, blobs: Iterable[Any]) -> Iterator[Tuple[str, List[Any]]]:
+        """
+        Loads blobs and yields each one's documents as soon as it is parsed.
+
+        Args:
+            blobs: Blobs with name, bucket.name and download_to_filename.
+
+        Yields:
+            The blob name and its documents, in completion order. Failed files are skipped.
+        """
+        self.failures = {}
+        blobs = iter(blobs)
+        context = multiprocessing.get_context("spawn")
+        parse_workers: "queue.Queue[ParseWorker]" = queue.Queue()
+        for _ in range(self.parse_workers):
+            parse_workers.put(ParseWorker(self.parse, context))
+        try:
+            yield from self._load(blobs, parse_workers)
+        finally:
+            # _load has joined the download threads, so every worker is back in the queue.
+            while not parse_workers.empty():
+                parse_workers.get().close()
+
+    def _load(self, blobs: Iterator[Any], parse_workers: "queue.Queue[ParseWorker]") -> Iterator[Tuple[str, List[Any]]]:
+        with tempfile.TemporaryDirectory(prefix="loader") as tmp_dir, \
+                futures.ThreadPoolExecutor(max_workers=self.download_workers, thread_name_prefix="download") as download_pool:
+            pending = {}
+
+            def submit_next() -> bool:
+                blob = next(blobs, None)
+                if blob is None:
+                    return False
+                pending[download_pool.submit(self._load_one, blob, parse_workers, tmp_dir)] = blob.name
+                return True
+
+            while len(pending) < self.max_in_flight and submit_next():
+                pass
+            while pending:
+                done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    blob_name = pending.pop(future)
+                    try:
+                        docs = future.result()
+                    except Exception as e:
+                        error = (str(e) or "timed out") if isinstance(e, TimeoutError) else str(e)
+                        logging.error(f"Failed to load {blob_name}: {error}")
+                        self.failures[blob_name] = error
+                    else:
+                        yield blob_name, docs
+                    submit_next()
+
+    def load_all(self, blobs: Iterable[Any]) -> List[Any]:
+        """
+        Loads blobs and returns their documents in blob order.
+        """
+        blobs = list(blobs)
+        docs_by_blob = dict(self.load(blobs))
+        return [doc for blob in blobs for doc in docs_by_blob.get(blob.name, [])]
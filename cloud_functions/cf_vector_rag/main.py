@@ -1,14 +1,15 @@
 
 import os
 import functions_framework
-import vertexai
-from flask import Flask, request, jsonify
-from langchain_google_vertexai import VertexAI
-from routes import preproc_run_route_controller, vs_similarity_search_controller, update_document_controller
+from flask import Flask, Response, request, jsonify
+from routes import preproc_run_route_controller, vs_qa_chain_controller, update_document_controller
+from timing import metrics, install_timing
+from profiling import profile_request
 
 PROJECT_ID = os.environ.get("PROJECT_ID")
 LOCATION = os.environ.get("LOCATION")
 app = Flask(__name__)
+install_timing(app)
 
 @app.route('/vectorStore/chains/qa', methods=['GET', 'POST'])
 def vs_similarity_search():
@@ -25,6 +26,10 @@ def update_document(id):
     else:
         return "Failed to update the document"
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 def my_function(request):
     """
     Handles incoming requests and dispatches them to the internal Flask app.
@@ -36,10 +41,11 @@ def my_function(request):
         The response from the internal Flask app.
     """
     
+    import vertexai
     vertexai.init(project=PROJECT_ID, location=LOCATION)
     with app.test_request_context(
         path=request.path, method=request.method, 
         headers={k: v for k, v in request.headers.items()}, 
         data=request.data
     ):
-        return app.full_dispatch_request()
+        return profile_request(request.headers, app.full_dispatch_request)
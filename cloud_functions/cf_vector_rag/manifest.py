@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+class ManifestStore:
+    """
+    Reads and writes the ingestion manifest as JSON.
+    """
+
+    def read(self) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def write(self, manifest: Dict[str, Any]):
+        raise NotImplementedError
+
+class FileManifestStore(ManifestStore):
+    """
+    Keeps the manifest in a local file, replaced atomically on write.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def read(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            return json.load(f)
+
+    def write(self, manifest: Dict[str, Any]):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.path)
+
+class GcsManifestStore(ManifestStore):
+    """
+    Keeps the manifest in a Cloud Storage object.
+    """
+
+    def __init__(self, bucket_name: str, blob_name: str, client=None):
+        self.bucket_name = bucket_name
+        self.blob_name = blob_name
+        self.client = client
+
+    def _blob(self):
+        if self.client is None:
+            from google.cloud import storage
+            self.client = storage.Client()
+        return self.client.bucket(self.bucket_name).blob(self.blob_name)
+
+    def read(self) -> Optional[Dict[str, Any]]:
+        blob = self._blob()
+        if not blob.exists():
+            return None
+        return json.loads(blob.download_as_text())
+
+    def write(self, manifest: Dict[str, Any]):
+        self._blob().upload_from_string(json.dumps(manifest), content_type="application/json")
+
+def build_manifest_store(bucket_name: str) -> ManifestStore:
+    """
+    Builds the manifest store configured by `MANIFEST_PATH`.
+
+    A gs://bucket/object path or a local file path can be given. Defaults to
+    `_ingestion/manifest.json` in the source bucket.
+
+    Args:
+        bucket_name (str): The bucket holding the source documents.
+
+    Returns:
+        ManifestStore: The manifest store.
+    """
+    return build_store(os.environ.get("MANIFEST_PATH") or f"gs://{bucket_name}/_ingestion/manifest.json")
+
+def build_version_store(bucket_name: str) -> ManifestStore:
+    """
+    Builds the store of the corpus version configured by `CORPUS_VERSION_PATH`.
+
+    The version is a small object next to the manifest that changes on every
+    ingestion run that changes the corpus, so instances can poll it cheaply.
+    Defaults to `_ingestion/version.json` in the source bucket.
+
+    Args:
+        bucket_name (str): The bucket holding the source documents.
+
+    Returns:
+        ManifestStore: The version store.
+    """
+    return build_store(os.environ.get("CORPUS_VERSION_PATH") or f"gs://{bucket_name}/_ingestion/version.json")
+
+def build_store(path: str) -> ManifestStore:
+    if path.startswith("gs://"):
+        bucket, _, blob_name = path[len("gs://"):].partition("/")
+        return GcsManifestStore(bucket, blob_name)
+    return FileManifestStore(path)
+
+def read_corpus_version(store: ManifestStore) -> Optional[str]:
+    return (store.read() or {}).get("version")
+
+def write_corpus_version(store: ManifestStore) -> str:
+    """
+    Records a new corpus version and returns it.
+    """
+    version = uuid.uuid4().hex
+    store.write({"version": version, "updated_at": time.time()})
+    return version
+
+def get_fingerprint(blob) -> str:
+    """
+    Identifies a version of a blob by its generation and MD5 hash.
+    """
+    return f"{blob.generation}:{blob.md5_hash}"
+
+class ManifestDiff:
+    """
+    The blobs to ingest and the vector store rows to delete in one run.
+    """
+
+    def __init__(self, changed: List[Any], deleted: List[str], unchanged: List[str], full_refresh: bool):
+        self.changed = changed
+        self.deleted = deleted
+        self.unchanged = unchanged
+        self.full_refresh = full_refresh
+
+class IngestionManifest:
+    """
+    Tracks which version of each blob is in the vector store and its row ids.
+
+    Entries are keyed by blob name and hold the blob fingerprint and the ids
+    returned by `add_documents`. The split config is stored too: a change of
+    chunk size or overlap invalidates every entry.
+    """
+
+    def __init__(self, store: ManifestStore):
+        self.store = store
+        state = store.read() or {}
+        self.config: Optional[Dict[str, Any]] = state.get("config")
+        self.entries: Dict[str, Dict[str, Any]] = state.get("entries", {})
+
+    def diff(self, blobs: Iterable[Any], config: Dict[str, Any]) -> ManifestDiff:
+        """
+        Compares the current blobs with the manifest.
+
+        Args:
+            blobs (Iterable[Any]): The source blobs, with name, generation and md5_hash.
+            config (Dict[str, Any]): The split config of this run.
+
+        Returns:
+            ManifestDiff: New or changed blobs, deleted blob names, unchanged blob names,
+                and whether the whole store must be rebuilt.
+        """
+        blobs = list(blobs)
+        if self.config != config:
+            return ManifestDiff(blobs, list(self.entries), [], full_refresh=True)
+        changed, unchanged = [], []
+        for blob in blobs:
+            entry = self.entries.get(blob.name)
+            if entry and entry["fingerprint"] == get_fingerprint(blob):
+                unchanged.append(blob.name)
+            else:
+                changed.append(blob)
+        names = {blob.name for blob in blobs}
+        deleted = [name for name in self.entries if name not in names]
+        return ManifestDiff(changed, deleted, unchanged, full_refresh=False)
+
+    def get_stale_ids(self, diff: ManifestDiff) -> List[str]:
+        """
+        Returns the row ids of changed and deleted blobs.
+        """
+        names = [blob.name for blob in diff.changed] + diff.deleted
+        return [row_id for name in names for row_id in self.entries.get(name, {}).get("ids", [])]
+
+    def apply(self, diff: ManifestDiff, config: Dict[str, Any], ids_by_blob: Dict[str, List[str]]):
+        """
+        Records the outcome of a run.
+
+        Args:
+            diff (ManifestDiff): The diff the run ingested.
+            config (Dict[str, Any]): The split config of the run.
+            ids_by_blob (Dict[str, List[str]]): The new row ids per ingested blob name.
+        """
+        if diff.full_refresh:
+            self.entries = {}
+        for name in diff.deleted:
+            self.entries.pop(name, None)
+        for blob in diff.changed:
+            self.entries[blob.name] = {
+                "fingerprint": get_fingerprint(blob),
+                "ids": ids_by_blob.get(blob.name, []),
+            }
+        self.config = config
+
+    def save(self):
+        self.store.write({"config": self.config, "entries": self.entries})
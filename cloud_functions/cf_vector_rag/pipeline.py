@@ -0,0 +1,142 @@
+import os
+import time
+import queue
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 500))
+INGEST_MAX_PENDING_BATCHES = int(os.environ.get("INGEST_MAX_PENDING_BATCHES", 2))
+
+class IngestError(Exception):
+    """
+    Raised when writing a batch fails, with the ids of the rows already written.
+    """
+
+    def __init__(self, error: BaseException, ids_by_blob: Dict[str, List[str]]):
+        super().__init__(str(error))
+        self.error = error
+        self.ids_by_blob = ids_by_blob
+
+def batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def split_stream(
+    documents: Iterable[List[Any]],
+    text_splitter,
+) -> Iterator[Any]:
+    """
+    Splits documents one source file at a time.
+
+    Args:
+        documents: The documents of each source file, e.g. from ParallelLoader.load.
+        text_splitter: A LangChain text splitter.
+
+    Yields:
+        Chunks numbered in order with a `chunk` metadata field.
+    """
+    index = 0
+    for docs in documents:
+        for split in text_splitter.split_documents(docs):
+            split.metadata["chunk"] = index
+            index += 1
+            yield split
+
+class IngestStats:
+    """
+    Counters for one ingestion run.
+    """
+
+    def __init__(self):
+        self.chunks = 0
+        self.batches = 0
+        self.write_seconds = 0.0
+        self.start = time.monotonic()
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.start
+        return {
+            "chunks": self.chunks,
+            "batches": self.batches,
+            "elapsed_s": round(elapsed, 3),
+            "write_s": round(self.write_seconds, 3),
+            "chunks_per_s": round(self.chunks / elapsed, 2) if elapsed else None,
+        }
+
+def write_in_batches(
+    chunks: Iterable[Any],
+    write_batch: Callable[[List[Any]], List[str]],
+    batch_size: int = INGEST_BATCH_SIZE,
+    max_pending: int = INGEST_MAX_PENDING_BATCHES,
+    stats: IngestStats = None,
+) -> Dict[str, List[str]]:
+    """
+    Writes a stream of chunks in micro-batches on a background thread.
+
+    Loading and splitting run on the calling thread while the previous batch
+    is embedded and written. The queue between them holds at most
+    `max_pending` batches, so a slow writer stops the producer instead of
+    letting chunks pile up, and peak memory does not grow with the corpus.
+
+    Args:
+        chunks: The chunks to write, with a `blob_name` metadata field.
+        write_batch: Embeds and writes one batch, returning the new row ids, e.g. vector_store.add_documents.
+        batch_size: Chunks per batch. Defaults to `INGEST_BATCH_SIZE` or 500.
+        max_pending: Batches queued for the writer. Defaults to `INGEST_MAX_PENDING_BATCHES` or 2.
+        stats: Counters to update. Defaults to None.
+
+    Returns:
+        The new row ids per blob name.
+
+    Raises:
+        IngestError: If loading, splitting or write_batch fails, once the writer has stopped.
+    """
+    stats = stats or IngestStats()
+    pending: "queue.Queue" = queue.Queue(maxsize=max_pending)
+    ids_by_blob: Dict[str, List[str]] = {}
+    errors: List[BaseException] = []
+
+    def writer():
+        while True:
+            batch = pending.get()
+            if batch is None:
+                return
+            if errors:
+                # Keep draining so the producer never blocks on a dead writer.
+                continue
+            start = time.monotonic()
+            try:
+                ids = write_batch(batch)
+            except BaseException as e:
+                logging.error(f"Failed to write a batch of {len(batch)} chunks: {e}")
+                errors.append(e)
+                continue
+            stats.write_seconds += time.monotonic() - start
+            stats.batches += 1
+            stats.chunks += len(batch)
+            for chunk, row_id in zip(batch, ids):
+                ids_by_blob.setdefault(chunk.metadata.get("blob_name"), []).append(row_id)
+
+    thread = threading.Thread(target=writer, name="ingest-writer", daemon=True)
+    thread.start()
+    try:
+        for batch in batched(chunks, batch_size):
+            if errors:
+                break
+            pending.put(batch)
+    except Exception as e:
+        logging.error(f"Failed to produce chunks: {e}")
+        errors.append(e)
+    finally:
+        pending.put(None)
+        thread.join()
+    if errors:
+        raise IngestError(errors[0], ids_by_blob)
+    return ids_by_blob
@@ -0,0 +1,33 @@
+from typing import Any, Dict, List, Optional
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from timing import span
+
+class SnapshotRetriever(BaseRetriever):
+    """
+    Retrieves chunks from an in-process VectorIndex instead of BigQuery.
+
+    The query is embedded with the same model as the chunks, and the
+    similarity is returned in the `score` metadata field.
+    """
+
+    index: Any
+    embedding: Any
+    k: int = 4
+    filter: Optional[Dict[str, Any]] = None
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with span("embed_query"):
+            query_vector = self.embedding.embed_query(query)
+        with span("retrieve"):
+            results = self.index.search(query_vector, k=self.k, filter=self.filter)
+        return [
+            Document(
+                page_content=document["content"],
+                metadata={**document["metadata"], "doc_id": document["id"], "score": score},
+            )
+            for document, score in results
+        ]
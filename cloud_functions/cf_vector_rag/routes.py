@@ -1,11 +1,16 @@
 import os
+import json
+import time
 import logging
 from typing import List, Dict, Any
-from google.cloud import storage, bigquery
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_vertexai import VertexAIEmbeddings
-from langchain_google_community import BigQueryVectorStore
-from langchain_community.document_loaders import PyPDFLoader, BSHTMLLoader, UnstructuredHTMLLoader
+from timing import span
+from manifest import IngestionManifest, build_manifest_store, build_version_store, write_corpus_version
+from loaders import ParallelLoader
+from pipeline import IngestError, IngestStats, split_stream, write_in_batches
+from embeddings import AdaptiveEmbedder
+from embedding_cache import EMBED_CACHE_ENABLED, CachedEmbeddings, embedding_cache
+# Heavy dependencies (langchain, Vertex AI, unstructured, GCS, BigQuery) are
+# imported inside the functions that need them to keep cold starts short.
 
 PROJECT_ID = os.environ.get("PROJECT_ID")
 LOCATION = os.environ.get("LOCATION")
@@ -14,11 +19,22 @@ DATASET = os.environ.get("DATASET")
 TABLE_ID = os.environ.get("TABLE_ID")
 DEFAULT_CHUNK_SIZE = 200
 DEFAULT_CHUNK_OVERLAP = 20
+PARALLEL_LOADING = os.environ.get("LOADER_PARALLEL", "true").lower() == "true"
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "bigquery")
+VECTOR_INDEX_PATH = os.environ.get("VECTOR_INDEX_PATH")
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", 4))
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# Cached embeddings are keyed by model name, so it must be a fixed version: a
+# moving alias like "@latest" would mix vectors of two models after an upgrade.
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "textembedding-gecko@003")
+USE_EMBED_CACHE = EMBED_CACHE_ENABLED and not EMBEDDING_MODEL.endswith("@latest")
 
 def load_pdf_documents(file_path: str):
+    from langchain_community.document_loaders import PyPDFLoader
     return PyPDFLoader(file_path)
 
 def load_html_documents(file_path: str):
+    from langchain_community.document_loaders import UnstructuredHTMLLoader
     return UnstructuredHTMLLoader(file_path)
 
 def add_document_name(loader: List):
@@ -26,76 +42,277 @@ def add_document_name(loader: List):
         doc.metadata["document_name"] = doc.metadata["source"].split("/")[-1]
     return loader
 
-def load_files_from_gcs(bucket_name, folder_name: str=None):
+def list_source_blobs(bucket_name, folder_name: str=None):
+    from google.cloud import storage
+
     gcs_client = storage.Client()
+    return [
+        blob for blob in gcs_client.list_blobs(bucket_name, prefix=folder_name)
+        if blob.name.endswith((".pdf", ".html"))
+    ]
+
+def load_blob(blob):
+    from langchain_google_community import GCSFileLoader
+
+    if blob.name.endswith(".pdf"):
+        loader = GCSFileLoader(
+            project_name=PROJECT_ID,
+            bucket=blob.bucket.name,
+            blob=blob.name,
+            loader_func=load_pdf_documents
+            ).load()
+    else:
+        loader = GCSFileLoader(
+            project_name=PROJECT_ID,
+            bucket=blob.bucket.name,
+            blob=blob.name,
+            loader_func=load_html_documents
+            ).load()
+        # html_metas = extract_meta_information(blob)
+        # for doc in loader:
+        #     doc.metadata.update(html_metas)
+    loader = add_document_name(loader)
+    for doc in loader:
+        doc.metadata["blob_name"] = blob.name
+    return loader
+
+def load_files_from_gcs(bucket_name, folder_name: str=None, blobs: List=None, loader: ParallelLoader=None):
+    if blobs is None:
+        blobs = list_source_blobs(bucket_name, folder_name)
+    if PARALLEL_LOADING:
+        return (loader or ParallelLoader()).load_all(blobs)
     all_documents = []
-    for blob in gcs_client.list_blobs(bucket_name, prefix=folder_name):
-        if blob.name.endswith(".pdf"):
-            loader = GCSFileLoader(
-                project_name=PROJECT_ID,
-                bucket=blob.bucket.name,
-                blob=blob.name,
-                loader_func=load_pdf_documents
-                ).load()
-        elif blob.name.endswith(".html"):
-            loader = GCSFileLoader(
-                project_name=PROJECT_ID,
-                bucket=blob.bucket.name,
-                blob=blob.name,
-                loader_func=load_html_documents
-                ).load()
-            # html_metas = extract_meta_information(blob)
-            # for doc in loader:
-            #     doc.metadata.update(html_metas)
-        else:
-            continue
-        loader = add_document_name(loader)
-        all_documents.extend(loader)
+    for blob in blobs:
+        all_documents.extend(load_blob(blob))
     return all_documents
 
-def add_docs_in_bqQueryVectorstore(docs):
-    EMBEDDING_MODEL = VertexAIEmbeddings(
-         model_name="textembedding-gecko@latest", project=PROJECT_ID
+def get_embedding_model(**kwargs):
+    from langchain_google_vertexai import VertexAIEmbeddings
+
+    return VertexAIEmbeddings(
+         model_name=EMBEDDING_MODEL, project=PROJECT_ID, **kwargs
     )
+
+def get_cached_embedding_model():
+    """Returns the embedding model behind the embedding cache, unless it is disabled."""
+    model = get_embedding_model()
+    if not USE_EMBED_CACHE:
+        return model
+    return CachedEmbeddings(model, embedding_cache)
+
+def get_vector_store(embedding=None):
+    from langchain_google_community import BigQueryVectorStore
+
     vector_store = BigQueryVectorStore(
         project_id=PROJECT_ID,
         location=LOCATION,
         dataset_name=DATASET,
         table_name=TABLE_ID,
-        embedding=EMBEDDING_MODEL,
+        embedding=embedding or get_cached_embedding_model(),
     )
-    #add documents to the store
-    client = bigquery.Client()
-    table_ref = f"{PROJECT_ID}.{DATASET}.{TABLE_ID}"
-    if check_bigquery_table_has_data(client):
-        delete_bigquery_table_data(client)
-    doc_ids = vector_store.add_documents(docs)
     return vector_store
 
-def process_docs(data: Dict[str, Any]):
+def iter_blob_documents(blobs: List, loader: ParallelLoader=None):
+    """Yields the documents of each blob as soon as it is loaded."""
+    if PARALLEL_LOADING:
+        for _, docs in (loader or ParallelLoader()).load(blobs):
+            yield docs
+    else:
+        for blob in blobs:
+            yield load_blob(blob)
+
+def add_docs_in_bqQueryVectorstore(docs, clear_table: bool=True, stats: IngestStats=None, embedder: AdaptiveEmbedder=None):
+    """Adds a stream of chunks to the vector store in micro-batches.
+
+    Each micro-batch is embedded by the adaptive embedder, which sends
+    several token-bounded requests at once and backs off on quota errors,
+    and is then inserted with its embeddings. Chunks already in the
+    embedding cache, such as repeated headers and disclaimers, are not
+    sent to the model again.
+
+    Args:
+        docs: The chunks to add, as any iterable.
+        clear_table: Whether to delete every row first.
+        stats: Counters to update.
+        embedder: The embedder. Defaults to one for the Vertex AI embedding model.
+
+    Returns:
+        The vector store and the ids of the added rows per blob name.
+    """
+    from google.cloud import bigquery
+
+    # Retries are left to the adaptive embedder.
+    embedding_model = get_embedding_model(max_retries=0)
+    embedder = embedder or AdaptiveEmbedder.for_vertex(embedding_model)
+    embed_texts = embedder.embed
+    if USE_EMBED_CACHE:
+        embedding_model = CachedEmbeddings(embedding_model, embedding_cache, embed_texts=embedder.embed)
+        embed_texts = embedding_model.embed_documents
+    vector_store = get_vector_store(embedding_model)
+    if clear_table:
+        client = bigquery.Client()
+        if check_bigquery_table_has_data(client):
+            delete_bigquery_table_data(client)
+
+    def write_batch(batch):
+        texts = [chunk.page_content for chunk in batch]
+        embeddings = embed_texts(texts)
+        return vector_store.add_texts_with_embeddings(
+            texts, embeddings, metadatas=[chunk.metadata for chunk in batch]
+        )
+
+    #add documents to the store
+    ids_by_blob = write_in_batches(docs, write_batch, stats=stats)
+    logging.info(f"Embedding stats: {embedder.stats()}, cache: {embedding_cache.stats()}")
+    return vector_store, ids_by_blob
+
+def get_split_config(data: Dict[str, Any]) -> Dict[str, Any]:
     chunk_size = data.get("chunk_size", None)
     chunk_overlap = data.get("chunk_overlap", None)
     if not any([chunk_size, chunk_overlap]):
         chunk_size = DEFAULT_CHUNK_SIZE
         chunk_overlap = DEFAULT_CHUNK_OVERLAP
+    return {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+
+def process_docs(data: Dict[str, Any], blobs: List=None, loader: ParallelLoader=None):
+    """Streams the chunks of the given blobs, one source file at a time.
+
+    Only the files being loaded and the chunks of the current batch are held
+    in memory, however large the bucket is.
+    """
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
+        **get_split_config(data),
         separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""],
     )
-    documents = load_files_from_gcs(bucket_name=BUCEKT_NAME)
-    doc_splits = text_splitter.split_documents(documents)
-    #Add chunk number to metada
-    for idx, split in enumerate(doc_splits):
-        split.metadata["chunk"] = idx
-    return doc_splits
+    if blobs is None:
+        blobs = list_source_blobs(BUCEKT_NAME)
+    return split_stream(iter_blob_documents(blobs, loader), text_splitter)
 
 def preproc_run_route_controller(data: Dict[str, Any]):
+    """Ingests new and changed documents into the vector store.
+
+    The ingestion manifest records the generation and MD5 hash of every
+    ingested blob and the ids of its rows. Only new or changed blobs are
+    loaded, split and embedded; rows of changed and deleted blobs are
+    deleted, and unchanged blobs are left alone. A new split config, an
+    empty manifest or `full_refresh` in the request rebuilds the table.
+
+    Args:
+        data: The request with optional chunk_size, chunk_overlap and full_refresh.
+
+    Returns:
+        The vector store.
+    """
     logging.info("Initiating document preprocessing.")
-    docs = process_docs(data)
-    vector_store = add_docs_in_bqQueryVectorstore(docs)
+    manifest = IngestionManifest(build_manifest_store(BUCEKT_NAME))
+    config = get_split_config(data)
+    if data.get("full_refresh"):
+        manifest.config = None
+    diff = manifest.diff(list_source_blobs(BUCEKT_NAME), config)
+    logging.info(
+        f"Ingesting {len(diff.changed)} new or changed documents, removing {len(diff.deleted)}, "
+        f"skipping {len(diff.unchanged)} unchanged (full refresh: {diff.full_refresh})."
+    )
+    loader = ParallelLoader()
+    docs = process_docs(data, blobs=diff.changed, loader=loader)
+    stats = IngestStats()
+    with span("write"):
+        try:
+            vector_store, ids_by_blob = add_docs_in_bqQueryVectorstore(
+                docs, clear_table=diff.full_refresh, stats=stats
+            )
+        except IngestError as e:
+            # Roll back this run's rows so the manifest stays accurate.
+            written_ids = [row_id for ids in e.ids_by_blob.values() for row_id in ids]
+            if written_ids:
+                get_vector_store().delete(written_ids)
+            if diff.full_refresh:
+                # The table was cleared, so the next run must rebuild it.
+                manifest.entries, manifest.config = {}, None
+                manifest.save()
+            raise e.error
+    if loader.failures:
+        # Failed documents keep their old rows and are retried on the next run.
+        diff.changed = [blob for blob in diff.changed if blob.name not in loader.failures]
+    if not diff.full_refresh:
+        # Old rows are removed only once their replacements are written.
+        stale_ids = manifest.get_stale_ids(diff)
+        if stale_ids:
+            vector_store.delete(stale_ids)
+    logging.info(f"Ingestion finished: {stats.to_dict()}")
+    manifest.apply(diff, config, ids_by_blob)
+    manifest.save()
+    if VECTOR_INDEX_PATH:
+        with span("export"):
+            export_vector_index()
+    if diff.changed or diff.deleted or diff.full_refresh:
+        # Cached answers may cite removed or outdated chunks.
+        version = write_corpus_version(build_version_store(BUCEKT_NAME))
+        from answer_cache import answer_cache
+        answer_cache.invalidate(version)
     return vector_store
 
+def export_vector_index():
+    """Exports the chunk table to the vector index snapshot at `VECTOR_INDEX_PATH`.
+
+    Failures are logged: instances keep serving the previous snapshot.
+    """
+    import tempfile
+    from google.cloud import bigquery
+    from vector_index import publish_snapshot, write_snapshot
+
+    client = bigquery.Client()
+    table_ref = f"{PROJECT_ID}.{DATASET}.{TABLE_ID}"
+    try:
+        rows = client.query(f"SELECT * FROM `{table_ref}`").result()
+        snapshot_rows = (
+            {
+                "id": row["doc_id"],
+                "content": row["content"],
+                "embedding": row["embedding"],
+                "metadata": {
+                    key: value for key, value in row.items()
+                    if key not in ("doc_id", "content", "embedding") and value is not None
+                },
+            }
+            for row in rows
+        )
+        with tempfile.TemporaryDirectory(prefix="vector_index") as tmp_dir:
+            info = write_snapshot(tmp_dir, snapshot_rows, rows.total_rows)
+            publish_snapshot(tmp_dir, VECTOR_INDEX_PATH)
+        logging.info(f"Exported vector index snapshot: {info}")
+    except Exception as e:
+        logging.error(f"Failed to export the vector index snapshot: {e}")
+
+def get_retriever(data: Dict[str, Any]):
+    """Returns the retriever for `RETRIEVAL_MODE`.
+
+    "snapshot" searches the in-process vector index and falls back to
+    BigQuery if no snapshot can be loaded; "bigquery" queries the table.
+
+    Args:
+        data: The request with an optional metadata filter.
+    """
+    if RETRIEVAL_MODE == "snapshot":
+        from vector_index import get_vector_index
+        from retrievers import SnapshotRetriever
+
+        try:
+            return SnapshotRetriever(
+                index=get_vector_index(VECTOR_INDEX_PATH),
+                embedding=get_cached_embedding_model(),
+                k=RETRIEVAL_TOP_K,
+                filter=data.get("filter"),
+            )
+        except Exception as e:
+            logging.error(f"Failed to load the vector index snapshot, querying BigQuery: {e}")
+    search_kwargs = {"k": RETRIEVAL_TOP_K}
+    if data.get("filter"):
+        search_kwargs["filter"] = data["filter"]
+    return get_vector_store().as_retriever(search_kwargs=search_kwargs)
+
 def vs_qa_chain_controller(data: Dict[str, Any]):
     if not check_bigquery_table_has_data:
         logging.info(
@@ -109,38 +326,55 @@ def vs_qa_chain_controller(data: Dict[str, Any]):
             data["chunk_overlap"] = DEFAULT_CHUNK_OVERLAP
         preproc_run_route_controller(data)
 
-    EMBEDDING_MODEL = VertexAIEmbeddings(
-         model_name="textembedding-gecko@latest", project=PROJECT_ID
-    )
-    vector_store = BigQueryVectorStore(
-        project_id=PROJECT_ID,
-        location=LOCATION,
-        dataset_name=DATASET,
-        table_name=TABLE_ID,
-        embedding=EMBEDDING_MODEL,
-    )
-    llm = VertexAI(model_name="gemini-pro")
     query = data.get("text", None)
     if not query:
-        logging.Error("Request need a text to query Vector Store")
+        logging.error("Request need a text to query Vector Store")
         return {
             "error": "Request doesn't have a text to query"
         }
-    langchain_retriever = vector_store.as_retriever()
-    llm = VertexAI(model_name="gemini-pro")
+    answer_cache = None
+    if ANSWER_CACHE_ENABLED:
+        from answer_cache import answer_cache
+
+        # Answers depend on the metadata filter as well as the question.
+        cache_context = json.dumps(data.get("filter") or {}, sort_keys=True)
+        with span("answer_cache"):
+            query_vector = get_cached_embedding_model().embed_query(query)
+            cached = answer_cache.lookup(query_vector, cache_context)
+        if cached:
+            logging.info(f"Answered from the semantic cache (matched: {cached.query!r}).")
+            return cached.answer
+        cache_version = answer_cache.version
+    # Only a cache miss needs the chain, so a hit never imports langchain.
+    with span("imports"):
+        from langchain.chains import RetrievalQA
+        from langchain_google_vertexai import VertexAI
+
+    with span("setup"):
+        langchain_retriever = get_retriever(data)
+        llm = VertexAI(model_name="gemini-pro")
     retrieval_qa = RetrievalQA.from_chain_type(
         llm=llm, chain_type="stuff", retriever=langchain_retriever
     )
     try:
-        response = retrieval_qa.invoke(query)
-    except Error as e:
-        logging.Error("Error occurred while querying Vector Store: {e}")
+        with span("chain"):
+            start = time.monotonic()
+            response = retrieval_qa.invoke(query)
+    except Exception as e:
+        logging.error(f"Error occurred while querying Vector Store: {e}")
         return {
-            "error": "Error occurred while querying Vector Store: {e}"
+            "error": f"Error occurred while querying Vector Store: {e}"
         }
+    if answer_cache:
+        answer_cache.store(
+            query, query_vector, response["result"], time.monotonic() - start,
+            context=cache_context, version=cache_version,
+        )
     return response["result"]
 
 def update_document_controller(doc_id: str, data: Dict[str, Any]):
+    from google.cloud import bigquery
+
     client = bigquery.Client()
     table_ref = f"{PROJECT_ID}.{DATASET}.{TABLE_ID}"
     try:
@@ -148,21 +382,21 @@ def update_document_controller(doc_id: str, data: Dict[str, Any]):
         query_job = client.query(query)
         results = list(query_job.results())
         if not results:
-            logging.Error(f"Unable to find any documents with a provided doc_id: {doc_id}")
+            logging.error(f"Unable to find any documents with a provided doc_id: {doc_id}")
             return False
         existing_columns = [field.name for field in table.schema]
         update_query = f"UPDATE `{table_ref}` SET "
         updates = []
         for column, value in data.items():
             if column not in existing_columns:
-                logging.Error(f"Column: {column}, does not exist in the table.")
+                logging.error(f"Column: {column}, does not exist in the table.")
                 continue
             if isinstance(value, str):
                 updates.append(f"{column} = '{value}'")
             else:
                 updates.append(f"{column} = {value}")
         if not updates:
-            logging.Error(f"No valid columns to update.")
+            logging.error(f"No valid columns to update.")
             return False
 
         update_query += ", ".join(updates)
@@ -172,7 +406,7 @@ def update_document_controller(doc_id: str, data: Dict[str, Any]):
         logging.info(f"Row with doc_id {doc_id} updated successfully.")
         return True
     except Exception as e:
-        logging.Error(f"Error updating row of doc_id: {doc_id}. Error message: {e}")
+        logging.error(f"Error updating row of doc_id: {doc_id}. Error message: {e}")
         return False
 
 def delete_bigquery_table_data(client):
@@ -191,7 +425,7 @@ def delete_bigquery_table_data(client):
         query_job.result()  # Wait for the query to complete
         logging.info(f"All data deleted from table {table_ref}")
     except Exception as e:
-        logging.Error(f"Error deleting data from table: {e}")
+        logging.error(f"Error deleting data from table: {e}")
 
 def check_bigquery_table_has_data(client):
     """Checks if a BigQuery table has any data.
@@ -213,5 +447,5 @@ def check_bigquery_table_has_data(client):
         row_count = list(query_job)[0][0]
         return row_count > 0  # Table has data if row_count is greater than 0
     except Exception as e:
-        logging.Error(f"Error checking table: {e}")
+        logging.error(f"Error checking table: {e}")
         return False  # Assume no data in case of error
@@ -0,0 +1,201 @@
+import os
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+TIMING_ENABLED = os.environ.get("timing_enabled", "true").lower() == "true"
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_stages: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "timing_stages", default=None
+)
+
+class Histogram:
+    """
+    A cumulative-bucket latency histogram in the Prometheus layout.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+class Metrics:
+    """
+    Per-route, per-stage latency histograms plus gauges read at scrape time.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._gauges: Dict[str, Tuple[str, str, Callable[[], Dict[Tuple[Tuple[str, str], ...], float]]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route: str, stages: Dict[str, float]):
+        with self._lock:
+            for stage, seconds in stages.items():
+                histogram = self._histograms.get((route, stage))
+                if histogram is None:
+                    histogram = self._histograms[(route, stage)] = Histogram()
+                histogram.observe(seconds)
+
+    def register_gauge(
+        self,
+        name: str,
+        help_text: str,
+        collect: Callable[[], Dict[Tuple[Tuple[str, str], ...], float]],
+        metric_type: str = "gauge",
+    ):
+        """
+        Registers a gauge whose samples are collected when /metrics is scraped.
+
+        Args:
+            name (str): The metric name, without the prefix.
+            help_text (str): The HELP line.
+            collect (Callable): Returns a mapping of label pairs to values.
+            metric_type (str, optional): "gauge" or "counter". Defaults to "gauge".
+        """
+        self._gauges[name] = (help_text, metric_type, collect)
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics page.
+        """
+        name = f"{self.prefix}_stage_duration_seconds"
+        lines = [
+            f"# HELP {name} Time spent in each stage of a webhook request.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            snapshot = [
+                (route, stage, list(h.counts), h.sum, h.count)
+                for (route, stage), h in sorted(self._histograms.items())
+            ]
+        for route, stage, counts, total, count in snapshot:
+            labels = f'route="{route}",stage="{stage}"'
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{name}_sum{{{labels}}} {total}")
+            lines.append(f"{name}_count{{{labels}}} {count}")
+        for gauge, (help_text, metric_type, collect) in sorted(self._gauges.items()):
+            gauge_name = f"{self.prefix}_{gauge}"
+            lines.append(f"# HELP {gauge_name} {help_text}")
+            lines.append(f"# TYPE {gauge_name} {metric_type}")
+            for label_pairs, value in collect().items():
+                labels = ",".join(f'{key}="{val}"' for key, val in label_pairs)
+                lines.append(f"{gauge_name}{{{labels}}} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics(os.environ.get("metrics_prefix", "webhook"))
+
+@contextmanager
+def span(stage: str):
+    """
+    Times a block as a stage of the current request.
+
+    Outside a request, or with `timing_enabled` false, this only costs a
+    context variable lookup.
+
+    Args:
+        stage (str): The stage name, e.g. "rpc".
+    """
+    stages = _stages.get()
+    if stages is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[stage] = stages.get(stage, 0.0) + time.perf_counter() - start
+
+def start_request() -> Optional[contextvars.Token]:
+    if not TIMING_ENABLED:
+        return None
+    return _stages.set({"_start": time.perf_counter()})
+
+def finish_request(route: str, token: Optional[contextvars.Token]) -> Dict[str, float]:
+    """
+    Ends the current request's timing and records it.
+
+    Args:
+        route (str): The route rule, e.g. "/answer".
+        token (Optional[contextvars.Token]): The token returned by start_request.
+
+    Returns:
+        Dict[str, float]: Seconds per stage, including "total".
+    """
+    stages = _stages.get()
+    if token is None or stages is None:
+        return {}
+    _stages.reset(token)
+    stages["total"] = time.perf_counter() - stages.pop("_start")
+    metrics.observe(route, stages)
+    return stages
+
+def build_server_timing(stages: Dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in stages.items())
+
+def install_timing(app, skip: Tuple[str, ...] = ("/metrics",)):
+    """
+    Times every request to a Flask app and adds a Server-Timing header.
+
+    Args:
+        app (Flask): The app to instrument.
+        skip (Tuple[str, ...], optional): Paths that are not timed. Defaults to ("/metrics",).
+    """
+    from flask import g, request
+
+    @app.before_request
+    def _start_timing():
+        if request.path not in skip:
+            g.timing_token = start_request()
+
+    @app.after_request
+    def _finish_timing(response):
+        token = g.pop("timing_token", None)
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        stages = finish_request(route, token)
+        if stages:
+            response.headers["Server-Timing"] = build_server_timing(stages)
+        return response
+
+def measure_overhead(iterations: int = 100000) -> Dict[str, float]:
+    """
+    Measures the cost of a span inside and outside a timed request.
+
+    Returns:
+        Dict[str, float]: Microseconds per span.
+    """
+    def run() -> float:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            with span("bench"):
+                pass
+        return (time.perf_counter() - start) / iterations * 1e6
+
+    idle = run()
+    token = _stages.set({"_start": time.perf_counter()})
+    try:
+        active = run()
+    finally:
+        _stages.reset(token)
+    return {"idle_span_us": round(idle, 3), "active_span_us": round(active, 3)}
+
+if __name__ == "__main__":
+    print(measure_overhead())
@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+VECTOR_INDEX_PATH = os.environ.get("VECTOR_INDEX_PATH")
+VECTOR_INDEX_DTYPE = os.environ.get("VECTOR_INDEX_DTYPE", "float32")
+VECTOR_INDEX_CACHE_DIR = os.environ.get("VECTOR_INDEX_CACHE_DIR", "/tmp/vector_index")
+VECTOR_INDEX_CHECK_INTERVAL = float(os.environ.get("VECTOR_INDEX_CHECK_INTERVAL", 60))
+SNAPSHOT_FILES = ("vectors.npy", "scales.npy", "documents.jsonl")
+INDEX_FILE = "index.json"
+# Rows scored at once for int8 snapshots, bounding the float32 copy.
+BLOCK_SIZE = 65536
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Quantizes normalized vectors to int8 with one scale per row.
+    """
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+def write_snapshot(
+    directory: str,
+    rows: Iterable[Dict[str, Any]],
+    count: int,
+    dtype: str = VECTOR_INDEX_DTYPE,
+) -> Dict[str, Any]:
+    """
+    Writes a vector index snapshot.
+
+    Vectors are normalized so cosine similarity is a dot product, and are
+    written straight to a memory-mapped file so the export does not hold the
+    corpus twice.
+
+    Args:
+        directory: The local directory to write to.
+        rows: Rows with id, content, metadata and embedding.
+        count: The number of rows.
+        dtype: "float32", or "int8" for a quarter of the size. Defaults to `VECTOR_INDEX_DTYPE` or "float32".
+
+    Returns:
+        The snapshot info written to index.json.
+    """
+    if dtype not in ("float32", "int8"):
+        raise ValueError(f"Unsupported snapshot dtype: {dtype}")
+    os.makedirs(directory, exist_ok=True)
+    vectors, scales = None, None
+    written = 0
+    with open(os.path.join(directory, "documents.jsonl"), "w") as f:
+        for i, row in enumerate(rows):
+            vector = normalize(np.asarray(row["embedding"], dtype=np.float32)[None, :])
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(
+                    os.path.join(directory, "vectors.npy"), mode="w+", dtype=dtype, shape=(count, vector.shape[1])
+                )
+                scales = np.ones(count, dtype=np.float32)
+            if dtype == "int8":
+                vector, scale = quantize(vector)
+                scales[i] = scale[0]
+            vectors[i] = vector[0]
+            f.write(json.dumps({"id": row["id"], "content": row["content"], "metadata": row["metadata"]}, default=str) + "\n")
+            written += 1
+    if written != count:
+        raise ValueError(f"Expected {count} rows, got {written}")
+    if vectors is None:
+        vectors = np.zeros((0, 0), dtype=dtype)
+        np.save(os.path.join(directory, "vectors.npy"), vectors)
+        scales = np.ones(0, dtype=np.float32)
+    else:
+        vectors.flush()
+    np.save(os.path.join(directory, "scales.npy"), scales)
+    info = {
+        "version": uuid.uuid4().hex,
+        "dtype": dtype,
+        "count": count,
+        "dimensions": int(vectors.shape[1]),
+        "created_at": time.time(),
+    }
+    with open(os.path.join(directory, INDEX_FILE), "w") as f:
+        json.dump(info, f)
+    return info
+
+class VectorIndex:
+    """
+    An in-process, memory-mapped index for exact top-k cosine search.
+
+    The whole corpus is scored with one matrix-vector product and the top k
+    are picked with argpartition, so a query costs O(N) with no tree or
+    graph to build. A metadata filter selects the rows to score first, so
+    filtered queries only read the matching vectors.
+    """
+
+    def __init__(self, vectors: np.ndarray, scales: np.ndarray, documents: List[Dict[str, Any]], info: Dict[str, Any]):
+        self.vectors = vectors
+        self.scales = scales
+        self.documents = documents
+        self.info = info
+        self.version = info.get("version")
+        self._columns: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def load(cls, directory: str) -> "VectorIndex":
+        """
+        Memory-maps a snapshot written by write_snapshot.
+
+        Raises:
+            ValueError: If the row counts of index.json and the snapshot files differ.
+        """
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            info = json.load(f)
+        vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        scales = np.load(os.path.join(directory, "scales.npy"))
+        with open(os.path.join(directory, "documents.jsonl")) as f:
+            documents = [json.loads(line) for line in f]
+        counts = {
+            "index.json": info.get("count"),
+            "vectors.npy": len(vectors),
+            "scales.npy": len(scales),
+            "documents.jsonl": len(documents),
+        }
+        if len(set(counts.values())) != 1:
+            raise ValueError(f"Inconsistent vector index snapshot {info.get('version')} in {directory}: {counts}")
+        return cls(vectors, scales, documents, info)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def _column(self, key: str) -> np.ndarray:
+        column = self._columns.get(key)
+        if column is None:
+            column = np.empty(len(self.documents), dtype=object)
+            column[:] = [document["metadata"].get(key) for document in self.documents]
+            self._columns[key] = column
+        return column
+
+    def build_mask(self, filter: Dict[str, Any]) -> np.ndarray:
+        """
+        Matches documents whose metadata equals every filter value, or any value of a list.
+        """
+        mask = np.ones(len(self.documents), dtype=bool)
+        for key, value in filter.items():
+            column = self._column(key)
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            key_mask = np.zeros(len(self.documents), dtype=bool)
+            for allowed in values:
+                key_mask |= column == allowed
+            mask &= key_mask
+        return mask
+
+    def score(self, query: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Computes the cosine similarity of a normalized query with every row, or the given rows.
+        """
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        if vectors.dtype == np.float32:
+            return vectors @ query
+        scales = self.scales if rows is None else self.scales[rows]
+        scores = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), BLOCK_SIZE):
+            block = vectors[start:start + BLOCK_SIZE].astype(np.float32)
+            scores[start:start + BLOCK_SIZE] = (block @ query) * scales[start:start + BLOCK_SIZE]
+        return scores
+
+    def search(self, query_vector, k: int = 4, filter: Dict[str, Any] = None) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        Finds the documents most similar to a query vector.
+
+        Args:
+            query_vector: The query embedding.
+            k: The number of documents. Defaults to 4.
+            filter: Metadata values to match. Defaults to None.
+
+        Returns:
+            Up to k documents with their cosine similarity, best first.
+        """
+        if not len(self.documents):
+            return []
+        query = normalize(np.asarray(query_vector, dtype=np.float32))
+        rows = np.flatnonzero(self.build_mask(filter)) if filter else None
+        scores = self.score(query, rows)
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        indices = top if rows is None else rows[top]
+        return [(self.documents[i], float(scores[j])) for i, j in zip(indices, top)]
+
+def read_snapshot_info(path: str) -> Optional[Dict[str, Any]]:
+    """
+    Reads index.json of a snapshot at a gs:// or local path, or None if there is none.
+    """
+    if path.startswith("gs://"):
+        blob = get_gcs_blob(path, INDEX_FILE)
+        if not blob.exists():
+            return None
+        return json.loads(blob.download_as_text())
+    index_path = os.path.join(path, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path) as f:
+        return json.load(f)
+
+def get_gcs_blob(path: str, name: str):
+    from google.cloud import storage
+
+    bucket_name, _, prefix = path[len("gs://"):].partition("/")
+    return storage.Client().bucket(bucket_name).blob(f"{prefix.rstrip('/')}/{name}".lstrip("/"))
+
+def get_snapshot_file(info: Dict[str, Any], name: str) -> str:
+    # Snapshots published before versioned prefixes keep their files next to index.json.
+    return f"{info['prefix']}/{name}" if info.get("prefix") else name
+
+def publish_snapshot(directory: str, path: str):
+    """
+    Publishes a local snapshot to its gs:// or local path.
+
+    The files go under `<path>/<version>/`, and the top-level index.json is
+    written last and points at that prefix, so a reader always sees one
+    complete version. The version it replaces is kept for readers still
+    fetching it; older ones are deleted.
+    """
+    with open(os.path.join(directory, INDEX_FILE)) as f:
+        info = json.load(f)
+    version = info["version"]
+    previous = read_snapshot_info(path)
+    if path.startswith("gs://"):
+        for name in SNAPSHOT_FILES + (INDEX_FILE,):
+            get_gcs_blob(path, f"{version}/{name}").upload_from_filename(os.path.join(directory, name))
+        get_gcs_blob(path, INDEX_FILE).upload_from_string(
+            json.dumps({**info, "prefix": version}), content_type="application/json"
+        )
+    else:
+        version_dir = os.path.join(path, version)
+        os.makedirs(version_dir, exist_ok=True)
+        for name in SNAPSHOT_FILES + (INDEX_FILE,):
+            shutil.copyfile(os.path.join(directory, name), os.path.join(version_dir, name))
+        tmp_path = os.path.join(path, f"{INDEX_FILE}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({**info, "prefix": version}, f)
+        os.replace(tmp_path, os.path.join(path, INDEX_FILE))
+    keep = {version, (previous or {}).get("prefix")}
+    try:
+        remove_old_versions(path, keep)
+    except Exception as e:
+        logging.error(f"Failed to remove old vector index snapshots from {path}: {e}")
+
+def remove_old_versions(path: str, keep: set):
+    """
+    Deletes the versioned snapshot prefixes under path that are not in keep.
+    """
+    if path.startswith("gs://"):
+        from google.cloud import storage
+
+        bucket_name, _, prefix = path[len("gs://"):].partition("/")
+        prefix = f"{prefix.rstrip('/')}/".lstrip("/")
+        for blob in storage.Client().list_blobs(bucket_name, prefix=prefix):
+            version, separator, _ = blob.name[len(prefix):].partition("/")
+            if separator and version not in keep:
+                blob.delete()
+        return
+    for name in os.listdir(path):
+        if name not in keep and os.path.exists(os.path.join(path, name, INDEX_FILE)):
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+def fetch_snapshot(path: str, info: Dict[str, Any], cache_dir: str = VECTOR_INDEX_CACHE_DIR) -> str:
+    """
+    Returns a local directory holding the given snapshot version, downloading it from Cloud Storage if needed.
+    """
+    if not path.startswith("gs://"):
+        return os.path.join(path, info["prefix"]) if info.get("prefix") else path
+    directory = os.path.join(cache_dir, info["version"])
+    if not os.path.exists(os.path.join(directory, INDEX_FILE)):
+        os.makedirs(directory, exist_ok=True)
+        for name in SNAPSHOT_FILES:
+            get_gcs_blob(path, get_snapshot_file(info, name)).download_to_filename(os.path.join(directory, name))
+        # Written last, so an interrupted download is fetched again.
+        with open(os.path.join(directory, INDEX_FILE), "w") as f:
+            json.dump(info, f)
+    # Older versions stay readable while mapped; /tmp is memory, so free it.
+    for name in os.listdir(cache_dir):
+        if name != info["version"]:
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+    return directory
+
+_index: Optional[VectorIndex] = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+def get_vector_index(path: str = VECTOR_INDEX_PATH) -> VectorIndex:
+    """
+    Returns the snapshot index, loading it on first use.
+
+    At most every `VECTOR_INDEX_CHECK_INTERVAL` seconds, index.json is read
+    again and a newer snapshot published by an ingestion run is swapped in.
+
+    Args:
+        path: The gs:// or local snapshot path. Defaults to `VECTOR_INDEX_PATH`.
+
+    Returns:
+        The loaded index.
+
+    Raises:
+        FileNotFoundError: If no snapshot has been published.
+        ValueError: If the first snapshot loaded is inconsistent.
+    """
+    global _index, _checked_at
+    with _lock:
+        now = time.monotonic()
+        if _index is not None and now - _checked_at < VECTOR_INDEX_CHECK_INTERVAL:
+            return _index
+        _checked_at = now
+        try:
+            info = read_snapshot_info(path)
+        except Exception as e:
+            if _index is None:
+                raise
+            logging.error(f"Failed to check the vector index snapshot, keeping version {_index.version}: {e}")
+            return _index
+        if info is None:
+            if _index is None:
+                raise FileNotFoundError(f"No vector index snapshot at {path}")
+            return _index
+        if _index is None or info["version"] != _index.version:
+            start = time.monotonic()
+            try:
+                index = VectorIndex.load(fetch_snapshot(path, info))
+            except Exception as e:
+                if _index is None:
+                    raise
+                logging.error(f"Failed to load vector index {info['version']}, keeping version {_index.version}: {e}")
+                return _index
+            _index = index
+            logging.info(
+                f"Loaded vector index {_index.version}: {len(_index)} {info['dtype']} vectors "
+                f"in {time.monotonic() - start:.2f}s"
+            )
+        return _index
@@ -1 +1,459 @@
+"""
+Streaming answer-quality evaluation for golden sets.
 
+Reads a golden set (JSONL or CSV with `question`, `reference` and optionally
+`answer`) as a stream, fills in missing answers from cf_datastore_engines'
+`query_by_answer` or cf_vector_rag's `vs_qa_chain_controller`, and scores
+each row in a process pool:
+
+    exact_match   normalized string equality
+    token_f1      token-overlap F1
+    rouge_l       ROUGE-L F-measure over tokens
+    embedding     cosine similarity of local stub embeddings
+
+Rows the function fails to answer are scored with an empty answer and
+counted as `answer_errors` in the summary.
+
+Rows are scored in ordered chunks with a bounded number in flight, metrics
+are aggregated incrementally, and progress is checkpointed after every
+chunk so an interrupted run resumes where it stopped. Row results go to a
+CSV file, or to one Parquet file per chunk in a directory.
+
+Usage:
+    python main.py --input golden.jsonl --output scores.csv
+    python main.py --input golden.csv --target cf_datastore_engines --output scores --format parquet
+"""
+import os
+import re
+import sys
+import csv
+import json
+import math
+import string
+import hashlib
+import logging
+import argparse
+import importlib
+from collections import Counter, deque
+from concurrent import futures
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+FUNCTIONS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+METRICS = ("exact_match", "token_f1", "rouge_l", "embedding")
+RESULT_FIELDS = ["row", "question", "reference", "answer", "answer_error", *METRICS]
+HISTOGRAM_BUCKETS = 20
+EMBEDDING_DIM = 256
+
+def normalize(text: str) -> str:
+    text = (text or "").lower()
+    text = text.translate(str.maketrans("", "", string.punctuation))
+    text = re.sub(r"\b(a|an|the)\b", " ", text)
+    return " ".join(text.split())
+
+def tokenize(text: str) -> List[str]:
+    return normalize(text).split()
+
+def exact_match(answer: str, reference: str) -> float:
+    return float(normalize(answer) == normalize(reference))
+
+def token_f1(answer: str, reference: str) -> float:
+    answer_tokens, reference_tokens = tokenize(answer), tokenize(reference)
+    if not answer_tokens or not reference_tokens:
+        return float(answer_tokens == reference_tokens)
+    common = sum((Counter(answer_tokens) & Counter(reference_tokens)).values())
+    if not common:
+        return 0.0
+    precision = common / len(answer_tokens)
+    recall = common / len(reference_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+def rouge_l(answer: str, reference: str) -> float:
+    answer_tokens, reference_tokens = tokenize(answer), tokenize(reference)
+    if not answer_tokens or not reference_tokens:
+        return float(answer_tokens == reference_tokens)
+    # Longest common subsequence with a single rolling row.
+    previous = [0] * (len(reference_tokens) + 1)
+    for answer_token in answer_tokens:
+        current = [0]
+        for j, reference_token in enumerate(reference_tokens):
+            if answer_token == reference_token:
+                current.append(previous[j] + 1)
+            else:
+                current.append(max(previous[j + 1], current[j]))
+        previous = current
+    lcs = previous[-1]
+    if not lcs:
+        return 0.0
+    precision = lcs / len(answer_tokens)
+    recall = lcs / len(reference_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+def embed(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+    """
+    A local stand-in for an embedding model: hashed bag of words and bigrams.
+    """
+    vector = [0.0] * dim
+    tokens = tokenize(text)
+    for feature in tokens + [" ".join(pair) for pair in zip(tokens, tokens[1:])]:
+        digest = hashlib.md5(feature.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    return vector
+
+def embedding_similarity(answer: str, reference: str) -> float:
+    a, b = embed(answer), embed(reference)
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    if not norm:
+        return float(normalize(answer) == normalize(reference))
+    return sum(x * y for x, y in zip(a, b)) / norm
+
+def score_chunk(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Scores a chunk of rows. Runs in a worker process.
+    """
+    results = []
+    for row in rows:
+        answer, reference = row.get("answer") or "", row.get("reference") or ""
+        results.append({
+            "row": row["row"],
+            "question": row.get("question"),
+            "reference": reference,
+            "answer": answer,
+            "answer_error": bool(row.get("answer_error")),
+            "exact_match": exact_match(answer, reference),
+            "token_f1": token_f1(answer, reference),
+            "rouge_l": rouge_l(answer, reference),
+            "embedding": embedding_similarity(answer, reference),
+        })
+    return results
+
+class RunningMetric:
+    """
+    Constant-memory mean, variance, min, max and histogram of a [0, 1] metric.
+    """
+
+    def __init__(self, state: Optional[Dict[str, Any]] = None):
+        state = state or {}
+        self.count = state.get("count", 0)
+        self.mean = state.get("mean", 0.0)
+        self.m2 = state.get("m2", 0.0)
+        self.min = state.get("min")
+        self.max = state.get("max")
+        self.histogram = state.get("histogram", [0] * HISTOGRAM_BUCKETS)
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        bucket = min(int(max(value, 0.0) * HISTOGRAM_BUCKETS), HISTOGRAM_BUCKETS - 1)
+        self.histogram[bucket] += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Approximates a quantile as the upper edge of the bucket that holds it.
+        """
+        if not self.count:
+            return None
+        seen = 0
+        for i, bucket_count in enumerate(self.histogram):
+            seen += bucket_count
+            if seen >= q * self.count:
+                return (i + 1) / HISTOGRAM_BUCKETS
+        return 1.0
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "count": self.count, "mean": self.mean, "m2": self.m2,
+            "min": self.min, "max": self.max, "histogram": self.histogram,
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": round(self.mean, 4),
+            "std": round(math.sqrt(self.m2 / self.count), 4) if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+        }
+
+class Checkpoint:
+    """
+    The number of rows committed so far and the aggregate metrics, saved atomically.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows_done = 0
+        self.chunks_done = 0
+        self.answer_errors = 0
+        self.metrics = {metric: RunningMetric() for metric in METRICS}
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.rows_done = state["rows_done"]
+            self.chunks_done = state["chunks_done"]
+            self.answer_errors = state.get("answer_errors", 0)
+            self.metrics = {
+                metric: RunningMetric(state["metrics"].get(metric)) for metric in METRICS
+            }
+
+    def add(self, results: List[Dict[str, Any]]):
+        for result in results:
+            for metric in METRICS:
+                self.metrics[metric].add(result[metric])
+            self.answer_errors += result["answer_error"]
+        self.rows_done += len(results)
+        self.chunks_done += 1
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "rows_done": self.rows_done,
+                "chunks_done": self.chunks_done,
+                "answer_errors": self.answer_errors,
+                "metrics": {metric: m.state() for metric, m in self.metrics.items()},
+            }, f)
+        os.replace(tmp_path, self.path)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "rows": self.rows_done,
+            "answer_errors": self.answer_errors,
+            "metrics": {metric: m.summary() for metric, m in self.metrics.items()},
+        }
+
+class CsvWriter:
+    """
+    Appends row results to a CSV file, truncating rows past the checkpoint.
+    """
+
+    def __init__(self, path: str, checkpoint: Checkpoint):
+        if checkpoint.rows_done and os.path.exists(path):
+            self._truncate(path, checkpoint.rows_done)
+        else:
+            with open(path, "w", newline="") as f:
+                csv.DictWriter(f, fieldnames=RESULT_FIELDS).writeheader()
+        self.path = path
+
+    @staticmethod
+    def _truncate(path: str, rows_done: int):
+        # Drop rows written after the last checkpoint by an interrupted run.
+        tmp_path = f"{path}.tmp"
+        with open(path, newline="") as src, open(tmp_path, "w", newline="") as dst:
+            reader = csv.reader(src)
+            writer = csv.writer(dst)
+            for i, line in enumerate(reader):
+                if i > rows_done:
+                    break
+                writer.writerow(line)
+        os.replace(tmp_path, path)
+
+    def write(self, chunk_index: int, results: List[Dict[str, Any]]):
+        with open(self.path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            writer.writerows(results)
+
+class ParquetWriter:
+    """
+    Writes each chunk of row results to its own Parquet file in a directory.
+    """
+
+    def __init__(self, path: str, checkpoint: Checkpoint):
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.parquet = pyarrow.parquet
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # Drop parts written after the last checkpoint by an interrupted run.
+        for name in os.listdir(path):
+            match = re.fullmatch(r"part-(\d+)\.parquet", name)
+            if match and int(match.group(1)) >= checkpoint.chunks_done:
+                os.remove(os.path.join(path, name))
+
+    def write(self, chunk_index: int, results: List[Dict[str, Any]]):
+        table = self.pyarrow.Table.from_pylist(results)
+        self.parquet.write_table(table, os.path.join(self.path, f"part-{chunk_index:06d}.parquet"))
+
+def read_rows(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Streams golden set rows from a JSONL or CSV file.
+    """
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for i, row in enumerate(rows):
+            row["row"] = i
+            yield row
+
+def build_answerer(target: str) -> Callable[[str], str]:
+    """
+    Builds a function that answers a question with one of the Cloud Functions.
+
+    Args:
+        target (str): "cf_datastore_engines" or "cf_vector_rag".
+
+    Returns:
+        Callable[[str], str]: Returns the answer text for a question.
+
+    Raises:
+        ValueError: From the returned function, if the function failed to answer.
+    """
+    sys.path.insert(0, os.path.join(FUNCTIONS_DIR, target))
+    if target == "cf_datastore_engines":
+        routers = importlib.import_module("routers")
+
+        def answer_with_datastore(question: str) -> str:
+            # query_by_answer returns an empty dictionary when the Answer API fails.
+            response = routers.query_by_answer(question)
+            if not response:
+                raise ValueError("the data store returned no answer")
+            return response.get("answer", "")
+        return answer_with_datastore
+    if target == "cf_vector_rag":
+        routes = importlib.import_module("routes")
+
+        def answer_with_vector_rag(question: str) -> str:
+            # vs_qa_chain_controller returns an error dictionary when the chain call fails,
+            # and raises if the retriever, the model or the query embedding fails first.
+            response = routes.vs_qa_chain_controller({"text": question})
+            if not isinstance(response, str):
+                raise ValueError(f"the chain returned {response!r}")
+            return response
+        return answer_with_vector_rag
+    raise ValueError(f"Unknown target: {target}")
+
+def fill_answers(
+    chunks: Iterator[List[Dict[str, Any]]],
+    answerer: Callable[[str], str],
+    workers: int,
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Fills in missing answers concurrently, one chunk at a time.
+
+    A row the function fails to answer gets an empty answer and is flagged
+    with answer_error, so it is counted apart from wrong answers.
+    """
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk in chunks:
+            missing = [row for row in chunk if not row.get("answer")]
+
+            def answer(row: Dict[str, Any]):
+                try:
+                    row["answer"] = answerer(row.get("question", ""))
+                except Exception as e:
+                    logging.error(f"Failed to answer row {row['row']}: {e}")
+                    row["answer"] = ""
+                    row["answer_error"] = True
+            list(executor.map(answer, missing))
+            yield chunk
+
+def chunked(rows: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def evaluate(
+    input_path: str,
+    output_path: str,
+    output_format: str = "csv",
+    checkpoint_path: Optional[str] = None,
+    target: Optional[str] = None,
+    processes: Optional[int] = None,
+    chunk_size: int = 500,
+    max_in_flight: Optional[int] = None,
+    answer_workers: int = 8,
+) -> Dict[str, Any]:
+    """
+    Scores a golden set, resuming from the checkpoint if one exists.
+
+    Chunks are submitted to the process pool with at most `max_in_flight`
+    outstanding and committed in input order, so the checkpoint always
+    marks a prefix of the input that is fully written.
+
+    Args:
+        input_path (str): The golden set, JSONL or CSV.
+        output_path (str): The CSV file, or the Parquet directory.
+        output_format (str, optional): "csv" or "parquet". Defaults to "csv".
+        checkpoint_path (Optional[str]): Defaults to `<output_path>.checkpoint.json`.
+        target (Optional[str]): The function used to answer rows without an answer. Defaults to None.
+        processes (Optional[int]): Scoring processes. Defaults to the CPU count.
+        chunk_size (int, optional): Rows per chunk. Defaults to 500.
+        max_in_flight (Optional[int]): Chunks outstanding. Defaults to twice the processes.
+        answer_workers (int, optional): Concurrent answer requests. Defaults to 8.
+
+    Returns:
+        Dict[str, Any]: The aggregate metrics.
+    """
+    checkpoint = Checkpoint(checkpoint_path or f"{output_path.rstrip(os.sep)}.checkpoint.json")
+    if checkpoint.rows_done:
+        logging.info(f"Resuming after {checkpoint.rows_done} rows")
+    writer_cls = ParquetWriter if output_format == "parquet" else CsvWriter
+    writer = writer_cls(output_path, checkpoint)
+
+    rows = (row for row in read_rows(input_path) if row["row"] >= checkpoint.rows_done)
+    chunks = chunked(rows, chunk_size)
+    if target:
+        chunks = fill_answers(chunks, build_answerer(target), answer_workers)
+
+    processes = processes or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * processes
+    chunk_index = checkpoint.chunks_done
+    pending = deque()
+
+    def commit(future: futures.Future, index: int):
+        results = future.result()
+        writer.write(index, results)
+        checkpoint.add(results)
+        checkpoint.save()
+
+    with futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        for chunk in chunks:
+            pending.append((executor.submit(score_chunk, chunk), chunk_index))
+            chunk_index += 1
+            if len(pending) >= max_in_flight:
+                commit(*pending.popleft())
+        while pending:
+            commit(*pending.popleft())
+    return checkpoint.summary()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", required=True, help="Golden set, JSONL or CSV.")
+    parser.add_argument("--output", required=True, help="CSV file, or a directory for Parquet.")
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    parser.add_argument("--checkpoint")
+    parser.add_argument("--target", choices=("cf_datastore_engines", "cf_vector_rag"),
+                        help="Answer rows that have no answer with this function.")
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--answer-workers", type=int, default=8)
+    parser.add_argument("--summary", help="Write the aggregate metrics to this JSON file.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    summary = evaluate(
+        args.input, args.output, output_format=args.format, checkpoint_path=args.checkpoint,
+        target=args.target, processes=args.processes, chunk_size=args.chunk_size,
+        answer_workers=args.answer_workers,
+    )
+    print(json.dumps(summary, indent=2))
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    main()
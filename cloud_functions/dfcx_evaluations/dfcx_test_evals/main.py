@@ -1 +1,391 @@
+"""
+Replay load test and latency benchmark for the Cloud Functions in this repo.
 
+Reads a JSONL file of Dialogflow CX webhook requests, one per line:
+
+    {"path": "/answer", "body": {"text": "what are the plans?"}}
+
+and drives a function's Flask app (or its `hello_http` / `my_function`
+entry point) at a target concurrency or request rate. Discovery Engine and
+Vertex AI are replaced by fakes with configurable latency distributions, so
+runs are offline and repeatable. Throughput and p50/p90/p99 latency per
+route and per Server-Timing stage are printed and saved as JSON for comparing
+runs.
+
+Usage:
+    python main.py --target cf_datastore_engines --input requests.jsonl --concurrency 16
+    python main.py --target cf_datastore_engines --input requests.jsonl --rps 50 --requests 2000 \\
+        --latency answer=lognormal:0.4:0.6 --latency search=uniform:0.05:0.2 --output run.json
+    python main.py --compare baseline.json run.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import enum
+import random
+import logging
+import argparse
+import importlib
+import threading
+from types import SimpleNamespace
+from concurrent import futures
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+FUNCTIONS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+class LatencyModel:
+    """
+    A latency distribution for a fake backend call.
+
+    Specs have the form "fixed:<s>", "uniform:<low>:<high>" or
+    "lognormal:<median>:<sigma>", in seconds.
+    """
+
+    def __init__(self, spec: str = "fixed:0"):
+        kind, *params = spec.split(":")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(param) for param in params]
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return random.uniform(self.params[0], self.params[1])
+        median, sigma = self.params
+        return random.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+class FakeBackend:
+    """
+    Sleeps for a sampled latency inside a timing span of the target function.
+    """
+
+    def __init__(self, latencies: Dict[str, LatencyModel]):
+        self.latencies = latencies
+        self.span = None
+
+    def call(self, name: str, stage: str):
+        """
+        Sleeps for a latency sampled from the model for name.
+
+        Args:
+            name (str): The latency model, e.g. "search".
+            stage (str): The span the call is timed as, named like the real call's span, e.g. "rpc".
+        """
+        latency = self.latencies.get(name, LatencyModel()).sample()
+        with self.span(stage):
+            time.sleep(latency)
+
+class _State(enum.IntEnum):
+    STATE_UNSPECIFIED = 0
+    IN_PROGRESS = 1
+    COMPLETED = 2
+
+class FakeEngines:
+    """
+    Stands in for Engines, returning canned Discovery Engine responses.
+    """
+
+    def __init__(self, backend: FakeBackend):
+        self.backend = backend
+
+    def _search_results(self, query: str, total_results: int):
+        self.backend.call("search", "rpc")
+        return [
+            SimpleNamespace(
+                id=f"doc-{i}",
+                model_scores={},
+                document=SimpleNamespace(derived_struct_data={
+                    "extractive_answers": [{"content": f"Extractive answer {i} for {query}"}]
+                }),
+            )
+            for i in range(total_results)
+        ]
+
+    def query_by_search(self, search_config: Dict[str, Any], total_results: int = 10, deadline=None):
+        return self._search_results(search_config.get("query"), total_results)
+
+    def query_by_profile(self, profile, query: str, total_results: int = None, deadline=None, **request_fields):
+        return self._search_results(query, total_results or 1)
+
+    def query_by_answer(self, answer_config: Dict[str, Any], total_results: int = 10,
+                        related_question: bool = False, deadline=None):
+        self.backend.call("answer", "rpc")
+        query = answer_config.get("query")
+        return SimpleNamespace(
+            answer=SimpleNamespace(
+                answer_text=f"Answer for {query}",
+                related_questions=[f"{query} related {i}" for i in range(3)] if related_question else [],
+            ),
+            session=SimpleNamespace(name="projects/p/sessions/fake", state=_State.IN_PROGRESS),
+        )
+
+    def query_by_conversation(self, conv_config: Dict[str, Any], conversation=None, deadline=None):
+        self.backend.call("conversation", "rpc")
+        query = conv_config.get("query")
+        return SimpleNamespace(
+            reply=SimpleNamespace(
+                reply=f"Reply for {query}",
+                summary=SimpleNamespace(summary_text=f"Summary for {query}"),
+            ),
+            conversation=SimpleNamespace(
+                name="projects/p/conversations/fake",
+                state=_State.IN_PROGRESS,
+                user_pseudo_id="",
+                messages=[],
+                start_time=None,
+                end_time=None,
+            ),
+        )
+
+def load_target(target: str, backend: FakeBackend):
+    """
+    Imports a function's main module and swaps its backends for fakes.
+
+    Args:
+        target (str): The function directory under cloud_functions, e.g. "cf_datastore_engines".
+        backend (FakeBackend): The fake backend used by the patched modules.
+
+    Returns:
+        module: The function's main module.
+    """
+    sys.path.insert(0, os.path.join(FUNCTIONS_DIR, target))
+    if target == "cf_vector_rag":
+        # my_function initializes Vertex AI on every request.
+        sys.modules["vertexai"] = SimpleNamespace(init=lambda **kwargs: None)
+    main = importlib.import_module("main")
+    # Fake calls are timed like the calls they replace, so they show in Server-Timing.
+    backend.span = importlib.import_module("timing").span
+    if target == "cf_datastore_engines":
+        routers = importlib.import_module("routers")
+        fake_engines = FakeEngines(backend)
+        routers.get_engines = lambda: fake_engines
+        routers.get_search_profile = lambda *args, **kwargs: SimpleNamespace(serving_config="fake", total_results=1)
+        routers.build_session_to_json = lambda conversation: json.dumps({"name": conversation.name})
+    elif target == "cf_vector_rag":
+        def fake_qa_chain(data: Dict[str, Any]):
+            backend.call("retrieval", "retrieval")
+            backend.call("llm", "chain")
+            return f"Answer for {data.get('text')}"
+        main.vs_qa_chain_controller = fake_qa_chain
+    return main
+
+def build_sender(main, entry: str) -> Callable[[Dict[str, Any]], Tuple[int, Optional[str]]]:
+    """
+    Builds a function that sends one webhook request to the target.
+
+    Args:
+        main (module): The function's main module.
+        entry (str): "app" for the Flask test client, or the name of an entry point such as "hello_http".
+
+    Returns:
+        Callable[[Dict[str, Any]], Tuple[int, Optional[str]]]: Sends a request record and returns its
+            HTTP status code and Server-Timing header.
+    """
+    if entry == "app":
+        client = main.app.test_client()
+
+        def send(record: Dict[str, Any]) -> Tuple[int, Optional[str]]:
+            response = client.open(
+                record.get("path", "/"), method=record.get("method", "POST"), json=record.get("body")
+            )
+            response.get_data()
+            return response.status_code, response.headers.get("Server-Timing")
+        return send
+
+    entry_point = getattr(main, entry)
+
+    def send(record: Dict[str, Any]) -> Tuple[int, Optional[str]]:
+        request = SimpleNamespace(
+            path=record.get("path", "/"),
+            method=record.get("method", "POST"),
+            headers={"Content-Type": "application/json"},
+            data=json.dumps(record.get("body")).encode("utf-8"),
+        )
+        response = entry_point(request)
+        headers = getattr(response, "headers", {})
+        return getattr(response, "status_code", 200), headers.get("Server-Timing")
+    return send
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """
+    Parses a Server-Timing header into seconds per stage.
+
+    Args:
+        header (Optional[str]): A header such as "rpc;dur=120.50, total;dur=123.10".
+
+    Returns:
+        Dict[str, float]: Seconds per stage, empty if there is no header.
+    """
+    stages = {}
+    for metric in (header or "").split(","):
+        name, *params = [part.strip() for part in metric.split(";")]
+        for param in params:
+            key, _, value = param.partition("=")
+            if name and key == "dur":
+                stages[name] = float(value) / 1000
+    return stages
+
+def read_requests(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    Nearest-rank percentile of a list of values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 2) if values else None,
+        "p50_ms": round(percentile(values, 0.5) * 1000, 2) if values else None,
+        "p90_ms": round(percentile(values, 0.9) * 1000, 2) if values else None,
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2) if values else None,
+    }
+
+def run_load(
+    send: Callable[[Dict[str, Any]], Tuple[int, Optional[str]]],
+    records: List[Dict[str, Any]],
+    total: int,
+    concurrency: int = 8,
+    rps: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Replays records against the target and measures latency.
+
+    With rps set, requests start on a fixed schedule (open loop) and
+    latency includes any queueing delay; otherwise `concurrency` workers
+    send requests back to back (closed loop). The per-stage latencies are
+    the stages the function reports in its Server-Timing header.
+
+    Args:
+        send (Callable[[Dict[str, Any]], Tuple[int, Optional[str]]]): Sends one request.
+        records (List[Dict[str, Any]]): The webhook requests, replayed in a cycle.
+        total (int): Number of requests to send.
+        concurrency (int, optional): Worker threads. Defaults to 8.
+        rps (Optional[float]): Target request rate. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: Throughput plus latency summaries per route and per stage.
+    """
+    samples = []
+    samples_lock = threading.Lock()
+
+    def run_one(record: Dict[str, Any], scheduled_at: Optional[float]):
+        scheduled_at = scheduled_at or time.monotonic()
+        status, server_timing = None, None
+        try:
+            status, server_timing = send(record)
+        except Exception as e:
+            logging.error(f"Request to {record.get('path')} failed: {e}")
+        elapsed = time.monotonic() - scheduled_at
+        stages = parse_server_timing(server_timing)
+        with samples_lock:
+            samples.append((record.get("path", "/"), elapsed, status, stages))
+
+    start = time.monotonic()
+    workers = concurrency if not rps else max(concurrency, int(rps * 10))
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for i in range(total):
+            record = records[i % len(records)]
+            if rps:
+                scheduled_at = start + i / rps
+                delay = scheduled_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(run_one, record, scheduled_at)
+            else:
+                executor.submit(run_one, record, None)
+    wall = time.monotonic() - start
+    return build_report(samples, wall)
+
+def build_report(samples: List, wall: float) -> Dict[str, Any]:
+    routes: Dict[str, Dict[str, Any]] = {}
+    for path, elapsed, status, stages in samples:
+        route = routes.setdefault(path, {"latencies": [], "errors": 0, "stages": {}})
+        route["latencies"].append(elapsed)
+        if status is None or status >= 400:
+            route["errors"] += 1
+        for stage, stage_elapsed in stages.items():
+            route["stages"].setdefault(stage, []).append(stage_elapsed)
+    return {
+        "requests": len(samples),
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(samples) / wall, 2) if wall else None,
+        "routes": {
+            path: dict(
+                summarize(route["latencies"]),
+                errors=route["errors"],
+                stages={stage: summarize(values) for stage, values in route["stages"].items()},
+            )
+            for path, route in routes.items()
+        },
+    }
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    lines = [f"throughput_rps: {baseline.get('throughput_rps')} -> {current.get('throughput_rps')}"]
+    for path, route in current["routes"].items():
+        previous = baseline["routes"].get(path, {})
+        for key in ("p50_ms", "p90_ms", "p99_ms"):
+            lines.append(f"{path} {key}: {previous.get(key)} -> {route.get(key)}")
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="cf_datastore_engines")
+    parser.add_argument("--entry", default="app", help='"app" for the Flask app or an entry point such as hello_http.')
+    parser.add_argument("--input", help="JSONL file of webhook requests.")
+    parser.add_argument("--requests", type=int, help="Requests to send. Defaults to one pass over the input.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rps", type=float)
+    parser.add_argument("--latency", action="append", default=[],
+                        help="Fake backend latency as <stage>=<spec>, e.g. answer=lognormal:0.4:0.6.")
+    parser.add_argument("--cache", action="store_true", help="Keep the response cache on for the run.")
+    parser.add_argument("--output", help="Write the report to this JSON file.")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"))
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            print("\n".join(compare_reports(json.load(f), json.load(g))))
+        return
+    if not args.input:
+        parser.error("--input is required")
+
+    if not args.cache:
+        os.environ["cache_enabled"] = "false"
+    latencies = {}
+    for spec in args.latency:
+        stage, model = spec.split("=", 1)
+        latencies[stage] = LatencyModel(model)
+    main_module = load_target(args.target, FakeBackend(latencies))
+    send = build_sender(main_module, args.entry)
+    records = read_requests(args.input)
+    report = run_load(
+        send, records, total=args.requests or len(records),
+        concurrency=args.concurrency, rps=args.rps,
+    )
+    report["config"] = {
+        "target": args.target,
+        "entry": args.entry,
+        "concurrency": args.concurrency,
+        "rps": args.rps,
+        "cache": args.cache,
+        "latency": {stage: model.spec for stage, model in latencies.items()},
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
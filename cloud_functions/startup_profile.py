@@ -0,0 +1,163 @@
+"""
+Reports the import time of each Cloud Function's entry module.
+
+Every function directory is imported in a fresh interpreter with
+`python -X importtime`, so the numbers match a cold start. The results can
+be saved as JSON and compared with a previous run to catch regressions.
+
+Usage:
+    python startup_profile.py                              # all functions
+    python startup_profile.py cf_datastore_engines -n 5    # median of 5 runs
+    python startup_profile.py --output startup.json
+    python startup_profile.py --baseline startup.json --threshold 0.2
+
+Exits with status 1 if a function fails to import or regresses past the baseline.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Dict, Any, List
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FUNCTIONS = ["cf_datastore_engines", "cf_vector_rag", "cf_flask_routing"]
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def profile_once(function_dir: str, entry_module: str = "main") -> Dict[str, Any]:
+    """
+    Imports a function's entry module once and parses the -X importtime output.
+
+    Args:
+        function_dir (str): Path to the Cloud Function directory.
+        entry_module (str, optional): The module to import. Defaults to "main".
+
+    Returns:
+        Dict[str, Any]: Total import time in ms, top-level module times in ms and any import error.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {entry_module}"],
+        cwd=function_dir,
+        capture_output=True,
+        text=True,
+    )
+    lines = []
+    for line in proc.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            depth = (len(match.group(3)) - 1) // 2
+            lines.append((depth, match.group(4), int(match.group(2)) / 1000))
+
+    # -X importtime prints children before their parent, so the entry module's
+    # subtree is everything after the interpreter's own top-level imports.
+    end = next(
+        (i for i, (depth, module, _) in enumerate(lines) if depth == 0 and module == entry_module),
+        len(lines),
+    )
+    start = max((i + 1 for i, line in enumerate(lines[:end]) if line[0] == 0), default=0)
+    modules: Dict[str, float] = {}
+    for depth, module, cumulative_ms in lines[start:end]:
+        if depth == 1:
+            modules[module] = modules.get(module, 0.0) + cumulative_ms
+    total_ms = lines[end][2] if end < len(lines) else sum(modules.values())
+
+    error = None
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1]
+    return {
+        "total_ms": total_ms,
+        "modules": modules,
+        "error": error,
+    }
+
+def profile_function(function_dir: str, runs: int = 3, top: int = 15) -> Dict[str, Any]:
+    """
+    Profiles a function's cold import several times and keeps the medians.
+
+    Args:
+        function_dir (str): Path to the Cloud Function directory.
+        runs (int, optional): Number of fresh interpreters to start. Defaults to 3.
+        top (int, optional): Number of slowest modules to keep. Defaults to 15.
+
+    Returns:
+        Dict[str, Any]: Median total import time, the slowest modules and any import error.
+    """
+    samples = [profile_once(function_dir) for _ in range(runs)]
+    module_names = set().union(*(sample["modules"] for sample in samples))
+    modules = {
+        name: statistics.median(sample["modules"].get(name, 0.0) for sample in samples)
+        for name in module_names
+    }
+    slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "total_ms": statistics.median(sample["total_ms"] for sample in samples),
+        "modules": dict(slowest),
+        "error": samples[-1]["error"],
+    }
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Compares import times with a baseline run.
+
+    Args:
+        results (Dict[str, Any]): The current results keyed by function.
+        baseline (Dict[str, Any]): A previous run keyed by function.
+        threshold (float): Allowed relative slowdown, e.g. 0.2 for 20%.
+
+    Returns:
+        List[str]: A message for every function that regressed or failed to import.
+    """
+    regressions = []
+    for function, result in results.items():
+        if result["error"]:
+            # A failed import stops early, so its time would pass for a speedup.
+            regressions.append(f"{function}: import failed: {result['error']}")
+            continue
+        previous = baseline.get(function)
+        if not previous or not previous["total_ms"]:
+            continue
+        change = (result["total_ms"] - previous["total_ms"]) / previous["total_ms"]
+        if change > threshold:
+            regressions.append(
+                f"{function}: {previous['total_ms']:.1f} ms -> {result['total_ms']:.1f} ms (+{change:.0%})"
+            )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("functions", nargs="*", default=FUNCTIONS)
+    parser.add_argument("-n", "--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Fail if slower than this JSON file.")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = {}
+    for function in args.functions:
+        result = profile_function(os.path.join(ROOT, function), runs=args.runs, top=args.top)
+        results[function] = result
+        print(f"{function}: {result['total_ms']:.1f} ms")
+        if result["error"]:
+            print(f"  import failed: {result['error']}")
+        for module, elapsed in result["modules"].items():
+            print(f"  {elapsed:10.1f} ms  {module}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+    if any(result["error"] for result in results.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()